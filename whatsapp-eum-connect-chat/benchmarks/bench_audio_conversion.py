@@ -0,0 +1,141 @@
+"""
+Voice note conversion latency, in-process (AUDIO_CONVERSION_MODE=local)
+versus the convert_to_wav lambda (remote).
+
+Always measured, with ffmpeg on the PATH:
+  local  convert_bytes_to_wav on the note already in memory
+  file   the convert_to_wav lambda's own ffmpeg step (temp files in and out),
+         i.e. the remote path without the invoke and the S3 round trips
+
+Both outputs are compared byte for byte. With --function and --bucket the real
+remote path is timed too: upload the note, invoke the deployed converter, and
+download the WAV, as whatsapp_event_handler does.
+
+    python benchmarks/bench_audio_conversion.py [--runs 5] [--function ARN --bucket NAME] [file.ogg ...]
+
+Without files, Opus notes of 5, 15, 30 and 60 seconds are generated with ffmpeg.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import shutil
+import statistics
+import subprocess  # nosec B404 - benchmark only, fixed argv
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+CODE_DIR = os.path.join(os.path.dirname(__file__), "..", "lambdas", "code")
+sys.path.insert(0, os.path.abspath(os.path.join(CODE_DIR, "whatsapp_event_handler")))
+
+import audio_converter  # noqa: E402
+from audio_converter import convert_bytes_to_wav  # noqa: E402
+
+
+def load_converter_lambda():
+    # both lambdas have a lambda_function module, load this one under its own name
+    path = os.path.abspath(os.path.join(CODE_DIR, "convert_to_wav", "lambda_function.py"))
+    spec = importlib.util.spec_from_file_location("convert_to_wav_lambda", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_note(seconds):
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+        "-c:a", "libopus", "-b:a", "24k", "-ac", "1", "-f", "ogg", "pipe:1",
+    ]
+    return subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout  # nosec B603
+
+
+def file_convert(converter, data):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ogg = os.path.join(tmp_dir, "voice.ogg")
+        wav = os.path.join(tmp_dir, "voice.wav")
+        with open(ogg, "wb") as f:
+            f.write(data)
+        # the lambda prints ffmpeg's full output
+        with contextlib.redirect_stdout(io.StringIO()):
+            converted = converter.convert_ogg_to_wav(ogg, wav)
+        if not converted:
+            return None
+        with open(wav, "rb") as f:
+            return f.read()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def remote_convert(s3, bucket, data):
+    key = f"benchmarks/{uuid.uuid4()}/voice.ogg"
+    s3.put_object(Bucket=bucket, Key=key, Body=data)
+    try:
+        start = time.perf_counter()
+        converted = audio_converter.convert_to_wav(f"s3://{bucket}/{key}")
+        wav = s3.get_object(Bucket=bucket, Key=converted.split("/", 3)[3])["Body"].read() if converted else None
+        elapsed = time.perf_counter() - start
+    finally:
+        s3.delete_object(Bucket=bucket, Key=key)
+        s3.delete_object(Bucket=bucket, Key=key[:-len("ogg")] + "wav")
+    return wav, elapsed
+
+
+def timed(fn, runs):
+    times = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--function", help="convert_to_wav function name or ARN, to time the remote path")
+    parser.add_argument("--bucket", help="bucket the remote path reads and writes")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg not found on PATH, nothing to measure")
+        return
+
+    remote = bool(args.function and args.bucket)
+    s3 = None
+    if remote:
+        import boto3
+        os.environ["CONVERT_WAV_HANDLER"] = args.function
+        s3 = boto3.client("s3")
+
+    if args.files:
+        notes = [(os.path.basename(path), open(path, "rb").read()) for path in args.files]
+    else:
+        notes = [(f"generated {s}s", generate_note(s)) for s in (5, 15, 30, 60)]
+
+    converter = load_converter_lambda()
+
+    header = f"{'note':<16}{'KB':>6}{'local ms':>10}{'file ms':>9}{'same':>6}"
+    if remote:
+        header += f"{'remote ms':>11}{'same':>6}"
+    print(header)
+    for name, data in notes:
+        local_wav, local_s = timed(lambda: convert_bytes_to_wav(data), args.runs)
+        file_wav, file_s = timed(lambda: file_convert(converter, data), args.runs)
+        line = f"{name:<16}{len(data) / 1024:>6.0f}{local_s * 1000:>10.1f}{file_s * 1000:>9.1f}{str(local_wav == file_wav):>6}"
+        if remote:
+            remote_wav, remote_s = remote_convert(s3, args.bucket, data)
+            line += f"{remote_s * 1000:>11.1f}{str(local_wav == remote_wav):>6}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Per-message client overhead in whatsapp_event_handler, before and after the
+shared client registry (aws_clients.py).
+
+No AWS calls are made: only client construction is measured.
+
+    python benchmarks/bench_client_registry.py [messages]
+"""
+import os
+import sys
+import time
+
+import boto3
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("TABLE_NAME", "bench")
+
+HANDLER_DIR = os.path.join(os.path.dirname(__file__), "..", "lambdas", "code", "whatsapp_event_handler")
+sys.path.insert(0, os.path.abspath(HANDLER_DIR))
+
+from connect_chat_service import ChatService  # noqa: E402
+from connections_service import ConnectionsService  # noqa: E402
+from whatsapp import WhatsappMessage  # noqa: E402
+
+
+PHONE = {"arn": "arn:aws:social-messaging:us-east-1:123456789012:phone-number-id/abc", "metaPhoneNumberId": "1"}
+
+
+def text_message(i):
+    return {"from": "5215550000000", "id": f"wamid.{i}", "type": "text", "text": {"body": f"hello {i}"}}
+
+
+def before(messages):
+    # Baseline: one ConnectionsService + ChatService per invocation and two
+    # clients per WhatsappMessage, all built from scratch.
+    boto3.resource("dynamodb").Table("bench")
+    boto3.client("connectparticipant")
+    boto3.client("connect")
+    for i in range(messages):
+        boto3.client("socialmessaging")
+        boto3.client("s3")
+
+
+def after(messages):
+    ConnectionsService("bench")
+    ChatService(instance_id="i", contact_flow_id="f")
+    for i in range(messages):
+        WhatsappMessage(PHONE, text_message(i), {})
+
+
+def timed(fn, messages, rounds):
+    elapsed = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(messages)
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    rounds = 3
+
+    # first call pays the one-off container cost (loading service models)
+    cold = timed(after, messages, 1)
+    baseline = timed(before, messages, rounds)
+    warm = timed(after, messages, rounds)
+
+    print(f"messages per invocation: {messages}")
+    print(f"before:           {baseline * 1000:9.2f} ms  ({baseline / messages * 1000:.3f} ms/message)")
+    print(f"after (cold):     {cold * 1000:9.2f} ms  ({cold / messages * 1000:.3f} ms/message)")
+    print(f"after (warm):     {warm * 1000:9.2f} ms  ({warm / messages * 1000:.3f} ms/message)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Inbound buffering latency, fixed tumbling window versus per-sender debounce
+(message_aggregator/debounce.py).
+
+Simulates one stream shard on a virtual clock. Customers send bursts of 1 to 4
+messages, a second or two apart. Lambda invokes the aggregator only when records
+are waiting (a batching window after the first one) and at the end of every
+tumbling window; invocations of a shard run one after another. Nothing runs
+between them, so on a quiet shard a sender may only be released at the end of
+the window, unless the invocation lingers for senders about to turn quiet (as
+message_aggregator/lambda_function.py does, checking the table for messages not
+in its batch yet). Prints per-message buffering
+latency and how many bursts were still delivered as a single group, for each
+shard traffic rate.
+
+    python benchmarks/bench_debounce.py [--bursts 2000] [--rates 0.02 0.1 0.5] [--window 20] [--gap 3]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+
+AGGREGATOR_DIR = os.path.join(os.path.dirname(__file__), "..", "lambdas", "code", "message_aggregator")
+sys.path.insert(0, os.path.abspath(AGGREGATOR_DIR))
+
+from debounce import release_quiet_senders, next_release_at  # noqa: E402
+
+
+def workload(bursts, rate, rng):
+    """[(arrival, record)]: bursts start as a Poisson process of `rate` per second."""
+    arrivals = []
+    clock = 0.0
+    for burst in range(bursts):
+        clock += rng.expovariate(rate)
+        sender = f"1415{rng.randrange(bursts):07d}"
+        t = clock
+        for part in range(rng.choice((1, 1, 1, 2, 2, 3, 4))):
+            t += rng.uniform(0.3, 2.0) if part else 0
+            arrivals.append((t, {"from": sender, "id": f"{burst}.{part}", "burst": burst,
+                                 "metadata": {"phone_number_id": "503650672828631"}}))
+    return sorted(arrivals, key=lambda a: a[0])
+
+
+def simulate(arrivals, window, batching_window, handler):
+    """Run the shard, returns {message id: dispatched at} and the dispatched groups."""
+    dispatched, groups = {}, []
+    state, index = {}, 0
+    by_sender = {}
+    for arrival, record in arrivals:
+        by_sender.setdefault(record["from"], []).append(arrival)
+
+    def written(sender, after, now):
+        # what the aggregator finds in the table: the sender's messages not in a batch yet
+        return any(after < arrival <= now for arrival in by_sender[sender])
+
+    window_end = window
+    busy_until = 0.0
+    while index < len(arrivals) or state.get("pending"):
+        # next invocation: a batching window after the first waiting record, or the end of the window,
+        # never before the previous invocation returned
+        first_waiting = arrivals[index][0] if index < len(arrivals) and arrivals[index][0] < window_end else None
+        invoke_at = window_end if first_waiting is None else min(first_waiting + batching_window, window_end)
+        invoke_at = max(invoke_at, busy_until)
+        final = invoke_at >= window_end
+
+        batch = []
+        while index < len(arrivals) and arrivals[index][0] <= invoke_at and arrivals[index][0] < window_end:
+            batch.append(arrivals[index])
+            index += 1
+
+        released, state, busy_until = handler(state, batch, invoke_at, final, written)
+        released_groups = {}
+        for at, record in released:
+            released_groups.setdefault(record["from"], []).append(record)
+            dispatched[record["id"]] = at
+        groups.extend(released_groups.values())
+
+        if final:
+            state = {}
+            window_end += window
+    return dispatched, groups
+
+
+def fixed_window(state, batch, now, final, written):
+    # legacy: everything in the batch goes out when the aggregator runs
+    return [(now, record) for _, record in batch], state, now
+
+
+def debounced(gap, window, linger):
+    def handler(state, batch, now, final, written):
+        released = []
+        linger_until = now + gap
+        while True:
+            ready, state = release_quiet_senders(state, batch, now, flush=final, quiet_gap=gap, max_wait=window)
+            released += [(now, record) for record in ready]
+            wake = None if final or not linger else next_release_at(state, now, gap, window)
+            if wake is None or wake > linger_until:
+                return released, state, now
+            batch, now = [], wake
+            for buffer in state["pending"].values():
+                if written(buffer["records"][0]["from"], buffer["last"], now):
+                    buffer["last"] = now
+    return handler
+
+
+def report(name, arrivals, dispatched, groups):
+    latencies = [dispatched[record["id"]] - arrival for arrival, record in arrivals]
+    bursts = {}
+    for group in groups:
+        for burst in {record["burst"] for record in group}:
+            bursts[burst] = bursts.get(burst, 0) + 1
+    whole = sum(1 for count in bursts.values() if count == 1) / len(bursts)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"  {name:<26}{statistics.median(latencies):>10.2f}{quantiles[94]:>10.2f}{max(latencies):>10.2f}{whole:>16.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bursts", type=int, default=2000)
+    parser.add_argument("--rates", type=float, nargs="+", default=[0.02, 0.1, 0.5], help="bursts per second on the shard")
+    parser.add_argument("--window", type=float, default=20, help="BUFFER_IN_SECONDS")
+    parser.add_argument("--gap", type=float, default=3, help="BUFFER_QUIET_GAP_IN_SECONDS")
+    args = parser.parse_args()
+
+    for rate in args.rates:
+        arrivals = workload(args.bursts, rate, random.Random(7))
+        print(f"{len(arrivals)} messages in {args.bursts} bursts, {rate:g} bursts/s")
+        print(f"  {'':<26}{'median s':>10}{'p95 s':>10}{'max s':>10}{'bursts merged':>16}")
+        report(f"fixed {args.window:g}s window", arrivals, *simulate(arrivals, args.window, args.window, fixed_window))
+        report(f"debounce {args.gap:g}s gap, no linger", arrivals,
+               *simulate(arrivals, args.window, args.gap, debounced(args.gap, args.window, linger=False)))
+        report(f"debounce {args.gap:g}s gap", arrivals,
+               *simulate(arrivals, args.window, args.gap, debounced(args.gap, args.window, linger=True)))
+
+
+if __name__ == "__main__":
+    main()
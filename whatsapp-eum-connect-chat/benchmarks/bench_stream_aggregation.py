@@ -0,0 +1,211 @@
+"""
+Throughput of the message aggregator's decoding and grouping, legacy versus
+current (message_aggregator/process_stream.py).
+
+Synthetic DynamoDB stream batches of 1,000 INSERT records are decoded and
+aggregated by both implementations. Their outputs are compared, then the
+records per second of each stage are printed.
+
+    python benchmarks/bench_stream_aggregation.py [--batches 20] [--senders 250] [--records 1000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+AGGREGATOR_DIR = os.path.join(os.path.dirname(__file__), "..", "lambdas", "code", "message_aggregator")
+sys.path.insert(0, os.path.abspath(AGGREGATOR_DIR))
+
+from process_stream import aggregate_all_messages, deserialize_dynamodb  # noqa: E402
+
+
+# ---------------------------------------------------------------------------
+# legacy implementation, as it was before the rewrite
+# ---------------------------------------------------------------------------
+
+def legacy_deserialize_dynamodb(item):
+    if isinstance(item, dict):
+        if len(item) == 1:
+            type_key = list(item.keys())[0]
+            value = item[type_key]
+
+            if type_key == 'S':
+                return value
+            elif type_key == 'N':
+                return float(value) if '.' in value else int(value)
+            elif type_key == 'M':
+                return {k: legacy_deserialize_dynamodb(v) for k, v in value.items()}
+            elif type_key == 'L':
+                return [legacy_deserialize_dynamodb(i) for i in value]
+            elif type_key == 'BOOL':
+                return value
+            elif type_key == 'NULL':
+                return None
+
+        return {k: legacy_deserialize_dynamodb(v) for k, v in item.items()}
+
+    return item
+
+
+def legacy_aggregate_all_messages(records):
+    grouped = defaultdict(lambda: {'messaging_product': None, 'metadata': None, 'context': None, 'contacts': {}, 'messages': []})
+
+    for record in records:
+        metadata = record.get('metadata', {})
+        context = record.get('context', {})
+        sender = record.get('from')
+
+        key = (json.dumps(metadata, sort_keys=True), json.dumps(context, sort_keys=True), sender)
+
+        grouped[key]['messaging_product'] = record.get('messaging_product')
+        grouped[key]['metadata'] = metadata
+        grouped[key]['context'] = context
+        grouped[key]['messages'].append(record)
+
+        contact = record.get('contact')
+        if contact:
+            grouped[key]['contacts'][sender] = contact
+
+    result = []
+    for data in grouped.values():
+        sorted_msgs = sorted(data['messages'], key=lambda m: int(m.get('timestamp', 0)))
+
+        aggregated = []
+        text_buffer = []
+
+        for msg in sorted_msgs:
+            if msg.get('type') == 'text' and msg.get('from') == sorted_msgs[0].get('from'):
+                text_buffer.append(msg)
+            else:
+                if text_buffer:
+                    last = text_buffer[-1].copy()
+                    last['text'] = {'body': '\n'.join(m['text']['body'] for m in text_buffer)}
+                    aggregated.append(last)
+                    text_buffer = []
+                aggregated.append(msg)
+
+        if text_buffer:
+            last = text_buffer[-1].copy()
+            last['text'] = {'body': '\n'.join(m['text']['body'] for m in text_buffer)}
+            aggregated.append(last)
+
+        result.append({
+            'messaging_product': data['messaging_product'],
+            'metadata': data['metadata'],
+            'context': data['context'],
+            'field': 'messages',
+            'contacts': [{'profile': c['profile'], 'wa_id': c['wa_id']} for c in data['contacts'].values()],
+            'messages': [{
+                'from': m['from'],
+                'id': m['id'],
+                'timestamp': m['timestamp'],
+                'text': m.get('text'),
+                'type': m['type'],
+                'audio': m.get('audio'),
+                'image': m.get('image'),
+                'video': m.get('video'),
+                'document': m.get('document'),
+                'sticker': m.get('sticker'),
+                'location': m.get('location'),
+                'contacts': m.get('contacts'),
+                'interactive': m.get('interactive')
+            } for m in aggregated]
+        })
+
+    return result
+
+
+# ---------------------------------------------------------------------------
+# synthetic stream batches
+# ---------------------------------------------------------------------------
+
+def S(value):
+    return {"S": value}
+
+
+def M(**fields):
+    return {"M": fields}
+
+
+def new_image(sender, index, timestamp, phone_number_id):
+    image = {
+        "metadata": M(phone_number_id=S(phone_number_id), display_phone_number=S("56227607895")),
+        "field": S("messages"),
+        "contact": M(profile=M(name=S(f"Customer {sender}")), wa_id=S(sender)),
+        "messaging_product": S("whatsapp"),
+        "context": M(
+            MetaWabaIds={"L": [M(wabaId=S("509609192225796"), arn=S("arn:aws:social-messaging:us-east-1:123456789012:waba/abc"))]},
+            MetaPhoneNumberIds={"L": [M(metaPhoneNumberId=S(phone_number_id), arn=S("arn:aws:social-messaging:us-east-1:123456789012:phone-number-id/def"))]},
+        ),
+        "from": S(sender),
+        "id": S(f"wamid.{sender}.{index}"),
+        "timestamp": S(str(timestamp)),
+    }
+    if index % 5 == 4:
+        image["type"] = S("audio")
+        image["audio"] = M(mime_type=S("audio/ogg; codecs=opus"), sha256=S("c2hhMjU2"), id=S(f"{index}"), voice={"BOOL": True})
+    else:
+        image["type"] = S("text")
+        image["text"] = M(body=S(f"message {index} " + "lorem ipsum " * random.randint(1, 8)))
+    image["timestamp_ms"] = {"N": str(timestamp * 1000)}
+    return image
+
+
+def stream_batch(records, senders, rng):
+    phone_number_ids = ["503650672828631", "503650672828632"]
+    clock = 1762843882
+    batch = []
+    for index in range(records):
+        sender = f"1415{rng.randrange(senders):07d}"
+        clock += rng.randint(0, 2)
+        batch.append({
+            "eventName": "INSERT",
+            "dynamodb": {"NewImage": new_image(sender, index, clock, phone_number_ids[int(sender) % 2])},
+        })
+    return batch
+
+
+def run(decode, aggregate, batches):
+    decode_seconds = aggregate_seconds = 0.0
+    outputs = []
+    for batch in batches:
+        start = time.perf_counter()
+        records = [decode(r["dynamodb"]["NewImage"]) for r in batch if r.get("eventName") == "INSERT"]
+        middle = time.perf_counter()
+        outputs.append(aggregate(records))
+        decode_seconds += middle - start
+        aggregate_seconds += time.perf_counter() - middle
+    return outputs, decode_seconds, aggregate_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--senders", type=int, default=250)
+    parser.add_argument("--records", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    random.seed(42)
+    batches = [stream_batch(args.records, args.senders, rng) for _ in range(args.batches)]
+    total = args.records * args.batches
+
+    legacy = run(legacy_deserialize_dynamodb, legacy_aggregate_all_messages, batches)
+    current = run(deserialize_dynamodb, aggregate_all_messages, batches)
+
+    def canonical(outputs):
+        return [sorted(json.dumps(group, sort_keys=True) for group in output) for output in outputs]
+
+    print(f"{args.batches} batches x {args.records} records, {args.senders} senders, same output: {canonical(legacy[0]) == canonical(current[0])}")
+    print(f"{'':<10}{'decode rec/s':>14}{'aggregate rec/s':>17}{'total rec/s':>13}")
+    for name, (_, decode_s, aggregate_s) in (("legacy", legacy), ("current", current)):
+        print(f"{name:<10}{total / decode_s:>14,.0f}{total / aggregate_s:>17,.0f}{total / (decode_s + aggregate_s):>13,.0f}")
+    speedup = (legacy[1] + legacy[2]) / (current[1] + current[2])
+    print(f"speedup: {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
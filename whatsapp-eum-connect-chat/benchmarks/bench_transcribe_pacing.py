@@ -0,0 +1,107 @@
+"""
+Wall time per audio second of the transcription feeder, legacy fixed pacing
+versus Ogg granule pacing (transcribe_audio/ogg_feeder.py).
+
+Sends go to a no-op sink, so only the feeder's own pacing is measured. By
+default time is simulated; pass --real to actually sleep.
+
+    python benchmarks/bench_transcribe_pacing.py [--real] [--speed 3.0] [file.ogg ...]
+
+Without files, synthetic Opus-in-Ogg notes of 5, 15, 30 and 60 seconds are used.
+"""
+import argparse
+import asyncio
+import io
+import os
+import struct
+import sys
+import time
+
+FEEDER_DIR = os.path.join(os.path.dirname(__file__), "..", "lambdas", "code", "transcribe_audio")
+sys.path.insert(0, os.path.abspath(FEEDER_DIR))
+
+from ogg_feeder import CHUNK_SIZE, OPUS_GRANULE_RATE, SPEED_FACTOR, feed_paced, ogg_chunks  # noqa: E402
+
+# legacy pacing: CHUNK_SIZE*16 / (SAMPLE_RATE*BYTES_PER_SAMPLE*CHANNEL_NUMS) after every chunk
+LEGACY_SLEEP = CHUNK_SIZE * 16 / (48000 * 2 * 1)
+
+
+def ogg_page(granule, sequence, packets):
+    lacing = b""
+    for packet in packets:
+        lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+    header = b"OggS" + struct.pack("<BBqIII", 0, 0, granule, 1, sequence, 0) + bytes([len(lacing)])
+    return header + lacing + b"".join(packets)
+
+
+def synthetic_note(seconds, bitrate=24000):
+    """Opus-like stream: 20 ms packets, 50 per page (one page per second)."""
+    packet = b"\x00" * (bitrate // 8 // 50)
+    pages = [ogg_page(0, 0, [b"OpusHead" + b"\x00" * 11]), ogg_page(0, 1, [b"OpusTags" + b"\x00" * 8])]
+    for second in range(seconds):
+        pages.append(ogg_page((second + 1) * OPUS_GRANULE_RATE, second + 2, [packet] * 50))
+    return b"".join(pages)
+
+
+class Clock:
+    def __init__(self, real):
+        self.real = real
+        self.now = 0.0
+
+    def time(self):
+        return time.monotonic() if self.real else self.now
+
+    async def sleep(self, seconds):
+        if self.real:
+            await asyncio.sleep(seconds)
+        else:
+            self.now += seconds
+
+
+async def sink(chunk):
+    pass
+
+
+async def legacy(data, clock):
+    stream = io.BytesIO(data)
+    start = clock.time()
+    while stream.read(CHUNK_SIZE):
+        await clock.sleep(LEGACY_SLEEP)
+    return clock.time() - start
+
+
+async def paced(data, clock, speed):
+    start = clock.time()
+    await feed_paced(ogg_chunks(io.BytesIO(data), CHUNK_SIZE), sink, speed, clock=clock.time, sleep=clock.sleep)
+    return clock.time() - start
+
+
+def audio_seconds(data):
+    seconds = 0.0
+    for _, position in ogg_chunks(io.BytesIO(data)):
+        seconds = position
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--real", action="store_true", help="really sleep instead of simulating time")
+    parser.add_argument("--speed", type=float, default=SPEED_FACTOR, help="speed factor for granule pacing")
+    args = parser.parse_args()
+
+    if args.files:
+        notes = [(os.path.basename(path), open(path, "rb").read()) for path in args.files]
+    else:
+        notes = [(f"synthetic {s}s", synthetic_note(s)) for s in (5, 15, 30, 60)]
+
+    print(f"{'note':<20}{'audio s':>9}{'KB':>8}{'legacy s':>10}{'s/audio s':>11}{'paced s':>9}{'s/audio s':>11}")
+    for name, data in notes:
+        duration = audio_seconds(data)
+        old = asyncio.run(legacy(data, Clock(args.real)))
+        new = asyncio.run(paced(data, Clock(args.real), args.speed))
+        print(f"{name:<20}{duration:>9.1f}{len(data) / 1024:>8.0f}{old:>10.2f}{old / duration:>11.3f}{new:>9.2f}{new / duration:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
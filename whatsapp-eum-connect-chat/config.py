@@ -11,5 +11,64 @@ CONFIG_PARAM_INITIAL_CONTENT = {
     "ignore_stickers": "yes",
 }
 
+# hard maximum a message waits in the buffer (tumbling window of the aggregator)
 BUFFER_IN_SECONDS = 20
+# a sender's messages are released once the sender has been quiet this long (also the aggregator's batching window)
+BUFFER_QUIET_GAP_IN_SECONDS = 3
+
+# "direct" sends inbound messages that are never merged (media, locations...) straight to whatsapp_event_handler,
+# unless the sender still has text in the buffer; "buffered" sends everything through the aggregator
+INBOUND_ROUTING_MODE = "direct"
+# after a direct message, the sender's next messages are held until whatsapp_event_handler has delivered it,
+# at most this long if the handler never reports back (its timeout)
+DIRECT_IN_FLIGHT_SECONDS = 900
+
+# media downloads on_raw_messages starts while messages wait in the buffer (0 leaves them to whatsapp_event_handler)
+PREFETCH_MEDIA_MAX_WORKERS = 8
+
+# sender groups the message aggregator dispatches to whatsapp_event_handler at the same time
+AGGREGATOR_MAX_CONCURRENCY = 16
 META_API_VERSION = "v23.0"
+
+# voice notes transcribed in the background by whatsapp_event_handler while their WAV is uploaded
+TRANSCRIPTION_WORKERS = 10
+
+# keep customer sessions cached across warm invocations of whatsapp_event_handler (0 = per invocation only)
+# a rejected cached token is re-read from the connections table before a new chat is started
+SESSION_CACHE_TTL_SECONDS = 0
+
+# agent messages resolve their contactId through a warm-container cache in connect_event_handler (0 disables it);
+# unknown contactIds are cached for a shorter time, as the connection may be written just after the chat starts
+CONTACT_CACHE_TTL_SECONDS = 30
+CONTACT_CACHE_NEGATIVE_TTL_SECONDS = 2
+CONTACT_CACHE_MAX_ENTRIES = 1000
+
+# signed URLs of an agent's attachments fetched at the same time by connect_event_handler (sends stay in order)
+OUTBOUND_ATTACHMENT_CONCURRENCY = 4
+
+# outbound WhatsApp sends (replies, reactions, agent messages) are paced per origination phone number:
+# "local" per Lambda container, "shared" across containers through the connections table, "off" disables pacing.
+# Throttled sends are retried with jitter.
+SEND_RATE_LIMIT_MODE = "local"
+SEND_RATE_PER_SECOND = 20
+SEND_RATE_BURST = 20
+
+# agent attachments are uploaded to WhatsApp media once and resent by media id for this many days
+# (media ids last 30 days; 0 always sends Connect's link)
+OUTBOUND_MEDIA_CACHE_DAYS = 29
+
+# "stream" pipes inbound media from S3 to the Connect upload in blocks, "buffer" reads it fully into memory first
+ATTACHMENT_TRANSFER_MODE = "stream"
+
+# "remote" converts voice notes with the convert_to_wav lambda, "local" runs ffmpeg inside whatsapp_event_handler
+# (local deploys whatsapp_event_handler on x86_64 with the ffmpeg layer)
+AUDIO_CONVERSION_MODE = "remote"
+
+# how the convert_to_wav lambda converts: "stream" pipes S3 -> ffmpeg -> S3 (no /tmp), "file" goes through temp files
+CONVERT_WAV_MODE = "stream"
+
+# days inbound media (and the media store index) are kept in S3 before expiring (0 = keep forever)
+MEDIA_RETENTION_DAYS = 30
+
+# how long voice note transcripts are cached, keyed by audio fingerprint (0 disables the cache)
+TRANSCRIPT_CACHE_TTL_DAYS = 30
@@ -31,5 +31,14 @@ class Tables(Construct):
             partition_key=ddb.Attribute(name="from", type=ddb.AttributeType.STRING),
             sort_key=ddb.Attribute(name="id", type=ddb.AttributeType.STRING),
             stream=ddb.StreamViewType.NEW_IMAGE,
-            time_to_live_attribute='timestamp',
+            # epoch seconds written by on_raw_messages (the message "timestamp" is a string, TTL ignores it)
+            time_to_live_attribute='expires',
+            **TABLE_CONFIG) # type: ignore
+
+        # Transcripts of voice notes already transcribed, keyed by audio fingerprint and language
+        self.transcripts = ddb.Table(
+            self, "Transcripts",
+            partition_key=ddb.Attribute(name="fingerprint", type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name="languageCode", type=ddb.AttributeType.STRING),
+            time_to_live_attribute='expires',
             **TABLE_CONFIG) # type: ignore
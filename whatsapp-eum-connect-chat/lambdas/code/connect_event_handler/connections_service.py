@@ -2,10 +2,23 @@ import boto3
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
 
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
 
 participant_client = boto3.client('connectparticipant')
 
+# contactId -> connection item kept in warm containers (0 disables the cache)
+CONTACT_CACHE_TTL_SECONDS = float(os.environ.get("CONTACT_CACHE_TTL_SECONDS", 30))
+# unknown contactIds are remembered for less time: the connection may be written just after the chat starts
+CONTACT_CACHE_NEGATIVE_TTL_SECONDS = float(os.environ.get("CONTACT_CACHE_NEGATIVE_TTL_SECONDS", 2))
+CONTACT_CACHE_MAX_ENTRIES = int(os.environ.get("CONTACT_CACHE_MAX_ENTRIES", 1000))
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "WhatsappConnectChat")
+
+MISS = object()
+
 
 def build_update_expression(to_update):
     attr_names = {}
@@ -34,10 +47,94 @@ def get_signed_url(connectionToken,attachment):
         return response['Url']
 
 
+class ContactCache:
+    """
+    contactId -> connection item, in front of the connections table.
+
+    Bounded LRU kept across warm invocations. Entries expire after ttl_seconds,
+    unknown contactIds (cached as None) after negative_ttl_seconds. Sessions
+    are replaced by whatsapp_event_handler in another container, so callers
+    invalidate a contact when its chat ends or its connection token fails.
+    """
+
+    def __init__(self, ttl_seconds=CONTACT_CACHE_TTL_SECONDS, negative_ttl_seconds=CONTACT_CACHE_NEGATIVE_TTL_SECONDS,
+                 max_entries=CONTACT_CACHE_MAX_ENTRIES) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, contactId):
+        """Return the cached item (possibly None), or MISS."""
+        with self._lock:
+            entry = self._items.get(contactId)
+            if entry and entry[0] > time.monotonic():
+                self._items.move_to_end(contactId)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._items[contactId]
+            self.misses += 1
+            return MISS
+
+    def put(self, contactId, item):
+        ttl = self.ttl_seconds if item is not None else self.negative_ttl_seconds
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._items[contactId] = (time.monotonic() + ttl, item)
+            self._items.move_to_end(contactId)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def invalidate(self, contactId):
+        with self._lock:
+            self._items.pop(contactId, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+
+    def emit_metrics(self):
+        """Log hit/miss counts since the last call in CloudWatch Embedded Metric Format, then reset them."""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+            size = len(self._items)
+        if not hits + misses:
+            return
+
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Cache"]],
+                    "Metrics": [
+                        {"Name": "Hits", "Unit": "Count"},
+                        {"Name": "Misses", "Unit": "Count"},
+                        {"Name": "HitRate", "Unit": "Percent"},
+                        {"Name": "Entries", "Unit": "Count"},
+                    ],
+                }],
+            },
+            "Cache": "Contacts",
+            "Hits": hits,
+            "Misses": misses,
+            "HitRate": round(100 * hits / (hits + misses), 2),
+            "Entries": size,
+        }))
+
+
 class ConnectionsService:
-    def __init__(self, connections_table_name=os.environ.get("TABLE_NAME")) -> None:
+    def __init__(self, connections_table_name=os.environ.get("TABLE_NAME"), cache=None) -> None:
         self.dynamodb = boto3.resource("dynamodb")
         self.table = self.dynamodb.Table(connections_table_name) # type: ignore
+        self.cache = cache if cache is not None else ContactCache()
 
     def insert_contact( self, customerId, channel, contactId, participantToken, connectionToken, name, systemNumber):
         try:
@@ -84,6 +181,7 @@ class ConnectionsService:
 
     def remove_contactId(self, contactId):
 
+        self.cache.invalidate(contactId)
         try:
             self.table.delete_item(Key={"contactId": contactId})
         except Exception as e:
@@ -100,7 +198,14 @@ class ConnectionsService:
 
 
     def get_customer(self, contactId):
-        customer = None
-        response = self.table.query(KeyConditionExpression=Key("contactId").eq(contactId))
-        if response["Items"]: customer = response["Items"][0]
+        customer = self.cache.get(contactId)
+        if customer is not MISS:
+            return customer
+
+        # contactId is the table key: a single item read
+        customer = self.table.get_item(Key={"contactId": contactId}).get("Item")
+        self.cache.put(contactId, customer)
         return customer
+
+    def invalidate_contact(self, contactId):
+        self.cache.invalidate(contactId)
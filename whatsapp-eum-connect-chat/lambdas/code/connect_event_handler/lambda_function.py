@@ -1,10 +1,26 @@
 import json, decimal, os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
 
 from whatsapp import send_whatsapp_text, send_whatsapp_attachment
 from connections_service import ConnectionsService, get_signed_url
+from outbound_media import media_cache
 
 
 connections         = ConnectionsService(os.environ.get("TABLE_NAME"))
+sqs                 = boto3.client("sqs")
+
+# SQS FIFO queue the SNS records are relayed to, one message group per contact: a contact's
+# records are processed one at a time, in the order they were queued (unset processes them right away)
+CONTACT_QUEUE_URL = os.environ.get("CONTACT_QUEUE_URL")
+# a failed record (and the rest of its batch) is received again after this long
+QUEUE_RETRY_DELAY_SECONDS = int(os.environ.get("QUEUE_RETRY_DELAY_SECONDS", 5))
+# SendMessageBatch takes at most 10 entries
+QUEUE_BATCH_SIZE = 10
+# attachment URLs of one agent message fetched at the same time
+ATTACHMENT_MAX_WORKERS = int(os.environ.get("ATTACHMENT_MAX_WORKERS", 4))
 
 
 def process_message(message_attributes, message):
@@ -28,8 +44,47 @@ def process_event(message_attributes, message):
     if(message_type == 'application/vnd.amazonaws.connect.event.participant.left' or message_type == 'application/vnd.amazonaws.connect.event.chat.ended'):
         print('participant left')
         contactId = message['InitialContactId']
+        # the session is over, a new chat gets a new contactId
+        connections.invalidate_contact(contactId)
+        connections.invalidate_contact(message.get('ContactId'))
         # connections.remove_contactId(contactId) # Optional
     
+def refresh_connection_token(contactId, connectionToken):
+    """Connection token read again from the table when the cached one failed, or None if unchanged."""
+    connections.invalidate_contact(contactId)
+    fresh = connections.get_customer(contactId)
+    if fresh and fresh['connectionToken'] != connectionToken:
+        return fresh['connectionToken']
+    return None
+
+
+def prepare_attachment(connectionToken, attachment, systemNumber):
+    """(signed URL, content key, cached WhatsApp media id) of an attachment; signed URL None if it failed."""
+    signed_url = get_signed_url(connectionToken, attachment['AttachmentId'])
+    if signed_url is None:
+        return None, None, None
+    content_key, media_id = media_cache.lookup(signed_url, systemNumber)
+    return signed_url, content_key, media_id
+
+
+def deliver_attachment(pool, signed_url, content_key, media_id, attachment, phone, systemNumber):
+    """Send by cached media id if there is one, else by link, then upload the file for the next sends."""
+    content_type = attachment['ContentType']
+    name = attachment['AttachmentName']
+    if media_id:
+        try:
+            send_whatsapp_attachment(signed_url, content_type, name, phone, systemNumber, media_id=media_id)
+            return
+        except ClientError as e:
+            print(f"Cached media id {media_id} rejected, sending the link: {e}")
+            media_cache.forget(systemNumber, content_key)
+
+    send_whatsapp_attachment(signed_url, content_type, name, phone, systemNumber)
+    if content_key:
+        # off the send path, done before the invocation ends
+        pool.submit(media_cache.upload, signed_url, systemNumber, content_key, content_type)
+
+
 def process_attachment(message_attributes, message):
     contactId = message['ContactId']
     customer = connections.get_customer(contactId)
@@ -40,30 +95,48 @@ def process_attachment(message_attributes, message):
         connectionToken = customer['connectionToken']
         
         # Process attachments
-        attachments = message.get('Attachments', [])
-        for attachment in attachments:
-            if attachment['Status'] == 'APPROVED':
-                attachment_id = attachment['AttachmentId']
-                attachment_name = attachment['AttachmentName']
-                content_type = attachment['ContentType']
-                
-                # Get signed URL for the attachment
-                signed_url = get_signed_url(connectionToken, attachment_id)
-            
-                send_whatsapp_attachment(signed_url, content_type, attachment_name, phone, systemNumber)
+        attachments = [a for a in message.get('Attachments', []) if a['Status'] == 'APPROVED']
+        if not attachments:
+            return
+
+        # signed URLs (and cached media ids) are fetched concurrently; sends go out one at a time in the agent's
+        # order (WhatsApp shows the files in the order it accepted them), each as soon as its URL is ready
+        workers = max(1, min(ATTACHMENT_MAX_WORKERS, len(attachments)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            prepared = [pool.submit(prepare_attachment, connectionToken, a, systemNumber) for a in attachments]
+            refreshed = False
+
+            for attachment, future in zip(attachments, prepared):
+                signed_url, content_key, media_id = future.result()
+                if signed_url is None and not refreshed:
+                    # the cached connection may be stale, read it again once
+                    refreshed = True
+                    connectionToken = refresh_connection_token(contactId, connectionToken) or connectionToken
+                if signed_url is None and refreshed:
+                    signed_url, content_key, media_id = prepare_attachment(connectionToken, attachment, systemNumber)
+
+                if signed_url is None:
+                    print(f"No signed URL for attachment {attachment['AttachmentId']}, skipping")
+                    continue
+                deliver_attachment(pool, signed_url, content_key, media_id, attachment, phone, systemNumber)
     else:
         print('Contact not found for attachment handling')
         
 
-def process_record(record):
-    # Process each record here
-    print("Processing record:", record)
-
-    sns = record.get("Sns", {})
+def parse_record(sns):
+    """(message_attributes, message) of the Sns part of a record."""
     sns_message_str = sns.get("Message", "{}")
     message_attributes = sns.get('MessageAttributes')
     message = json.loads(sns_message_str, parse_float=decimal.Decimal)
+    return message_attributes, message
+
+
+def contact_key(message):
+    return message.get('ContactId') or message.get('InitialContactId') or 'unknown'
+
 
+def process_record(parsed):
+    message_attributes, message = parsed
     print(f"Message: {message}")
     message_type= message.get('Type')
     ParticipantRole = message.get('ParticipantRole')
@@ -83,10 +156,70 @@ def process_record(record):
         process_attachment(message_attributes, message)
 
 
+def enqueue(records):
+    """
+    Relay SNS records to the contact queue, grouped by contact.
+
+    SNS invokes this function once per record and concurrently, so a burst of agent
+    messages could be sent to WhatsApp out of order. The FIFO queue hands a contact's
+    records to one invocation at a time. The SNS MessageId deduplicates redeliveries.
+    """
+    entries = []
+    for record in records:
+        sns = record.get("Sns", {})
+        _, message = parse_record(sns)
+        entries.append({
+            "Id": str(len(entries)),
+            "MessageBody": json.dumps(sns),
+            "MessageGroupId": contact_key(message),
+            "MessageDeduplicationId": sns.get("MessageId") or str(message.get('Id')),
+        })
+
+    for start in range(0, len(entries), QUEUE_BATCH_SIZE):
+        response = sqs.send_message_batch(QueueUrl=CONTACT_QUEUE_URL, Entries=entries[start:start + QUEUE_BATCH_SIZE])
+        if response.get("Failed"):
+            # SNS delivers the event again, the records already queued are deduplicated
+            raise RuntimeError(f"Records not queued: {response['Failed']}")
+
+
+def process_queue(records):
+    """
+    Process queued records in order. After a failure the rest of the batch is
+    returned too, so no record of a contact overtakes the failed one.
+    """
+    failed = []
+    for record in records:
+        if not failed:
+            try:
+                process_record(parse_record(json.loads(record["body"])))
+                continue
+            except Exception as e:
+                print(f"Record {record['messageId']} failed: {e}")
+        failed.append(record)
+
+    for record in failed:
+        try:
+            sqs.change_message_visibility(QueueUrl=CONTACT_QUEUE_URL, ReceiptHandle=record["receiptHandle"],
+                                          VisibilityTimeout=QUEUE_RETRY_DELAY_SECONDS)
+        except Exception as e:
+            print(f"Could not shorten the retry delay of {record['messageId']}: {e}")
+    return {"batchItemFailures": [{"itemIdentifier": record["messageId"]} for record in failed]}
 
 
 def lambda_handler(event, context):
     records = event.get("Records", [])
-
     for record in records:
-        process_record(record)
\ No newline at end of file
+        print("Processing record:", record)
+
+    if records and records[0].get("eventSource") == "aws:sqs":
+        result = process_queue(records)
+    elif CONTACT_QUEUE_URL:
+        enqueue(records)
+        return
+    else:
+        result = None
+        for record in records:
+            process_record(parse_record(record.get("Sns", {})))
+
+    connections.cache.emit_metrics()
+    return result
@@ -0,0 +1,115 @@
+import logging
+import os
+import time
+import urllib.request
+
+import boto3
+
+logger = logging.getLogger()
+
+TABLE_NAME = os.environ.get("TABLE_NAME")
+BUCKET_NAME = os.environ.get("BUCKET_NAME")
+# WhatsApp keeps uploaded media for 30 days, reuse a media id for a day less (0 disables the cache)
+OUTBOUND_MEDIA_CACHE_DAYS = int(os.environ.get("OUTBOUND_MEDIA_CACHE_DAYS", 29))
+# larger files are always sent as a link
+OUTBOUND_MEDIA_CACHE_MAX_BYTES = int(os.environ.get("OUTBOUND_MEDIA_CACHE_MAX_BYTES", 25 * 1024 * 1024))
+OUTBOUND_MEDIA_PREFIX = "outbound_"
+# cache entries are items of the connections table, expired through its TTL attribute
+CACHE_KEY_PREFIX = "media#"
+
+
+class OutboundMediaCache:
+    """
+    WhatsApp media ids of agent attachments, by content and origination number.
+
+    The content key is the ETag and size of the file behind Connect's signed
+    URL, read with a one byte ranged GET: the body is not transferred to find
+    a cached media id. A miss is sent as a link; the caller then uploads the
+    file off the send path (streamed once into S3, then to WhatsApp media)
+    and its media id is kept for ttl_days. Cache failures are logged and fall
+    back to the link.
+    """
+
+    def __init__(self, table_name=TABLE_NAME, bucket_name=BUCKET_NAME, ttl_days=OUTBOUND_MEDIA_CACHE_DAYS,
+                 max_bytes=OUTBOUND_MEDIA_CACHE_MAX_BYTES) -> None:
+        self.table_name = table_name
+        self.bucket_name = bucket_name
+        self.ttl_seconds = ttl_days * 86400
+        self.max_bytes = max_bytes
+        self.dynamodb = boto3.client("dynamodb")
+        self.s3 = boto3.client("s3")
+        self.socialmessaging = boto3.client("socialmessaging")
+
+    @property
+    def enabled(self):
+        return bool(self.ttl_seconds and self.table_name and self.bucket_name)
+
+    def lookup(self, signed_url, phone_number_id):
+        """(content key, cached WhatsApp media id or None) of the file behind the signed URL, or (None, None)."""
+        if not self.enabled or not signed_url or not signed_url.startswith("https://"):
+            return None, None
+        try:
+            content_key, size = self.content_key(signed_url)
+            if not content_key or size > self.max_bytes:
+                return None, None
+            return content_key, self.find(phone_number_id, content_key)
+        except Exception as e:
+            logger.warning(f"Outbound media cache lookup failed: {e}")
+            return None, None
+
+    @staticmethod
+    def content_key(signed_url):
+        """(ETag-size key, size) from the headers of a one byte ranged GET."""
+        request = urllib.request.Request(signed_url, headers={"Range": "bytes=0-0"})
+        with urllib.request.urlopen(request, timeout=10) as response:  # nosec B310 - https only
+            etag = (response.headers.get("ETag") or "").strip('"')
+            content_range = response.headers.get("Content-Range") or ""
+            if "/" in content_range:
+                size = int(content_range.rsplit("/", 1)[1])
+            else:
+                # range ignored: the whole body is on its way, only the headers are used
+                size = int(response.headers.get("Content-Length") or 0)
+        if not etag or not size:
+            return None, size
+        return f"{etag}-{size}", size
+
+    def find(self, phone_number_id, content_key):
+        item = self.dynamodb.get_item(TableName=self.table_name, Key=self._key(phone_number_id, content_key)).get("Item")
+        # expired items may still be there until the TTL deletes them
+        if not item or int(item["date"]["N"]) <= time.time():
+            return None
+        return item["mediaId"]["S"]
+
+    def upload(self, signed_url, phone_number_id, content_key, mime_type):
+        """Stream the file to S3, upload it to WhatsApp media and cache its media id, for the next sends."""
+        key = f"{OUTBOUND_MEDIA_PREFIX}{content_key}"
+        try:
+            with urllib.request.urlopen(signed_url, timeout=30) as response:  # nosec B310 - https only
+                self.s3.upload_fileobj(response, self.bucket_name, key, ExtraArgs={"ContentType": mime_type})
+            media_id = self.socialmessaging.post_whatsapp_message_media(
+                originationPhoneNumberId=phone_number_id,
+                sourceS3File={"bucketName": self.bucket_name, "key": key},
+            )["mediaId"]
+            item = self._key(phone_number_id, content_key)
+            item.update(mediaId={"S": media_id}, date={"N": str(int(time.time() + self.ttl_seconds))})
+            self.dynamodb.put_item(TableName=self.table_name, Item=item)
+        except Exception as e:
+            logger.warning(f"Outbound media upload failed: {e}")
+        finally:
+            try:
+                self.s3.delete_object(Bucket=self.bucket_name, Key=key)
+            except Exception as e:
+                logger.warning(f"Could not delete s3://{self.bucket_name}/{key}: {e}")
+
+    def forget(self, phone_number_id, content_key):
+        try:
+            self.dynamodb.delete_item(TableName=self.table_name, Key=self._key(phone_number_id, content_key))
+        except Exception as e:
+            logger.warning(f"Outbound media cache delete failed: {e}")
+
+    @staticmethod
+    def _key(phone_number_id, content_key):
+        return {"contactId": {"S": f"{CACHE_KEY_PREFIX}{phone_number_id}#{content_key}"}}
+
+
+media_cache = OutboundMediaCache()
@@ -0,0 +1,168 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# Same module in whatsapp_event_handler and connect_event_handler: both send
+# through the same business numbers and share their throughput.
+
+# "local" paces sends per container, "shared" across containers through the connections table, "off" disables
+SEND_RATE_LIMIT_MODE = os.environ.get("SEND_RATE_LIMIT_MODE", "local")
+# sustained messages per second per origination phone number, and how many may go out at once
+SEND_RATE_PER_SECOND = float(os.environ.get("SEND_RATE_PER_SECOND", 20))
+SEND_RATE_BURST = float(os.environ.get("SEND_RATE_BURST", SEND_RATE_PER_SECOND))
+# a send waits at most this long for a token, then goes out and relies on the throttling retries
+SEND_RATE_MAX_WAIT_SECONDS = float(os.environ.get("SEND_RATE_MAX_WAIT_SECONDS", 30))
+SEND_MAX_ATTEMPTS = int(os.environ.get("SEND_MAX_ATTEMPTS", 6))
+TABLE_NAME = os.environ.get("TABLE_NAME")
+# shared buckets are items of the connections table, expired through its TTL attribute when idle
+BUCKET_KEY_PREFIX = "ratelimit#"
+BUCKET_IDLE_SECONDS = 86400
+
+THROTTLING_ERRORS = {"ThrottledRequestException", "ThrottlingException", "TooManyRequestsException"}
+
+
+def bucket_key(origination_phone_number_id):
+    """Same key for a phone number id and its ARN (arn:...:phone-number-id/abc -> phone-number-id-abc)."""
+    return origination_phone_number_id.split(":")[-1].replace("/", "-")
+
+
+class LocalTokenBucket:
+    """
+    Token buckets per key, in this container.
+
+    A caller takes a token right away, possibly driving the bucket negative,
+    and sleeps until its token is due: concurrent senders queue up in arrival
+    order at the configured rate.
+    """
+
+    def __init__(self, rate=SEND_RATE_PER_SECOND, burst=SEND_RATE_BURST) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key):
+        """Take a token, returns the seconds to wait before using it."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate) - 1
+            self._buckets[key] = (tokens, now)
+        return max(0.0, -tokens / self.rate)
+
+    def acquire(self, key, max_wait=SEND_RATE_MAX_WAIT_SECONDS, sleep=time.sleep):
+        wait = self.reserve(key)
+        if wait > 0:
+            sleep(min(wait, max_wait))
+        return wait
+
+
+class SharedTokenBucket:
+    """
+    Token buckets per key, shared by every container.
+
+    Each bucket is an item of the connections table (contactId "ratelimit#<key>")
+    holding the tokens left and when they were counted. A token is taken with
+    a conditional update on that timestamp; a concurrent taker makes the
+    condition fail and the read is retried. An empty bucket waits for its
+    next token.
+    """
+
+    def __init__(self, table_name=TABLE_NAME, rate=SEND_RATE_PER_SECOND, burst=SEND_RATE_BURST, client=None) -> None:
+        self.table_name = table_name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.client = client or boto3.client("dynamodb")
+
+    def try_take(self, key, now):
+        """Take a token if there is one. Returns 0, or the seconds until the next token."""
+        item_key = {"contactId": {"S": f"{BUCKET_KEY_PREFIX}{key}"}}
+        item = self.client.get_item(TableName=self.table_name, Key=item_key, ConsistentRead=True).get("Item")
+        if item:
+            updated = int(item["updated"]["N"])
+            tokens = min(self.burst, float(item["tokens"]["N"]) + (now - updated / 1000) * self.rate)
+            condition = "updated = :updated"
+            values = {":updated": {"N": str(updated)}}
+        else:
+            tokens = self.burst
+            condition = "attribute_not_exists(contactId)"
+            values = {}
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+
+        values.update({
+            ":tokens": {"N": str(round(tokens - 1, 6))},
+            ":now": {"N": str(int(now * 1000))},
+            ":expires": {"N": str(int(now) + BUCKET_IDLE_SECONDS)},
+        })
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=item_key,
+                UpdateExpression="SET tokens = :tokens, updated = :now, #date = :expires",
+                ConditionExpression=condition,
+                ExpressionAttributeNames={"#date": "date"},
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+            # another sender took a token in between, count again
+            return 0.01 * random.uniform(0.5, 1.5)  # nosec B311 - jitter, not crypto
+        return 0
+
+    def acquire(self, key, max_wait=SEND_RATE_MAX_WAIT_SECONDS, sleep=time.sleep):
+        waited = 0.0
+        while waited < max_wait:
+            try:
+                wait = self.try_take(key, time.time())
+            except Exception as e:
+                # the limiter must never block a send
+                logger.warning(f"Shared rate limiter unavailable for {key}: {e}")
+                return waited
+            if not wait:
+                return waited
+            wait = min(wait, max_wait - waited)
+            sleep(wait)
+            waited += wait
+        return waited
+
+
+def build_limiter(mode=SEND_RATE_LIMIT_MODE):
+    if mode == "shared" and TABLE_NAME:
+        return SharedTokenBucket()
+    if mode in ("local", "shared"):
+        return LocalTokenBucket()
+    return None
+
+
+limiter = build_limiter()
+
+
+def send_whatsapp_message(client, max_attempts=SEND_MAX_ATTEMPTS, base_delay=0.5, max_delay=8.0, sleep=time.sleep, **kwargs):
+    """
+    client.send_whatsapp_message(**kwargs), paced per originationPhoneNumberId.
+
+    Every attempt waits for a token of its origination number. Throttling
+    errors are retried with exponential backoff and full jitter; the last one
+    is raised once max_attempts are used.
+    """
+    key = bucket_key(kwargs.get("originationPhoneNumberId", ""))
+    for attempt in range(1, max_attempts + 1):
+        if limiter:
+            limiter.acquire(key)
+        try:
+            return client.send_whatsapp_message(**kwargs)
+        except ClientError as e:
+            if attempt == max_attempts or e.response.get("Error", {}).get("Code") not in THROTTLING_ERRORS:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))  # nosec B311 - jitter, not crypto
+            logger.warning(f"Send throttled for {key} (attempt {attempt}), retrying in {delay:.2f}s")
+            sleep(delay)
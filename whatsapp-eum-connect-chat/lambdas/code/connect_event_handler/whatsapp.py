@@ -1,6 +1,7 @@
 import boto3
 import json
 import os
+from send_rate_limit import send_whatsapp_message
 socialessaging = boto3.client("socialmessaging")
 
 META_API_VERSION = os.environ.get("META_API_VERSION","v24.0" )
@@ -36,7 +37,7 @@ def send_whatsapp_text(text_message, to, phone_number_id, meta_api_version=META_
         message=bytes(json.dumps(message_object), "utf-8"),
     )
     # print(kwargs)
-    response = socialessaging.send_whatsapp_message(**kwargs)
+    response = send_whatsapp_message(socialessaging, **kwargs)
     print("replied to message:", response)
 
 
@@ -47,7 +48,9 @@ def send_whatsapp_attachment(
     to,
     phone_number_id,
     meta_api_version=META_API_VERSION,
+    media_id=None,
 ):
+    """Send a file by link, or by WhatsApp media id when it was already uploaded."""
     print("sending attachment...")
     message_type = get_file_category(mime_type)
     message_object = {
@@ -56,7 +59,10 @@ def send_whatsapp_attachment(
         "to": f"+{to}",
         "type": message_type,
     }
-    message_object[message_type] = {"link": attachment_url}
+    if media_id:
+        message_object[message_type] = {"id": media_id}
+    else:
+        message_object[message_type] = {"link": attachment_url}
     if message_type == "document":
         message_object[message_type]["filename"] = name
 
@@ -66,5 +72,5 @@ def send_whatsapp_attachment(
         message=bytes(json.dumps(message_object), "utf-8"),
     )
     # print(kwargs)
-    response = socialessaging.send_whatsapp_message(**kwargs)
+    response = send_whatsapp_message(socialessaging, **kwargs)
     print("attachment response:", response)
@@ -2,8 +2,10 @@ import json
 import os
 import re
 import shutil
+import struct
 import subprocess  # nosec B404 - subprocess required for ffmpeg invocation; inputs validated via _validate_path
 import tempfile
+import threading
 import boto3
 import logging
 from urllib.parse import urlparse
@@ -11,7 +13,14 @@ from urllib.parse import urlparse
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# "stream" pipes S3 -> ffmpeg -> S3 without touching /tmp, "file" converts through temp files
+CONVERSION_MODE = os.environ.get("CONVERSION_MODE", "stream")
 
+# S3 multipart parts must be at least 5 MiB, except the last one
+PART_SIZE = 5 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+s3_client = boto3.client('s3')
 
 
 ALLOWED_FILENAME_PATTERN = re.compile(r'^[\w\-. ]+$')
@@ -50,6 +59,24 @@ def parse_location(s3_uri):
     return bucket, prefix, fileName, extension, file
 
 
+def _validate_filename(filename: str) -> str:
+    """Validate an S3 file name with the same allowlist used for local paths."""
+    if not ALLOWED_FILENAME_PATTERN.match(filename):
+        raise ValueError(f"Invalid characters in filename: {filename}")
+    return filename
+
+
+def object_exists(bucket, key):
+    """True if the object is already in S3 (e.g. a WAV converted by an earlier invocation)."""
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+        return True
+    except s3_client.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
 def download_file(bucket, key, local_path):
     """Download file from S3 to local path"""
     s3_client = boto3.client('s3')
@@ -94,6 +121,190 @@ def convert_ogg_to_wav(input_file, output_file):
     return result.returncode == 0
 
 
+def fix_wav_header(head: bytearray, total_size: int) -> bytearray:
+    """
+    Write the real RIFF and data chunk sizes into the first bytes of a piped WAV.
+
+    ffmpeg cannot seek back on a pipe, so it leaves placeholder sizes where a
+    file output would have the final ones.
+    """
+    if head[:4] != b'RIFF' or head[8:12] != b'WAVE':
+        raise ValueError("Not a WAV stream")
+    struct.pack_into('<I', head, 4, total_size - 8)
+
+    offset = 12
+    while offset + 8 <= len(head):
+        chunk_id = bytes(head[offset:offset + 4])
+        if chunk_id == b'data':
+            struct.pack_into('<I', head, offset + 4, total_size - offset - 8)
+            return head
+        chunk_size = struct.unpack_from('<I', head, offset + 4)[0]
+        offset += 8 + chunk_size + (chunk_size & 1)
+    raise ValueError("WAV data chunk not found")
+
+
+class MultipartWriter:
+    """
+    Upload a stream of bytes to S3 in parts, as it is produced.
+
+    The first part is held back until the end so the WAV header can be fixed
+    with the final sizes. Outputs smaller than one part go up with a single
+    put_object.
+    """
+
+    def __init__(self, bucket, key) -> None:
+        self.bucket = bucket
+        self.key = key
+        self.first_part = None
+        self.buffer = bytearray()
+        self.size = 0
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= PART_SIZE:
+            part, self.buffer = self.buffer[:PART_SIZE], self.buffer[PART_SIZE:]
+            if self.first_part is None:
+                self.first_part = part
+            else:
+                self._upload_part(len(self.parts) + 2, part)
+
+    def close(self):
+        if self.first_part is None:
+            body = fix_wav_header(self.buffer, self.size)
+            s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(body))
+            return
+
+        if self.buffer:
+            self._upload_part(len(self.parts) + 2, self.buffer)
+        self._upload_part(1, fix_wav_header(self.first_part, self.size))
+        s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': sorted(self.parts, key=lambda p: p['PartNumber'])},
+        )
+
+    def abort(self):
+        if self.upload_id:
+            s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def _upload_part(self, number, data):
+        if self.upload_id is None:
+            self.upload_id = s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        response = s3_client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=bytes(data)
+        )
+        self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+
+
+def stream_ogg_to_wav(bucket, source_key, target_key):
+    """
+    Convert OGG to WAV piping S3 -> ffmpeg -> S3, with nothing written to disk.
+
+    The S3 body is fed to ffmpeg's stdin from a thread while its stdout is
+    uploaded in parts, so the upload starts before decoding finishes.
+    """
+    _validate_filename(os.path.basename(source_key))
+    _validate_filename(os.path.basename(target_key))
+
+    # Using list form (not shell=True) with a fixed argv: keys never reach the
+    # command line, audio only flows through stdin/stdout, and only the pipe
+    # protocol is allowed for input.
+    command = [
+        'ffmpeg', '-hide_banner',
+        '-protocol_whitelist', 'pipe',
+        '-f', 'ogg', '-i', 'pipe:0',
+        '-acodec', 'pcm_s16le',
+        '-ar', '16000',
+        '-ac', '1',
+        '-f', 'wav', 'pipe:1',
+    ]
+    logger.info("Running ffmpeg command: %s", command)
+
+    body = s3_client.get_object(Bucket=bucket, Key=source_key)['Body']
+    process = subprocess.Popen(  # nosemgrep: dangerous-subprocess-use-audit  # nosec B603
+        command,
+        shell=False,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    errors = []
+    stderr = []
+
+    def feed():
+        try:
+            for chunk in iter(lambda: body.read(READ_SIZE), b''):
+                process.stdin.write(chunk)
+        except Exception as e:
+            # BrokenPipeError here means ffmpeg exited early, its return code tells why
+            errors.append(e)
+        finally:
+            body.close()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def drain_stderr():
+        stderr.append(process.stderr.read())
+
+    threads = [threading.Thread(target=feed), threading.Thread(target=drain_stderr)]
+    for thread in threads:
+        thread.start()
+
+    writer = MultipartWriter(bucket, target_key)
+    try:
+        for chunk in iter(lambda: process.stdout.read(READ_SIZE), b''):
+            writer.write(chunk)
+        returncode = process.wait()
+        for thread in threads:
+            thread.join()
+
+        print(f"code: {returncode}, stderr: {b''.join(stderr).decode(errors='replace')}")
+        if returncode != 0 or (errors and not isinstance(errors[0], BrokenPipeError)):
+            writer.abort()
+            return False
+
+        writer.close()
+        return True
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+
+
+def file_ogg_to_wav(bucket, source_key, target_key):
+    """Convert OGG to WAV through temp files: download, ffmpeg file to file, upload."""
+    file = os.path.basename(source_key)
+    wav_file = os.path.basename(target_key)
+    tmp_dir = tempfile.mkdtemp()
+
+    try:
+        # Download OGG file
+        local_ogg = os.path.join(tmp_dir, file)
+        print(f"Downloading {file} from s3://{bucket}/{source_key} to {local_ogg}")
+        download_file(bucket, source_key, local_ogg)
+
+        # Convert to WAV
+        local_wav = os.path.join(tmp_dir, wav_file)
+        if not convert_ogg_to_wav(local_ogg, local_wav):
+            return False
+
+        # Upload WAV to S3
+        upload_file(local_wav, bucket, target_key)
+        return True
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
 def lambda_handler(event, context):
     print(event)
     
@@ -112,38 +323,34 @@ def lambda_handler(event, context):
             'converted_location': None
         }
     
-    # Download OGG file
     location = f"{prefix}/{file}" if prefix else file
-    tmp_dir = tempfile.mkdtemp()
-
-    try:
-        local_ogg = os.path.join(tmp_dir, file)
-        print(f"Downloading {file} from s3://{bucket}/{location} to {local_ogg}")
-        download_file(bucket, location, local_ogg)
-
-        # Convert to WAV
-        wav_file = f"{fileName}.wav"
-        local_wav = os.path.join(tmp_dir, wav_file)
-
-        success = convert_ogg_to_wav(local_ogg, local_wav)
-
-        if not success:
-            return {
-                'statusCode': 500,
-                'error': 'ffmpeg conversion failed'
-            }
-
-        # Upload WAV to S3
-        wav_location = f"{prefix}/{wav_file}" if prefix else wav_file
-        upload_file(local_wav, bucket, wav_location)
-
-        # Return both locations
-        converted_location = f"s3://{bucket}/{wav_location}"
+    wav_file = f"{fileName}.wav"
+    wav_location = f"{prefix}/{wav_file}" if prefix else wav_file
+    converted_location = f"s3://{bucket}/{wav_location}"
 
+    # the WAV key is derived from the OGG key, so an existing WAV is this note already converted
+    if object_exists(bucket, wav_location):
+        print(f"{converted_location} already exists, skipping conversion")
         return {
             'statusCode': 200,
             'location': s3_uri,
             'converted_location': converted_location
         }
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if CONVERSION_MODE == "stream":
+        success = stream_ogg_to_wav(bucket, location, wav_location)
+    else:
+        success = file_ogg_to_wav(bucket, location, wav_location)
+
+    if not success:
+        return {
+            'statusCode': 500,
+            'error': 'ffmpeg conversion failed'
+        }
+
+    # Return both locations
+    return {
+        'statusCode': 200,
+        'location': s3_uri,
+        'converted_location': converted_location
+    }
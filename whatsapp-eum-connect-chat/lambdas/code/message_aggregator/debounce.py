@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+
+# a sender is released once quiet this long...
+BUFFER_QUIET_GAP_IN_SECONDS = float(os.environ.get("BUFFER_QUIET_GAP_IN_SECONDS", 3))
+# ...or once its first buffered message is this old, whatever happens
+BUFFER_IN_SECONDS = float(os.environ.get("BUFFER_IN_SECONDS", 20))
+# tumbling window state is capped at 1 MB by Lambda, keep a margin
+MAX_STATE_BYTES = int(os.environ.get("MAX_STATE_BYTES", 900_000))
+
+
+def sender_key(record):
+    phone_number_id = (record.get("metadata") or {}).get("phone_number_id")
+    return f"{phone_number_id}#{record.get('from')}"
+
+
+def release_quiet_senders(state, records, now, flush=False,
+                          quiet_gap=BUFFER_QUIET_GAP_IN_SECONDS, max_wait=BUFFER_IN_SECONDS,
+                          max_state_bytes=MAX_STATE_BYTES, in_flight=None):
+    """
+    Per-sender debounce over tumbling window invocations.
+
+    Records are buffered per sender in the window state. A sender's buffer is
+    released when its last message arrived at least quiet_gap seconds ago, when
+    its first one arrived max_wait seconds ago, or on flush (last invocation of
+    the window). If the state would not fit in max_state_bytes, the oldest
+    buffers are released early.
+
+    A buffer whose records carry a holdUntil (set by on_raw_messages while a
+    direct message of the sender is in flight) is held until then, or until
+    in_flight(from, holdToken) says the event handler has cleared the slot.
+    Held buffers are not released on flush either: they stay in the returned
+    state and the caller requeues their records into the next window.
+
+    Args:
+        state: window state returned by the previous invocation ({} at window start)
+        records: [(arrival_time, record)] of this invocation, in stream order
+        now: current time, in the same clock as arrival_time (epoch seconds)
+        in_flight: optional (from, token) -> bool, whether that direct slot is still taken
+
+    Returns:
+        (records to dispatch now in arrival order, state to return)
+    """
+    pending = dict((state or {}).get("pending", {}))
+    for arrival, record in records:
+        buffer = pending.setdefault(sender_key(record), {"first": arrival, "last": arrival, "records": []})
+        buffer["first"] = min(buffer["first"], arrival)
+        buffer["last"] = max(buffer["last"], arrival)
+        buffer["records"].append(record)
+        if record.get("holdUntil") and record["holdUntil"] > buffer.get("hold", 0):
+            buffer["hold"] = record["holdUntil"]
+            buffer["holdToken"] = record.get("holdToken")
+
+    released = []
+    for key, buffer in list(pending.items()):
+        ready = flush or now >= buffer["last"] + quiet_gap or now >= buffer["first"] + max_wait
+        if ready and now < buffer.get("hold", 0):
+            sender = buffer["records"][0].get("from")
+            if in_flight is not None and not in_flight(sender, buffer.get("holdToken")):
+                buffer.pop("hold")
+                buffer.pop("holdToken", None)
+        if ready and now >= buffer.get("hold", 0):
+            released.append(pending.pop(key))
+
+    # oldest buffers leave first until the rest fits in the window state
+    size = len(json.dumps(pending))
+    for key, buffer in sorted(pending.items(), key=lambda item: item[1]["first"]):
+        if size <= max_state_bytes:
+            break
+        size -= len(json.dumps({key: buffer}))
+        logger.warning(f"Window state full, releasing {key} early")
+        released.append(pending.pop(key))
+
+    released.sort(key=lambda buffer: buffer["first"])
+    ready = [record for buffer in released for record in buffer["records"]]
+    return ready, {"pending": pending}
+
+
+def next_release_at(state, now, quiet_gap=BUFFER_QUIET_GAP_IN_SECONDS, max_wait=BUFFER_IN_SECONDS):
+    """
+    When the next pending buffer becomes ready (quiet gap or max wait), or None.
+
+    Buffers held behind a direct message are left out: they are checked again when
+    the event handler clears its slot, an update that invokes the aggregator.
+    """
+    wake = None
+    for buffer in (state or {}).get("pending", {}).values():
+        if now < buffer.get("hold", 0):
+            continue
+        ready_at = min(buffer["last"] + quiet_gap, buffer["first"] + max_wait)
+        wake = ready_at if wake is None else min(wake, ready_at)
+    return wake
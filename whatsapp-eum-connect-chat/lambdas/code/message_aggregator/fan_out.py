@@ -0,0 +1,75 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+logger = logging.getLogger()
+
+# error codes worth another attempt: throttling and transient service faults
+RETRYABLE_ERRORS = {
+    "TooManyRequestsException",
+    "ThrottlingException",
+    "Throttling",
+    "ServiceException",
+    "ResourceNotReadyException",
+    "EC2ThrottledException",
+}
+# connection failures and timeouts (EndpointConnectionError, ReadTimeoutError, ...), as botocore's standard retry mode
+RETRYABLE_EXCEPTIONS = (ConnectionError, HTTPClientError)
+
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_EXCEPTIONS):
+        return True
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in RETRYABLE_ERRORS
+
+
+def call_with_backoff(fn, max_attempts=5, base_delay=0.2, max_delay=5.0, sleep=time.sleep):
+    """
+    Call fn(), retrying retryable errors with exponential backoff and full jitter.
+
+    Raises:
+        The last error, once max_attempts are used or on a non-retryable error.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_attempts or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))  # nosec B311 - jitter, not crypto
+            logger.warning(f"Retrying after {e} (attempt {attempt}), sleeping {delay:.2f}s")
+            sleep(delay)
+
+
+def fan_out(payloads, send, max_workers=16, max_attempts=5):
+    """
+    Send every payload concurrently, at most max_workers at a time.
+
+    Args:
+        payloads: list of payloads
+        send: callable sending one payload
+        max_workers: concurrency bound
+        max_attempts: attempts per payload for retryable errors
+
+    Returns:
+        [(payload, error)] for the payloads that could not be sent.
+    """
+    if not payloads:
+        return []
+
+    def send_one(payload):
+        call_with_backoff(lambda: send(payload), max_attempts=max_attempts)
+
+    workers = max(1, min(max_workers, len(payloads)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(payload, pool.submit(send_one, payload)) for payload in payloads]
+
+    failed = []
+    for payload, future in futures:
+        error = future.exception()
+        if error:
+            failed.append((payload, error))
+    return failed
@@ -1,38 +1,172 @@
-import json, decimal, logging, os, boto3
+import json, decimal, logging, os, time, boto3
+from botocore.config import Config
 from process_stream import deserialize_dynamodb, aggregate_all_messages
+from fan_out import fan_out
+from debounce import release_quiet_senders, next_release_at, BUFFER_QUIET_GAP_IN_SECONDS, BUFFER_IN_SECONDS
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-lambda_client = boto3.client('lambda')
+
+# per sender item written by on_raw_messages next to the messages, not a message
+IN_FLIGHT_ID = "#in-flight"
+RAW_MESSAGES_TABLE = os.environ.get("RAW_MESSAGES_TABLE")
+
+# groups dispatched to the handler at the same time
+FAN_OUT_MAX_WORKERS = int(os.environ.get("FAN_OUT_MAX_WORKERS", 16))
+FAN_OUT_MAX_ATTEMPTS = int(os.environ.get("FAN_OUT_MAX_ATTEMPTS", 5))
+
+# retries (throttling, transient faults, connection errors and timeouts) are done by fan_out, with jitter; one connection per worker
+lambda_client = boto3.client('lambda', config=Config(
+    max_pool_connections=FAN_OUT_MAX_WORKERS,
+    retries={'mode': 'standard', 'max_attempts': 1},
+))
+dynamodb = boto3.client('dynamodb')
+
+
+def in_flight(sender, token):
+    """Whether the sender's direct message (token) is still on its way: whatsapp_event_handler clears the slot when done."""
+    if not RAW_MESSAGES_TABLE or not token:
+        return True
+    item = dynamodb.get_item(
+        TableName=RAW_MESSAGES_TABLE,
+        Key={"from": {"S": sender}, "id": {"S": IN_FLIGHT_ID}},
+        ConsistentRead=True,
+    ).get("Item") or {}
+    return item.get("directToken", {}).get("S") == token and int(item.get("directUntil", {}).get("N", 0)) > time.time()
+
+
+def sent_since(records):
+    """
+    Whether the sender of the buffered records has newer messages in the table.
+
+    Those were written after this batch was read and come with the next one: the
+    sender is not quiet. Compares WhatsApp's timestamp (epoch seconds, as a string).
+    """
+    if not RAW_MESSAGES_TABLE:
+        return False
+    known = {record["id"] for record in records}
+    response = dynamodb.query(
+        TableName=RAW_MESSAGES_TABLE,
+        KeyConditionExpression="#from = :from",
+        FilterExpression="#timestamp >= :timestamp",
+        ProjectionExpression="id",
+        ExpressionAttributeNames={"#from": "from", "#timestamp": "timestamp"},
+        ExpressionAttributeValues={
+            ":from": {"S": records[0]["from"]},
+            ":timestamp": {"S": max(str(record.get("timestamp", "")) for record in records)},
+        },
+        ConsistentRead=True,
+    )
+    return any(item["id"]["S"] not in known for item in response.get("Items", []))
+
+
+def still_typing(state, now):
+    """Restart the quiet gap of senders due now whose next message is already in the table."""
+    for buffer in state.get("pending", {}).values():
+        quiet = now >= buffer["last"] + BUFFER_QUIET_GAP_IN_SECONDS
+        if quiet and now < buffer["first"] + BUFFER_IN_SECONDS and sent_since(buffer["records"]):
+            buffer["last"] = now
+
+
+def requeue(buffers):
+    """
+    Touch the records of buffers still held at the end of the window.
+
+    The update puts them back in the stream (MODIFY with "requeued"), so the next
+    window buffers them again instead of sending them ahead of the direct message.
+    """
+    for buffer in buffers:
+        for record in buffer["records"]:
+            dynamodb.update_item(
+                TableName=RAW_MESSAGES_TABLE,
+                Key={"from": {"S": record["from"]}, "id": {"S": record["id"]}},
+                UpdateExpression="SET requeued = if_not_exists(requeued, :zero) + :one",
+                ExpressionAttributeValues={":zero": {"N": "0"}, ":one": {"N": "1"}},
+            )
+
+
+def describe_group(agg, error):
+    """What is reported for a group that could not be dispatched."""
+    messages = agg.get('messages', [])
+    return {
+        'phone_number_id': (agg.get('metadata') or {}).get('phone_number_id'),
+        'from': messages[0].get('from') if messages else None,
+        'message_ids': [m.get('id') for m in messages],
+        'error': str(error),
+    }
 
 
 def lambda_handler(event, context):
     raw_records = event.get("Records", [])
-    state = event.get('state', {})
+    state = event.get('state') or {}
+    now = time.time()
 
-    logger.info("raw_records: %s", raw_records)
+    # whole batches are only logged at debug level: formatting 1,000 records costs more than processing them
+    logger.debug("raw_records: %s", raw_records)
     
     records = []
     for record in raw_records:
-        if record.get("eventName") == "INSERT":
+        # new messages, and messages requeued by a previous window (rewrites of a message are not new)
+        if record.get("eventName") in ("INSERT", "MODIFY"):
             dynamodb_data = record.get("dynamodb", {})
             new_image = dynamodb_data.get("NewImage", {})
+            if record["eventName"] == "MODIFY" and "requeued" not in new_image:
+                continue
             deserialized = deserialize_dynamodb(new_image)
-            records.append(deserialized)
-    
-    if len(records) == 0:
-        return {"state": state}
-    logger.info("records: %s", records)
-    
-    aggregated = aggregate_all_messages(records)
-    logger.info("aggregated: %s", aggregated)
-    
+            if deserialized.get("routed") == "direct" or deserialized.get("id") == IN_FLIGHT_ID:
+                # already delivered by on_raw_messages, or its per sender bookkeeping item (whose
+                # updates still invoke this function, so held senders are checked again)
+                continue
+            records.append((dynamodb_data.get("ApproximateCreationDateTime", now), deserialized))
+
+    # senders still typing stay in the window state, the last invocation of the window releases everyone
+    final = event.get("isFinalInvokeForWindow") or event.get("isWindowTerminatedEarly")
     handler_name = os.environ['WHATSAPP_EVENT_HANDLER']
-    for agg in aggregated:
+
+    def invoke(agg):
         lambda_client.invoke(
             FunctionName=handler_name,
             InvocationType='Event',
             Payload=json.dumps(agg)
         )
-    
-    return {"state": state}
\ No newline at end of file
+
+    # Lambda only invokes this function when records arrive (or at the end of the window), so a sender
+    # that becomes quiet within the next gap is waited for here instead of until the window ends.
+    # Records written meanwhile come with the next batch: the table tells whether the sender wrote again.
+    linger_until = now + BUFFER_QUIET_GAP_IN_SECONDS
+    failed_groups = []
+    while True:
+        records, state = release_quiet_senders(state, records, now, flush=final, in_flight=in_flight)
+        if final and state["pending"]:
+            # held behind a direct message still in flight: carried over to the next window
+            requeue(state["pending"].values())
+            logger.info("%d held senders requeued", len(state["pending"]))
+            state = {"pending": {}}
+        failed_groups += dispatch(records, invoke)
+
+        wake = None if final else next_release_at(state, now)
+        if wake is None or wake > linger_until:
+            break
+        time.sleep(max(0.0, wake - time.time()))
+        records, now = [], max(wake, time.time())
+        still_typing(state, now)
+
+    logger.info("%d senders buffered", len(state["pending"]))
+    return {"state": state, "failedGroups": failed_groups}
+
+
+def dispatch(records, invoke):
+    """Aggregate the released records and invoke the handler per sender group, returns the failed groups."""
+    if len(records) == 0:
+        return []
+    logger.debug("records: %s", records)
+
+    aggregated = aggregate_all_messages(records)
+    logger.debug("aggregated: %s", aggregated)
+    logger.info("%d records aggregated into %d groups", len(records), len(aggregated))
+
+    failed = fan_out(aggregated, invoke, max_workers=FAN_OUT_MAX_WORKERS, max_attempts=FAN_OUT_MAX_ATTEMPTS)
+    failed_groups = [describe_group(agg, error) for agg, error in failed]
+    if failed_groups:
+        logger.error("%d of %d groups not dispatched: %s", len(failed_groups), len(aggregated), failed_groups)
+    return failed_groups
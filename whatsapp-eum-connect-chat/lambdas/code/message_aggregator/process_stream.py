@@ -1,98 +1,154 @@
-import json
-from collections import defaultdict
 from typing import Any, Dict, List
 
 
+def _decode_number(value: str):
+    # same shape as the webhook JSON: integers stay int, anything else is float
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return float(value)
+
+
+def _decode_map(value):
+    # strings are most of a message, decode them inline
+    return {k: v['S'] if 'S' in v else decode_value(v) for k, v in value.items()}
+
+
+def _decode_list(value):
+    return [decode_value(v) for v in value]
+
+
+_DECODERS = {
+    'N': _decode_number,
+    'M': _decode_map,
+    'L': _decode_list,
+    'BOOL': lambda value: value,
+    'NULL': lambda value: None,
+    # binaries arrive base64 encoded in stream events and are kept that way (JSON safe)
+    'B': lambda value: value,
+    'SS': list,
+    'NS': lambda value: [_decode_number(v) for v in value],
+    'BS': list,
+}
+
+
+def decode_value(attribute_value: Dict[str, Any]) -> Any:
+    """Convert one DynamoDB attribute value ({"S": "..."}, {"M": {...}}...) to plain JSON."""
+    if 'S' in attribute_value:
+        return attribute_value['S']
+    if 'M' in attribute_value:
+        return _decode_map(attribute_value['M'])
+    for type_key, value in attribute_value.items():
+        decoder = _DECODERS.get(type_key)
+        if decoder is None:
+            raise ValueError(f"Unsupported DynamoDB type: {type_key}")
+        return decoder(value)
+    raise ValueError("Empty DynamoDB attribute value")
+
+
 def deserialize_dynamodb(item: Dict[str, Any]) -> Dict[str, Any]:
-    """Convert DynamoDB format to plain JSON."""
-    if isinstance(item, dict):
-        if len(item) == 1:
-            type_key = list(item.keys())[0]
-            value = item[type_key]
-            
-            if type_key == 'S':
-                return value
-            elif type_key == 'N':
-                return float(value) if '.' in value else int(value) # type: ignore
-            elif type_key == 'M':
-                return {k: deserialize_dynamodb(v) for k, v in value.items()}
-            elif type_key == 'L':
-                return [deserialize_dynamodb(i) for i in value] # type: ignore
-            elif type_key == 'BOOL':
-                return value
-            elif type_key == 'NULL':
-                return None # type: ignore
-        
-        return {k: deserialize_dynamodb(v) for k, v in item.items()}
-    
-    return item
+    """Convert a DynamoDB image (attribute name -> attribute value) to plain JSON."""
+    return _decode_map(item)
 
 
-def aggregate_all_messages(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Group records by contact, metadata, context and concatenate consecutive text messages."""
-    grouped = defaultdict(lambda: {'messaging_product': None, 'metadata': None, 'context': None, 'contacts': {}, 'messages': []})
-    
-    for record in records:
-        metadata = record.get('metadata', {})
-        context = record.get('context', {})
-        sender = record.get('from')
-        
-        key = (json.dumps(metadata, sort_keys=True), json.dumps(context, sort_keys=True), sender)
-        
-        grouped[key]['messaging_product'] = record.get('messaging_product')
-        grouped[key]['metadata'] = metadata
-        grouped[key]['context'] = context
-        grouped[key]['messages'].append(record) # type: ignore
-        
+def _merge_texts(texts):
+    merged = texts[-1].copy()
+    merged['text'] = {'body': '\n'.join(m['text']['body'] for m in texts)}
+    return merged
+
+
+def _message_payload(m):
+    return {
+        'from': m['from'],
+        'id': m['id'],
+        'timestamp': m['timestamp'],
+        'text': m.get('text'),
+        'type': m['type'],
+        'audio': m.get('audio'),
+        'image': m.get('image'),
+        'video': m.get('video'),
+        'document': m.get('document'),
+        'sticker': m.get('sticker'),
+        'location': m.get('location'),
+        'contacts': m.get('contacts'),
+        'interactive': m.get('interactive')
+    }
+
+
+class _Group:
+    """Messages of one sender to one business number, in arrival order."""
+
+    __slots__ = ('messaging_product', 'metadata', 'context', 'contacts', 'messages', 'last_timestamp', 'ordered')
+
+    def __init__(self):
+        self.messaging_product = None
+        self.metadata = None
+        self.context = None
+        self.contacts = {}
+        self.messages = []
+        self.last_timestamp = None
+        self.ordered = True
+
+    def add(self, record, metadata, sender):
+        self.messaging_product = record.get('messaging_product')
+        self.metadata = metadata
+        self.context = record.get('context', {})
+        self.messages.append(record)
+
         contact = record.get('contact')
         if contact:
-            grouped[key]['contacts'][sender] = contact # type: ignore
-    
-    result = []
-    for data in grouped.values():
-        sorted_msgs = sorted(data['messages'], key=lambda m: int(m.get('timestamp', 0))) # type: ignore
-        
+            self.contacts[sender] = contact
+
+        timestamp = int(record.get('timestamp', 0))
+        if self.last_timestamp is not None and timestamp < self.last_timestamp:
+            # stream order normally is timestamp order, sort only when it is not
+            self.ordered = False
+        self.last_timestamp = timestamp
+
+    def payload(self):
+        messages = self.messages
+        if not self.ordered:
+            messages = sorted(messages, key=lambda m: int(m.get('timestamp', 0)))
+
         aggregated = []
-        text_buffer = []
-        
-        for msg in sorted_msgs:
-            if msg.get('type') == 'text' and msg.get('from') == sorted_msgs[0].get('from'):
-                text_buffer.append(msg)
-            else:
-                if text_buffer:
-                    last = text_buffer[-1].copy()
-                    last['text'] = {'body': '\n'.join(m['text']['body'] for m in text_buffer)}
-                    aggregated.append(last)
-                    text_buffer = []
-                aggregated.append(msg)
-        
-        if text_buffer:
-            last = text_buffer[-1].copy()
-            last['text'] = {'body': '\n'.join(m['text']['body'] for m in text_buffer)}
-            aggregated.append(last)
-        
-        result.append({
-            'messaging_product': data['messaging_product'],
-            'metadata': data['metadata'],
-            'context': data['context'],
+        texts = []
+        for msg in messages:
+            if msg.get('type') == 'text':
+                texts.append(msg)
+                continue
+            if texts:
+                aggregated.append(_merge_texts(texts))
+                texts = []
+            aggregated.append(msg)
+        if texts:
+            aggregated.append(_merge_texts(texts))
+
+        return {
+            'messaging_product': self.messaging_product,
+            'metadata': self.metadata,
+            'context': self.context,
             'field': 'messages',
-            'contacts': [{'profile': c['profile'], 'wa_id': c['wa_id']} for c in data['contacts'].values()],
-            'messages': [{
-                'from': m['from'],
-                'id': m['id'],
-                'timestamp': m['timestamp'],
-                'text': m.get('text'),
-                'type': m['type'],
-                'audio': m.get('audio'),
-                'image': m.get('image'),
-                'video': m.get('video'),
-                'document': m.get('document'),
-                'sticker': m.get('sticker'),
-                'location': m.get('location'),
-                'contacts': m.get('contacts'),
-                'interactive': m.get('interactive')
-            } for m in aggregated]
-        })
-    
-    return result
+            'contacts': [{'profile': c['profile'], 'wa_id': c['wa_id']} for c in self.contacts.values()],
+            'messages': [_message_payload(m) for m in aggregated]
+        }
+
+
+def aggregate_all_messages(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Group records by business number and sender, and concatenate consecutive text messages.
+
+    A single pass over the records: groups are keyed by (phone_number_id, from)
+    and keep their messages in arrival order, sorted by timestamp only if they
+    arrived out of order.
+    """
+    groups = {}
+    for record in records:
+        metadata = record.get('metadata', {})
+        sender = record.get('from')
+        key = ((metadata or {}).get('phone_number_id'), sender)
+
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = _Group()
+        group.add(record, metadata, sender)
 
+    return [group.payload() for group in groups.values()]
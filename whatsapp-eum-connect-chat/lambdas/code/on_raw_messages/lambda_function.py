@@ -1,20 +1,209 @@
-import json, decimal, os, boto3, logging
+import json, decimal, os, boto3, logging, random, time
+from botocore.exceptions import ClientError
+from media_prefetch import prefetch_media
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+RAW_MESSAGES_TABLE = os.environ['RAW_MESSAGES_TABLE']
+# BatchWriteItem takes at most 25 items per request
+BATCH_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = int(os.environ.get("BATCH_WRITE_MAX_ATTEMPTS", 8))
+# raw items are only needed until aggregated (numeric TTL attribute "expires")
+RAW_MESSAGE_TTL_SECONDS = int(os.environ.get("RAW_MESSAGE_TTL_SECONDS", 86400))
+
+# "buffered" sends every message through the aggregator, "direct" invokes whatsapp_event_handler
+# right away for messages the aggregator never merges (anything but text)
+INBOUND_ROUTING_MODE = os.environ.get("INBOUND_ROUTING_MODE", "buffered")
+WHATSAPP_EVENT_HANDLER = os.environ.get("WHATSAPP_EVENT_HANDLER")
+# a buffered message can wait this long in the aggregator, plus some margin for the stream
+PENDING_SECONDS = float(os.environ.get("BUFFER_IN_SECONDS", 20)) + 10
+# whatsapp_event_handler clears a sender's direct slot once it has delivered the direct message;
+# if it never does (e.g. it timed out), the slot expires after this long (the handler's timeout)
+DIRECT_IN_FLIGHT_SECONDS = float(os.environ.get("DIRECT_IN_FLIGHT_SECONDS", 900))
+# per sender item (same table, same partition) recording what is on its way to the event handler
+IN_FLIGHT_ID = "#in-flight"
+# aggregated messages only carry these fields (same payload as message_aggregator)
+MESSAGE_FIELDS = ('from', 'id', 'timestamp', 'text', 'type', 'audio', 'image', 'video',
+                  'document', 'sticker', 'location', 'contacts', 'interactive')
+
 dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['RAW_MESSAGES_TABLE']) # type: ignore
+table = dynamodb.Table(RAW_MESSAGES_TABLE)
+lambda_client = boto3.client('lambda')
+
+
+def write_batch(requests, max_attempts=BATCH_WRITE_MAX_ATTEMPTS, base_delay=0.05, max_delay=2.0):
+    """Write up to 25 put requests, retrying unprocessed items with exponential backoff and jitter."""
+    for attempt in range(1, max_attempts + 1):
+        response = dynamodb.batch_write_item(RequestItems={RAW_MESSAGES_TABLE: requests})
+        requests = response.get("UnprocessedItems", {}).get(RAW_MESSAGES_TABLE, [])
+        if not requests:
+            return
+        if attempt == max_attempts:
+            raise RuntimeError(f"{len(requests)} raw messages still unprocessed after {max_attempts} attempts")
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))  # nosec B311 - jitter, not crypto
+        logger.warning(f"{len(requests)} unprocessed items, retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+
+def put_items(items):
+    """Write all items with batch writes. Duplicate keys (from, id) keep the last item: a batch may not repeat a key."""
+    unique = {(item.get("from"), item.get("id")): item for item in items}
+    requests = [{"PutRequest": {"Item": item}} for item in unique.values()]
+    for start in range(0, len(requests), BATCH_SIZE):
+        write_batch(requests[start:start + BATCH_SIZE])
+    return len(requests)
+
+
+def json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def claim_direct(sender, token, now):
+    """
+    Take the sender's direct slot: True if nothing of the sender is in flight (buffered or direct).
+
+    The conditional update serializes concurrent invocations for the same sender, so two
+    messages never go direct at the same time and none overtakes a buffered one. The slot
+    is held by token (the first direct message id) until whatsapp_event_handler clears it;
+    a redelivery of the same event takes it again.
+    """
+    until = int(now + DIRECT_IN_FLIGHT_SECONDS)
+    try:
+        table.update_item(
+            Key={"from": sender, "id": IN_FLIGHT_ID},
+            UpdateExpression="SET directUntil = :until, directToken = :token, expires = :expires",
+            ConditionExpression="directToken = :token"
+                                " OR ((attribute_not_exists(directUntil) OR directUntil < :now)"
+                                " AND (attribute_not_exists(bufferedUntil) OR bufferedUntil < :now))",
+            ExpressionAttributeValues={":until": until, ":token": token, ":now": int(now),
+                                       ":expires": until + RAW_MESSAGE_TTL_SECONDS},
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
+
+
+def mark_buffered(sender, now):
+    """
+    Record that the sender has messages in the buffer.
+
+    Returns (directUntil, directToken) of the sender's direct message still in flight, or None.
+    """
+    until = int(now + PENDING_SECONDS)
+    response = table.update_item(
+        Key={"from": sender, "id": IN_FLIGHT_ID},
+        UpdateExpression="SET bufferedUntil = :until, expires = :expires",
+        ExpressionAttributeValues={":until": until, ":expires": until + RAW_MESSAGE_TTL_SECONDS},
+        ReturnValues="ALL_NEW",
+    )
+    attributes = response.get("Attributes", {})
+    direct_until = int(attributes.get("directUntil", 0))
+    if direct_until <= now or not attributes.get("directToken"):
+        return None
+    return direct_until, attributes["directToken"]
+
+
+def direct_payload(items, token):
+    """
+    One sender's messages in the payload the aggregator sends to whatsapp_event_handler.
+
+    inFlight tells the handler which direct slot to clear once it is done.
+    """
+    first = items[0]
+    contact = first.get("contact") or {}
+    return {
+        'messaging_product': first.get('messaging_product'),
+        'metadata': first.get('metadata'),
+        'context': first.get('context'),
+        'field': 'messages',
+        'contacts': [{'profile': contact.get('profile'), 'wa_id': contact.get('wa_id')}] if contact else [],
+        'messages': [{field: item.get(field) for field in MESSAGE_FIELDS} for item in items],
+        'inFlight': {'from': first.get('from'), 'token': token},
+    }
+
+
+def sender_of(item):
+    return (item.get("metadata") or {}).get("phone_number_id"), item.get("from")
+
+
+def route_direct(items, now):
+    """
+    Pick the messages that go to whatsapp_event_handler right away, before they are written.
+
+    Per sender, only the non-text messages before its first text in the batch can go direct,
+    and only if the sender has nothing in flight (claim_direct): otherwise they are buffered
+    and the aggregator keeps the order. Buffered messages of a sender whose direct message is
+    still in flight carry holdUntil/holdToken: the aggregator holds them until the handler
+    clears the slot. Routed items are marked with routed="direct" and skipped by the aggregator.
+
+    Returns:
+        {sender: [items]} to invoke the handler with once the items are written (invoke_direct)
+    """
+    buffered = set()
+    direct = {}
+    for item in items:
+        sender = sender_of(item)
+        if item.get("type") == "text" or sender in buffered:
+            buffered.add(sender)
+            continue
+        direct.setdefault(sender, []).append(item)
+
+    for sender, sender_items in list(direct.items()):
+        if not claim_direct(sender[1], sender_items[0].get("id"), now):
+            buffered.add(sender)
+            del direct[sender]
+            continue
+        for item in sender_items:
+            item["routed"] = "direct"
+
+    hold = {}
+    for sender in buffered:
+        in_flight = mark_buffered(sender[1], now)
+        if in_flight:
+            hold[sender] = in_flight
+    for item in items:
+        sender = sender_of(item)
+        if sender in hold and item.get("routed") != "direct":
+            item["holdUntil"], item["holdToken"] = hold[sender]
+
+    return direct
+
+
+def invoke_direct(direct):
+    """
+    Invoke whatsapp_event_handler with each sender's direct messages, once they are written.
+
+    A failed invoke fails the invocation: the event is delivered again, the items are
+    rewritten (the aggregator only takes inserts) and claim_direct hands the slot back
+    to the same messages, which go direct again. Nothing goes through the buffer twice.
+    """
+    for sender, sender_items in direct.items():
+        lambda_client.invoke(
+            FunctionName=WHATSAPP_EVENT_HANDLER,
+            InvocationType='Event',
+            Payload=json.dumps(direct_payload(sender_items, sender_items[0].get("id")), default=json_default)
+        )
+    return sum(len(sender_items) for sender_items in direct.values())
+
 
 def lambda_handler(event, context):
     records = event.get("Records", [])
     logger.info(event)
 
+    # every message of every record, written together at the end
+    items = []
+
     for record in records:
         sns = record.get("Sns", {})
         sns_message_str = sns.get("Message", "{}")
         sns_message = json.loads(sns_message_str, parse_float=decimal.Decimal)
-        webhook_entry = json.loads(sns_message.get("whatsAppWebhookEntry", {}))
+        # DynamoDB takes no floats (location coordinates)
+        webhook_entry = json.loads(sns_message.get("whatsAppWebhookEntry", {}), parse_float=decimal.Decimal)
         message_context = sns_message.get("context", {})
         
         for change in webhook_entry.get("changes", []):
@@ -35,6 +224,25 @@ def lambda_handler(event, context):
                 contact = next((c for c in contacts if c.get("wa_id") == wa_id), {})
                 item["contact"] = contact
                 
-                table.put_item(Item=item)
+                items.append(item)
+
+    now = time.time()
+    for item in items:
+        item["expires"] = int(now) + RAW_MESSAGE_TTL_SECONDS
+
+    direct = {}
+    if INBOUND_ROUTING_MODE == "direct" and WHATSAPP_EVENT_HANDLER:
+        direct = route_direct(items, now)
+
+    written = put_items(items)
+    logger.info(f"{written} raw messages written")
+
+    if direct:
+        routed = invoke_direct(direct)
+        logger.info(f"{routed} messages routed directly to the event handler")
 
-    return {'statusCode': 200}
\ No newline at end of file
+    # the buffer wait has started: download buffered media meanwhile (direct ones are handled right away)
+    prefetched = prefetch_media([item for item in items if item.get("routed") != "direct"])
+    if prefetched:
+        logger.info(f"{len(prefetched)} media prefetched: {prefetched}")
+    return {'statusCode': 200}
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+BUCKET_NAME = os.environ.get("BUCKET_NAME")
+# same layout as whatsapp_event_handler (whatsapp.py and media_store.py), so its lookups find the prefetched media
+ATTACHMENT_PREFIX = os.environ.get("ATTACHMENT_PREFIX", "attachment_")
+MEDIA_INDEX_PREFIX = os.environ.get("MEDIA_INDEX_PREFIX", "media/")
+# index records older than the retention period (less a day) are ignored, as in media_store.py
+MEDIA_RETENTION_DAYS = int(os.environ.get("MEDIA_RETENTION_DAYS", 30))
+# media downloads running at the same time (0 disables prefetching)
+PREFETCH_MAX_WORKERS = int(os.environ.get("PREFETCH_MAX_WORKERS", 8))
+
+# stickers are left out: the event handler ignores them by default
+MEDIA_TYPES = ("audio", "image", "document", "video")
+
+socialmessaging = boto3.client("socialmessaging")
+s3 = boto3.client("s3")
+
+
+def content_key_from_sha256(sha256):
+    """Index key for the sha256 WhatsApp sends with the media (as in media_store.py)."""
+    if not sha256:
+        return None
+    return "sha256-" + sha256.replace("+", "-").replace("/", "_").rstrip("=")
+
+
+def phone_number_id_for(item):
+    """EUM phone number id (phone-number-id-...) of the business number that received the message."""
+    meta_phone_number_id = (item.get("metadata") or {}).get("phone_number_id")
+    for phone_number in (item.get("context") or {}).get("MetaPhoneNumberIds", []):
+        if phone_number.get("metaPhoneNumberId") == meta_phone_number_id:
+            return phone_number.get("arn", "").split(":")[-1].replace("/", "-")
+    return None
+
+
+def media_of(item):
+    """(media_id, sha256, origination phone number id) of a media message, or None."""
+    media = next((item[t] for t in MEDIA_TYPES if item.get("type") == t and item.get(t)), None)
+    if not media or not media.get("id"):
+        return None
+    phone_id = phone_number_id_for(item)
+    if not phone_id:
+        return None
+    return media["id"], media.get("sha256"), phone_id
+
+
+def get_record(name):
+    """Index record under MEDIA_INDEX_PREFIX, None if missing, unreadable or past retention."""
+    try:
+        response = s3.get_object(Bucket=BUCKET_NAME, Key=f"{MEDIA_INDEX_PREFIX}{name}.json")
+        record = json.loads(response["Body"].read())
+    except Exception:
+        return None
+    max_age_seconds = max(MEDIA_RETENTION_DAYS - 1, 0) * 86400
+    if max_age_seconds and time.time() - record.get("created", 0) > max_age_seconds:
+        return None
+    return record
+
+
+def put_record(name, record, only_new=False):
+    kwargs = {"IfNoneMatch": "*"} if only_new else {}
+    try:
+        s3.put_object(Bucket=BUCKET_NAME, Key=f"{MEDIA_INDEX_PREFIX}{name}.json",
+                      Body=json.dumps(record).encode("utf-8"), ContentType="application/json", **kwargs)
+    except ClientError as e:
+        # an existing content record keeps its derived artifacts (e.g. the WAV of a voice note)
+        if not only_new or e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+            raise
+
+
+def prefetch_one(media_id, sha256, phone_id):
+    """
+    Download one media into S3 and index it, unless the index already has it.
+
+    Lookups follow MediaStore.find_media: by media id, then by content (a forwarded
+    file has a new media id but the same sha256), which only adds the media id pointer.
+    """
+    if get_record(f"by-id/{media_id}"):
+        return None
+    content_key = content_key_from_sha256(sha256)
+    if content_key:
+        record = get_record(f"by-content/{content_key}")
+        if record:
+            put_record(f"by-id/{media_id}", dict(record, content_key=content_key))
+            return None
+
+    media_content = socialmessaging.get_whatsapp_message_media(
+        mediaId=media_id,
+        originationPhoneNumberId=phone_id,
+        destinationS3File={"bucketName": BUCKET_NAME, "key": ATTACHMENT_PREFIX},
+    )
+    media_content.pop("ResponseMetadata", None)
+    extension = media_content.get("mimeType", "").split("/")[-1]
+    record = dict(
+        media_content,
+        location=f"s3://{BUCKET_NAME}/{ATTACHMENT_PREFIX}{media_id}.{extension}",
+        content_key=content_key,
+        created=int(time.time()),
+    )
+    put_record(f"by-id/{media_id}", record)
+    if content_key:
+        put_record(f"by-content/{content_key}", record, only_new=True)
+    return record["location"]
+
+
+def prefetch_media(items, max_workers=PREFETCH_MAX_WORKERS):
+    """
+    Download the media of the given raw items into S3 while they wait in the buffer.
+
+    Media land where whatsapp_event_handler would put them and are recorded in
+    its media store index, so the handler finds them staged and skips the
+    download. Failures are logged only: the handler downloads whatever is missing.
+
+    Returns:
+        {media_id: S3 location} of the media downloaded.
+    """
+    media = {}
+    for item in items:
+        found = media_of(item)
+        if found:
+            media.setdefault(found[0], found)
+    if not media or not BUCKET_NAME or max_workers <= 0:
+        return {}
+
+    locations = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(media))) as pool:
+        futures = {media_id: pool.submit(prefetch_one, *args) for media_id, args in media.items()}
+    for media_id, future in futures.items():
+        error = future.exception()
+        if error:
+            logger.warning(f"Prefetch of media {media_id} failed: {error}")
+        elif future.result():
+            locations[media_id] = future.result()
+    return locations
@@ -14,6 +14,13 @@ transcribe_service = TranscribeService()
 
 def lambda_handler(event, context):
     print(event)
+    locations = event.get("locations")
+    if locations:
+        logger.info(f"Batch audio processing request for {len(locations)} files")
+        result = transcribe_service.transcribe(locations, batch=True)
+        logger.info(f"Batch transcription result: {result}")
+        return {"statusCode": 200, **result}
+
     location = event.get("location")
     if location:
         logger.info(f"Direct audio processing request for: {location}")
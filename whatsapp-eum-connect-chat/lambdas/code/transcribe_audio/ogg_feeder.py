@@ -0,0 +1,162 @@
+import asyncio
+import os
+import struct
+import threading
+
+
+OGG_CAPTURE_PATTERN = b"OggS"
+OGG_HEADER_SIZE = 27
+# Opus granule positions always count samples at 48 kHz, whatever the input rate
+OPUS_GRANULE_RATE = 48000
+
+CHUNK_SIZE = 1024 * 8
+
+# How much faster than real time audio is fed to Transcribe. Capped at
+# MAX_SPEED_FACTOR: feeding faster risks the service rejecting the stream.
+MAX_SPEED_FACTOR = 4.0
+SPEED_FACTOR = min(float(os.environ.get("TRANSCRIBE_SPEED_FACTOR", 3.0)), MAX_SPEED_FACTOR)
+
+# chunks read from S3 ahead of the feeder, which bounds memory per stream
+READ_AHEAD_CHUNKS = int(os.environ.get("TRANSCRIBE_READ_AHEAD_CHUNKS", 8))
+
+
+def _read_exact(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def iter_ogg_pages(stream):
+    """
+    Yield (page, granule_position) for every page of an Ogg stream.
+
+    Args:
+        stream: file-like object with read(size)
+
+    Raises:
+        ValueError: If the data is not a well-formed Ogg stream
+    """
+    while True:
+        header = _read_exact(stream, OGG_HEADER_SIZE)
+        if not header:
+            return
+        if len(header) < OGG_HEADER_SIZE or header[:4] != OGG_CAPTURE_PATTERN:
+            raise ValueError("Invalid Ogg page header")
+
+        granule_position = struct.unpack_from("<q", header, 6)[0]
+        lacing = _read_exact(stream, header[26])
+        body = _read_exact(stream, sum(lacing))
+        if len(lacing) < header[26] or len(body) < sum(lacing):
+            raise ValueError("Truncated Ogg page")
+
+        yield header + lacing + body, granule_position
+
+
+def ogg_chunks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Group whole Ogg pages into chunks of about chunk_size bytes.
+
+    Yields:
+        (chunk, audio_seconds): audio_seconds is the playback position reached
+        at the end of the chunk, from the last known granule position.
+    """
+    buffer = []
+    buffered = 0
+    audio_seconds = 0.0
+    for page, granule_position in iter_ogg_pages(stream):
+        # -1 marks a page where no packet ends: the position does not move
+        if granule_position >= 0:
+            audio_seconds = granule_position / OPUS_GRANULE_RATE
+        buffer.append(page)
+        buffered += len(page)
+        if buffered >= chunk_size:
+            yield b"".join(buffer), audio_seconds
+            buffer, buffered = [], 0
+    if buffer:
+        yield b"".join(buffer), audio_seconds
+
+
+async def read_ahead(chunks, max_chunks=READ_AHEAD_CHUNKS):
+    """
+    Iterate a blocking iterator (e.g. ogg_chunks over an S3 body) from a worker thread.
+
+    At most max_chunks items are read ahead of the consumer, so download and
+    sending overlap while memory stays bounded.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max(1, max_chunks))
+    stopped = threading.Event()
+    end = object()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        try:
+            for item in chunks:
+                if stopped.is_set():
+                    return
+                put((item, None))
+            put((end, None))
+        except Exception as e:
+            put((None, e))
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if error:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        # unblock the producer if the consumer stopped early
+        stopped.set()
+        while not producer.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.sleep(0.01)
+
+
+async def feed_paced(chunks, send, speed_factor=SPEED_FACTOR, clock=None, sleep=asyncio.sleep):
+    """
+    Send audio chunks paced by their real audio duration.
+
+    A chunk is sent once the previous one has had time to "play" at
+    speed_factor times real time. Nothing waits after the last chunk.
+
+    Args:
+        chunks: iterable or async iterable of (chunk, audio_seconds), as produced
+            by ogg_chunks or read_ahead
+        send: coroutine function called with each chunk
+        speed_factor: playback speed relative to real time
+        clock, sleep: time source and sleep coroutine (overridable for benchmarks)
+
+    Returns:
+        Audio seconds sent.
+    """
+    clock = clock or asyncio.get_running_loop().time
+    speed_factor = max(speed_factor, 0.1)
+    start = clock()
+    audio_seconds = 0.0
+    async for chunk, chunk_end in _as_async(chunks):
+        delay = start + audio_seconds / speed_factor - clock()
+        if delay > 0:
+            await sleep(delay)
+        await send(chunk)
+        audio_seconds = chunk_end
+    return audio_seconds
+
+
+async def _as_async(chunks):
+    if hasattr(chunks, "__aiter__"):
+        async for item in chunks:
+            yield item
+    else:
+        for item in chunks:
+            yield item
@@ -1,28 +1,33 @@
 
 import boto3
 from botocore.exceptions import ClientError
-import io
+import os
 import asyncio
 import time
+from contextlib import aclosing
 
 from amazon_transcribe.client import TranscribeStreamingClient
 from amazon_transcribe.handlers import TranscriptResultStreamHandler
 from amazon_transcribe.model import TranscriptEvent
 from amazon_transcribe.utils import apply_realtime_delay
 
+from ogg_feeder import ogg_chunks, feed_paced, read_ahead, CHUNK_SIZE
+from transcript_cache import TranscriptCache, audio_fingerprint
+
 
 import logging
 logger = logging.getLogger(__name__)
 
 
 SAMPLE_RATE = 48000
-BYTES_PER_SAMPLE = 2
-CHANNEL_NUMS = 1
 
-# Parse S3 location
-CHUNK_SIZE = 1024 * 8
 REGION = "us-east-1"
 
+LANGUAGE_CODE = os.environ.get("TRANSCRIBE_LANGUAGE_CODE", "es-US")
+
+# streaming sessions run at the same time in batch mode
+MAX_CONCURRENT_STREAMS = int(os.environ.get("MAX_CONCURRENT_STREAMS", 5))
+
 
 
 class MyEventHandler(TranscriptResultStreamHandler):
@@ -43,9 +48,11 @@ class MyEventHandler(TranscriptResultStreamHandler):
 
 
 class TranscribeService:
-    def __init__(self, ) -> None:
+    def __init__(self, cache=None, language_code=LANGUAGE_CODE) -> None:
         self.transcribe_client = TranscribeStreamingClient(region=REGION)
         self.s3_client = boto3.client('s3')
+        self.cache = cache if cache is not None else TranscriptCache()
+        self.language_code = language_code
 
     def parse_s3_location(self, s3_location):
         s3_bucket = s3_location.split('/')[2]
@@ -56,10 +63,27 @@ class TranscribeService:
         s3_bucket, s3_key = self.parse_s3_location(s3_location)
         return self.s3_client.get_object(Bucket=s3_bucket, Key=s3_key)
         
+    def get_fingerprint(self, s3_location):
+        try:
+            return audio_fingerprint(self.s3_client, *self.parse_s3_location(s3_location))
+        except ClientError as e:
+            logger.warning(f"No fingerprint for {s3_location}: {e}")
+            return None
+
     async def basic_transcribe(self, s3_location):
+        """Transcript of one file, from the cache when this audio was already transcribed."""
+        if not self.cache.enabled:
+            return await self.stream_transcribe(s3_location)
+
+        fingerprint = await asyncio.get_running_loop().run_in_executor(None, self.get_fingerprint, s3_location)
+        return await self.cache.get_or_transcribe(
+            fingerprint, self.language_code, lambda: self.stream_transcribe(s3_location)
+        )
+
+    async def stream_transcribe(self, s3_location):
         # Start transcription to generate our async stream
         stream = await self.transcribe_client.start_stream_transcription(
-            language_code="es-US",
+            language_code=self.language_code,
             # language_options = ["es-US", "en-US"], # no soportado en este client
             # identify_language=True, # no soportado en este client
             media_sample_rate_hz=SAMPLE_RATE,
@@ -67,23 +91,22 @@ class TranscribeService:
         )
 
         async def write_chunks():
-            response = self.get_s3_object(s3_location)
-            audio_data = response['Body'].read()
-            
-            # Create a file-like object from the downloaded data
-            audio_stream = io.BytesIO(audio_data)
-            
-            while True:
-                chunk = audio_stream.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                print ("sending chunk:", len(chunk))
+            # off the event loop, other streams of a batch keep running
+            response = await asyncio.get_running_loop().run_in_executor(None, self.get_s3_object, s3_location)
+            # read straight from the S3 body: download and transcription overlap
+            audio_stream = response['Body']
+
+            async def send_chunk(chunk):
                 await stream.input_stream.send_audio_event(audio_chunk=chunk)
-                slee_time = CHUNK_SIZE *16 / (SAMPLE_RATE * BYTES_PER_SAMPLE * CHANNEL_NUMS)
-                print("sleeptime:", slee_time)
-                await asyncio.sleep(slee_time)
-                
-            await stream.input_stream.end_stream()
+
+            try:
+                # whole Ogg pages, paced by the audio time they carry
+                async with aclosing(read_ahead(ogg_chunks(audio_stream, CHUNK_SIZE))) as chunks:
+                    audio_seconds = await feed_paced(chunks, send_chunk)
+                print(f"sent {audio_seconds:.2f}s of audio")
+            finally:
+                audio_stream.close()
+                await stream.input_stream.end_stream()
 
         # Instantiate our handler and start processing events
         handler = MyEventHandler(stream.output_stream)
@@ -91,17 +114,53 @@ class TranscribeService:
         return " ".join(handler.transcript)
 
 
-    def transcribe(self,s3_location, batch=False):
+    async def batch_transcribe(self, s3_locations, max_concurrency=MAX_CONCURRENT_STREAMS):
+        """
+        Transcribe several files on one event loop, at most max_concurrency streams at a time.
+
+        Returns:
+            (transcriptions, errors): dicts keyed by S3 location. A failed item
+            lands in errors and does not affect the others.
+        """
+        locations = list(dict.fromkeys(s3_locations))
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def transcribe_one(location):
+            async with semaphore:
+                return await self.basic_transcribe(location)
+
+        results = await asyncio.gather(*(transcribe_one(l) for l in locations), return_exceptions=True)
+
+        transcriptions, errors = {}, {}
+        for location, result in zip(locations, results):
+            if isinstance(result, Exception):
+                logger.error(f"Transcription failed for {location}: {result}")
+                errors[location] = str(result)
+            else:
+                transcriptions[location] = result
+        return transcriptions, errors
+
+
+    def transcribe(self,s3_location, batch=False, max_concurrency=MAX_CONCURRENT_STREAMS):
+        """
+        Transcribe one S3 location, or a list of them with batch=True.
+
+        In batch mode returns {"transcriptions": {location: text}, "errors": {location: error}}.
+        """
         # Time the transcription process
         if batch:
-            print("Transcribing batch of ", len(s3_location), " files not Implemented")
+            print("Transcribing batch of ", len(s3_location), " files")
  
         start_time = time.time()
         
         # amazonq-ignore-next-line
         loop = asyncio.get_event_loop()
-        # amazonq-ignore-next-line
-        val = loop.run_until_complete(self.basic_transcribe(s3_location))
+        if batch:
+            transcriptions, errors = loop.run_until_complete(self.batch_transcribe(s3_location, max_concurrency))
+            val = {"transcriptions": transcriptions, "errors": errors}
+        else:
+            # amazonq-ignore-next-line
+            val = loop.run_until_complete(self.basic_transcribe(s3_location))
         #print("val:",val)
         #loop.close() # Not closing in AWS Lambda 
         
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+import time
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_CACHE_TABLE = os.environ.get("TRANSCRIPT_CACHE_TABLE")
+TRANSCRIPT_CACHE_TTL_SECONDS = int(os.environ.get("TRANSCRIPT_CACHE_TTL_SECONDS", 30 * 86400))
+
+
+def audio_fingerprint(s3_client, s3_bucket, s3_key):
+    """
+    Fingerprint of an audio object: its S3 ETag.
+
+    The ETag is a hash of the object content, so a retried or forwarded note
+    saved again under another key gets the same fingerprint, and it costs a
+    HEAD request instead of reading the audio twice.
+    """
+    etag = s3_client.head_object(Bucket=s3_bucket, Key=s3_key).get("ETag")
+    return "etag-" + etag.strip('"') if etag else None
+
+
+class TranscriptCache:
+    """
+    Transcripts already produced, keyed by audio fingerprint and language code.
+
+    Items live in a DynamoDB table (partition key fingerprint, sort key
+    languageCode) and expire through its TTL attribute. Cache failures are
+    logged and treated as misses, never as transcription failures.
+    """
+
+    def __init__(self, table=None, table_name=TRANSCRIPT_CACHE_TABLE, ttl_seconds=TRANSCRIPT_CACHE_TTL_SECONDS) -> None:
+        if table is None and table_name:
+            table = boto3.resource("dynamodb").Table(table_name)
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self):
+        return self.table is not None
+
+    def get(self, fingerprint, language_code):
+        """Cached transcript, or None."""
+        if not self.enabled or not fingerprint:
+            return None
+        try:
+            item = self.table.get_item(Key={"fingerprint": fingerprint, "languageCode": language_code}).get("Item")
+        except Exception as e:
+            logger.warning(f"Transcript cache read failed: {e}")
+            return None
+        # TTL deletion is lazy: an expired item can still be returned for a while
+        if not item or int(item.get("expires", 0)) < time.time():
+            return None
+        return item.get("transcript")
+
+    def put(self, fingerprint, language_code, transcript):
+        if not self.enabled or not fingerprint:
+            return
+        try:
+            self.table.put_item(Item={
+                "fingerprint": fingerprint,
+                "languageCode": language_code,
+                "transcript": transcript,
+                "expires": int(time.time()) + self.ttl_seconds,
+            })
+        except Exception as e:
+            logger.warning(f"Transcript cache write failed: {e}")
+
+    async def get_or_transcribe(self, fingerprint, language_code, transcribe):
+        """
+        Return the cached transcript, or await transcribe() and cache its result.
+
+        Args:
+            fingerprint: audio fingerprint, None to bypass the cache
+            language_code: language the audio is transcribed in
+            transcribe: coroutine function producing the transcript
+
+        Empty transcripts are not cached, so a stream that produced nothing is
+        retried next time.
+        """
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, self.get, fingerprint, language_code)
+        if cached is not None:
+            logger.info(f"Transcript cache hit for {fingerprint}")
+            return cached
+
+        transcript = await transcribe()
+        if transcript:
+            await loop.run_in_executor(None, self.put, fingerprint, language_code, transcript)
+        return transcript
@@ -0,0 +1,69 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+ACK_LINGER_SECONDS = float(os.environ.get("ACK_LINGER_SECONDS", 0.5))
+ACK_MAX_WORKERS = int(os.environ.get("ACK_MAX_WORKERS", 8))
+
+
+class AckDispatcher:
+    """
+    Send read receipts and reactions off the critical path.
+
+    Signals are sent in parallel on a thread pool. Reactions to the same message
+    are coalesced: a reaction waits up to linger_seconds before being sent, and
+    only the latest emoji requested for the message by then is delivered. Call
+    flush() before the handler returns.
+    """
+
+    def __init__(self, max_workers=ACK_MAX_WORKERS, linger_seconds=ACK_LINGER_SECONDS) -> None:
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.linger_seconds = linger_seconds
+        self._lock = threading.Lock()
+        self._flushing = threading.Event()
+        self._latest = {}  # message_id -> (message, emoji) not sent yet
+        self._active = set()  # message_ids with a sender job running
+
+    def mark_as_read(self, message):
+        self._submit(message.mark_as_read)
+
+    def react(self, message, emoji):
+        with self._lock:
+            self._latest[message.message_id] = (message, emoji)
+            if message.message_id in self._active:
+                return
+            self._active.add(message.message_id)
+        self._submit(self._send_reactions, message.message_id)
+
+    def flush(self):
+        """Send everything still pending and wait for it. No signals can be added afterwards."""
+        self._flushing.set()
+        self.pool.shutdown(wait=True)
+
+    def _send_reactions(self, message_id):
+        # give later reactions a chance to supersede this one
+        self._flushing.wait(self.linger_seconds)
+        # one job per message keeps its reactions in order
+        while True:
+            with self._lock:
+                latest = self._latest.pop(message_id, None)
+                if latest is None:
+                    self._active.discard(message_id)
+                    return
+            message, emoji = latest
+            try:
+                message.reaction(emoji)
+            except Exception as e:
+                logger.warning(f"Failed to send reaction {emoji}: {e}")
+
+    def _submit(self, fn, *args):
+        def run():
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.warning(f"Failed to send acknowledgement: {e}")
+
+        self.pool.submit(run)
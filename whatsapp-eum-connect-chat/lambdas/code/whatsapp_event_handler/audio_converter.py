@@ -1,10 +1,80 @@
 import json
 import os
 import logging
-import boto3
+import struct
+import subprocess  # nosec B404 - subprocess required for ffmpeg invocation; fixed argv, data only via pipes
+from aws_clients import get_client
 
 logger = logging.getLogger()
-lambda_client = boto3.client('lambda')
+lambda_client = get_client('lambda')
+
+# "remote" invokes the convert_to_wav lambda, "local" runs ffmpeg in this lambda
+AUDIO_CONVERSION_MODE = os.environ.get("AUDIO_CONVERSION_MODE", "remote")
+
+# same output settings as the convert_to_wav lambda, so both modes produce the same file
+FFMPEG_WAV_ARGS = ['-acodec', 'pcm_s16le', '-ar', '16000', '-ac', '1']
+
+
+def fix_wav_header(wav: bytes) -> bytes:
+    """
+    Write the real RIFF and data chunk sizes into a WAV produced on a pipe.
+
+    ffmpeg cannot seek back on a pipe, so it leaves placeholder sizes where a
+    file output would have the final ones.
+    """
+    fixed = bytearray(wav)
+    if fixed[:4] != b'RIFF' or fixed[8:12] != b'WAVE':
+        raise ValueError("Not a WAV stream")
+    struct.pack_into('<I', fixed, 4, len(fixed) - 8)
+
+    offset = 12
+    while offset + 8 <= len(fixed):
+        chunk_id = bytes(fixed[offset:offset + 4])
+        if chunk_id == b'data':
+            struct.pack_into('<I', fixed, offset + 4, len(fixed) - offset - 8)
+            break
+        chunk_size = struct.unpack_from('<I', fixed, offset + 4)[0]
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return bytes(fixed)
+
+
+def convert_bytes_to_wav(content: bytes) -> bytes:
+    """
+    Convert OGG audio already in memory to WAV, running ffmpeg in this lambda.
+
+    Args:
+        content: OGG/Opus bytes
+
+    Returns:
+        WAV bytes, or None if conversion failed
+    """
+    # Using list form (not shell=True) with a fixed argv: audio only flows
+    # through stdin/stdout, no path or user input reaches the command line.
+    command = [
+        'ffmpeg', '-hide_banner',
+        '-protocol_whitelist', 'pipe',
+        '-f', 'ogg', '-i', 'pipe:0',
+        *FFMPEG_WAV_ARGS,
+        '-f', 'wav', 'pipe:1',
+    ]
+    logger.info("Running ffmpeg command: %s", command)
+    try:
+        result = subprocess.run(  # nosemgrep: dangerous-subprocess-use-audit  # nosec B603
+            command,
+            shell=False,
+            input=content,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except Exception as e:
+        logger.error(f"Error running ffmpeg: {str(e)}")
+        return None
+
+    if result.returncode != 0:
+        logger.error(f"ffmpeg conversion failed: {result.stderr.decode(errors='replace')[-2000:]}")
+        return None
+
+    return fix_wav_header(result.stdout)
 
 
 def convert_to_wav(location: str) -> str:
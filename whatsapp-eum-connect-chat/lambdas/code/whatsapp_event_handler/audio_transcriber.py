@@ -1,15 +1,11 @@
 import json
 import os
 import logging
-import boto3
-from botocore.config import Config
+from aws_clients import get_client
 
 
 logger = logging.getLogger()
-lambda_client = boto3.client('lambda', config=Config(
-    read_timeout=300,
-    connect_timeout=10
-))
+lambda_client = get_client('lambda', read_timeout=300, connect_timeout=10)
 
 def transcribe_audio(location: str) -> str:
     """
@@ -53,3 +49,43 @@ def transcribe_audio(location: str) -> str:
     except Exception as e:
         logger.error(f"Error invoking transcribe lambda: {str(e)}")
         return None
+
+
+def transcribe_audio_batch(locations: list) -> dict:
+    """
+    Invoke the transcribe lambda once for several audio files.
+
+    Args:
+        locations: S3 URIs of the audio files to transcribe
+
+    Returns:
+        Dict of S3 URI -> transcription. Files that failed are missing from it.
+    """
+    transcribe_lambda = os.environ.get('TRANSCRIBE_HANDLER')
+    if not transcribe_lambda:
+        logger.warning("TRANSCRIBE_HANDLER environment variable not set")
+        return {}
+    try:
+        payload = {'locations': locations}
+        logger.info(f"Invoking transcribe lambda with {len(locations)} locations")
+
+        response = lambda_client.invoke(
+            FunctionName=transcribe_lambda,
+            InvocationType='RequestResponse',
+            Payload=json.dumps(payload)
+        )
+
+        result = json.loads(response['Payload'].read())
+        logger.info(f"Transcribe lambda response: {result}")
+
+        if result.get('statusCode') == 200:
+            for location, error in result.get('errors', {}).items():
+                logger.error(f"Transcription failed for {location}: {error}")
+            return result.get('transcriptions', {})
+        else:
+            logger.error(f"Transcribe lambda failed: {result.get('error')}")
+            return {}
+
+    except Exception as e:
+        logger.error(f"Error invoking transcribe lambda: {str(e)}")
+        return {}
@@ -0,0 +1,64 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+
+# Shared by every service class in this handler. Clients are built once per
+# container and reused by every message of every warm invocation.
+MAX_POOL_CONNECTIONS = int(os.environ.get("MAX_POOL_CONNECTIONS", 32))
+
+BASE_CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+)
+
+_session = boto3.session.Session()
+_clients = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_client(service_name, **config_overrides):
+    """
+    Return the container-wide client for a service.
+
+    Args:
+        service_name: boto3 service name (e.g. 's3', 'socialmessaging')
+        **config_overrides: botocore Config options (e.g. read_timeout=300). Each
+            distinct set of overrides gets its own client.
+
+    Returns:
+        A cached boto3 client. Clients are thread-safe and can be shared.
+    """
+    key = (service_name, tuple(sorted(config_overrides.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                config = BASE_CLIENT_CONFIG
+                if config_overrides:
+                    config = config.merge(Config(**config_overrides))
+                client = _session.client(service_name, config=config)
+                _clients[key] = client
+    return client
+
+
+def get_resource(service_name):
+    """
+    Return a cached boto3 resource for the calling thread.
+
+    boto3 resources are not thread-safe, so one is kept per thread. They are
+    still reused across messages and warm invocations.
+    """
+    resources = getattr(_local, "resources", None)
+    if resources is None:
+        resources = _local.resources = {}
+    resource = resources.get(service_name)
+    if resource is None:
+        with _lock:
+            resource = _session.resource(service_name, config=BASE_CLIENT_CONFIG)
+        resources[service_name] = resource
+    return resource
@@ -1,6 +1,6 @@
 import json
 import logging
-import boto3
+from aws_clients import get_client
 from typing import Dict, Any
 
 logger = logging.getLogger()
@@ -24,7 +24,7 @@ def get_ssm_parameter(parameter_name: str) -> Dict[str, Any]:
         raise ValueError("Parameter name cannot be empty")
     
     try:
-        ssm_client = boto3.client('ssm')
+        ssm_client = get_client('ssm')
         logger.info(f"Retrieving SSM parameter: {parameter_name}")
         
         response = ssm_client.get_parameter(
@@ -70,7 +70,7 @@ def get_secret_value(secret_arn: str) -> str:
         raise ValueError("Secret ARN cannot be empty")
     
     try:
-        secrets_client = boto3.client('secretsmanager')
+        secrets_client = get_client('secretsmanager')
         logger.info(f"Retrieving secret")
         
         response = secrets_client.get_secret_value(SecretId=secret_arn)
@@ -1,12 +1,9 @@
-import boto3
 import os
-import sys
 import requests
 from urllib.parse import urlparse
 from botocore.exceptions import ClientError
 
-participant_client = boto3.client("connectparticipant")
-connect_client = boto3.client("connect")
+from aws_clients import get_client
 
 
 class ChatService:
@@ -17,8 +14,8 @@ class ChatService:
         chat_duration_minutes=60,
         topic_arn = os.environ.get("TOPIC_ARN")
     ) -> None:
-        self.participant = boto3.client("connectparticipant")
-        self.connect = boto3.client("connect")
+        self.participant = get_client("connectparticipant")
+        self.connect = get_client("connect")
         self.contact_flow_id = contact_flow_id
         self.instance_id = instance_id
         self.chat_duration_minutes = chat_duration_minutes
@@ -51,9 +48,16 @@ class ChatService:
         print (start_chat_response)
         return start_chat_response
 
-    def send_message_with_retry_connection(self,text, message, connectionToken):
+    def send_message_with_retry_connection(self,text, message, connectionToken, connections=None):
         customer_name = message.message.get("customer_name", "NN")
         result = self.send_message(text, connectionToken)
+        if result == "ACCESS_DENIED" and connections:
+            # another container may have renewed the chat: try the token in the table before starting one
+            contact = connections.refresh_contact(message.phone_number)
+            if contact and contact.get("connectionToken") not in (None, connectionToken):
+                result = self.send_message(text, contact["connectionToken"])
+            if contact and result == "ACCESS_DENIED":
+                connections.remove_contactId(contact["contactId"])
         if result == "ACCESS_DENIED":
             contactId, participantToken, connectionToken = (
                 self.start_chat_and_stream(
@@ -73,6 +77,15 @@ class ChatService:
             fileContents=fileContents, fileName=fileName, fileType=fileType, ConnectionToken=connectionToken
         )
 
+        contact = None
+        if error_str == "ACCESS_DENIED":
+            # another container may have renewed the chat: try the token in the table before starting one
+            contact = connections.refresh_contact(message.phone_number)
+            if contact and contact.get("connectionToken") not in (None, connectionToken):
+                attachment_id, error_str = self.attach_file(
+                    fileContents=fileContents, fileName=fileName, fileType=fileType, ConnectionToken=contact["connectionToken"]
+                )
+
         if error_str == "ACCESS_DENIED":
             # Chat expired — start a new one
             customer_name = message.message.get("customer_name", "NN")
@@ -83,7 +96,6 @@ class ChatService:
             )
 
             # Update connection in DynamoDB
-            contact = connections.get_contact(message.phone_number)
             if contact:
                 connections.remove_contactId(contact["contactId"])
             connections.update_contact(
@@ -129,7 +141,7 @@ class ChatService:
             print ("Missing Topic ARN for start streamming")
             return None
 
-        start_stream_response = connect_client.start_contact_streaming(
+        start_stream_response = self.connect.start_contact_streaming(
             InstanceId=self.instance_id,
             ContactId=ContactId,
             ChatStreamingConfiguration={"StreamingEndpointArn": self.topic_arn})
@@ -171,11 +183,11 @@ class ChatService:
             return response["Url"]
 
     def attach_file(self, fileContents,fileName,fileType,ConnectionToken):
-        
-        fileSize = sys.getsizeof(fileContents) - 33 ## Removing BYTES overhead
-        print("Size downloaded:" + str(fileSize))
+        # fileContents is bytes or a sized stream (S3Stream), which is uploaded in blocks
+        fileSize = len(fileContents)
+        print("Size to upload:" + str(fileSize))
         try:
-            attachResponse = participant_client.start_attachment_upload(
+            attachResponse = self.participant.start_attachment_upload(
             ContentType=fileType,
             AttachmentSizeInBytes=fileSize,
             AttachmentName=fileName,
@@ -240,7 +252,7 @@ class ChatService:
                 return None, str(e)
             else:
                 print(filePostingResponse.status_code) 
-                verificationResponse = participant_client.complete_attachment_upload(
+                verificationResponse = self.participant.complete_attachment_upload(
                     AttachmentIds=[attachResponse['AttachmentId']],
                     ConnectionToken=ConnectionToken)
                 print("Verification Response")
@@ -1,8 +1,15 @@
-import boto3
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
 
 import os
+import threading
+import time
+
+from aws_clients import get_resource
+
+SESSION_CACHE_TTL_SECONDS = int(os.environ.get("SESSION_CACHE_TTL_SECONDS", 0))
+
+MISS = object()
 
 
 def build_update_expression(to_update):
@@ -18,10 +25,67 @@ def build_update_expression(to_update):
     return attr_names, attr_values, f"SET {', '.join(update_expression_list)}"
 
 
+class SessionCache:
+    """
+    customerId -> connection item, in front of the connections table.
+
+    With ttl_seconds=None entries never expire, which suits a cache that lives
+    for a single invocation. A warm-container cache should use a short TTL, as
+    other containers may renew the same customer's chat. A customer without a
+    connection is cached as None.
+    """
+
+    def __init__(self, ttl_seconds=None) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, customerId):
+        """Return the cached item (possibly None), or MISS."""
+        with self._lock:
+            entry = self._items.get(customerId)
+            if entry and (entry[0] is None or entry[0] > time.monotonic()):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return MISS
+
+    def put(self, customerId, item):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._items[customerId] = (expires_at, item)
+
+    def invalidate(self, customerId):
+        with self._lock:
+            self._items.pop(customerId, None)
+
+    def invalidate_contact(self, contactId):
+        with self._lock:
+            for customerId, (_, item) in list(self._items.items()):
+                if item and item.get("contactId") == contactId:
+                    del self._items[customerId]
+
+    def stats(self, reset=False):
+        """Hit/miss counts, since the last reset: a warm cache is reset after each invocation logs them."""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            if reset:
+                self.hits = self.misses = 0
+        lookups = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": round(hits / lookups, 3) if lookups else 0.0}
+
+
+# shared by warm invocations only when a TTL is configured
+warm_session_cache = SessionCache(SESSION_CACHE_TTL_SECONDS) if SESSION_CACHE_TTL_SECONDS > 0 else None
+
+
 class ConnectionsService:
-    def __init__(self, connections_table_name=os.environ.get("TABLE_NAME")) -> None:
-        self.dynamodb = boto3.resource("dynamodb")
-        self.table = self.dynamodb.Table(connections_table_name)
+    def __init__(self, connections_table_name=os.environ.get("TABLE_NAME"), cache=None) -> None:
+        self.table_name = connections_table_name
+        self.cache = cache if cache is not None else SessionCache()
+        self.table = get_resource("dynamodb").Table(connections_table_name)
 
     def insert_contact( self, customerId, channel, contactId, participantToken, connectionToken, name, systemNumber):
         try:
@@ -37,6 +101,7 @@ class ConnectionsService:
         except Exception as e:
             print(e)
         else:
+            self.cache.put(customerId, dict(contactId=contactId, **to_update))
             return table_update
         
     def update_contact( self, customerId, channel, contactId, participantToken, connectionToken, name, systemNumber):
@@ -53,18 +118,29 @@ class ConnectionsService:
         except Exception as e:
             print(e)
         else:
+            self.cache.put(customerId, dict(contactId=contactId, **to_update))
             return table_update
 
 
 
     def get_contact(self, customerId, index_name = "customerId-index"):
+        cached = self.cache.get(customerId)
+        if cached is not MISS:
+            return cached
+
         contactId = None
         response = self.table.query(IndexName=index_name, KeyConditionExpression=Key("customerId").eq(customerId))
 
         if response["Items"]: contactId = response["Items"][0]
 
+        self.cache.put(customerId, contactId)
         return contactId
 
+    def refresh_contact(self, customerId):
+        """get_contact from the table: the cached item may be stale if another container renewed the chat."""
+        self.cache.invalidate(customerId)
+        return self.get_contact(customerId)
+
 
     def remove_contactId(self, contactId):
 
@@ -73,6 +149,7 @@ class ConnectionsService:
         except Exception as e:
             print(e)
         else:
+            self.cache.invalidate_contact(contactId)
             return
 
 
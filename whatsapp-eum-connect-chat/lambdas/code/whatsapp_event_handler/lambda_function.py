@@ -1,50 +1,164 @@
 import json, decimal
 import os
 import logging
+import threading
 import boto3
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from whatsapp import WhatsappService, WhatsappMessage
-from connections_service import ConnectionsService
+from connections_service import ConnectionsService, warm_session_cache
 from connect_chat_service import ChatService
 from config_service import get_secret_value, get_ssm_parameter
-from audio_converter import convert_to_wav
-from audio_transcriber import transcribe_audio
+from audio_converter import convert_to_wav, convert_bytes_to_wav, AUDIO_CONVERSION_MODE
+from audio_transcriber import transcribe_audio, transcribe_audio_batch
+from acknowledgements import AckDispatcher
+from media_store import media_store
+from aws_clients import get_client
+from botocore.exceptions import ClientError
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+TRANSCRIPTION_WORKERS = int(os.environ.get("TRANSCRIPTION_WORKERS", 10))
+# raw messages table of on_raw_messages, where a direct message holds its sender's slot (inFlight in the event)
+RAW_MESSAGES_TABLE = os.environ.get("RAW_MESSAGES_TABLE")
+IN_FLIGHT_ID = "#in-flight"
+
+# voice notes are transcribed here while the WAV is converted and uploaded
+transcription_pool = ThreadPoolExecutor(max_workers=TRANSCRIPTION_WORKERS)
+
 
 def get_extension_by_file_type(file_type):
+    if not file_type: return "unknown"
     if "jpeg" in file_type: return "jpeg"
     if "png" in file_type: return "png"
     return "unknown"
 
 
-def process_attachment(chat:ChatService, connections, message):
+def start_batch_transcription(messages):
+    """
+    Transcribe the voice notes of the batch in the background, each note resolving its own Future.
+
+    Every note is looked up in the media store in parallel. Notes already staged in S3
+    (prefetched, or seen before) share a single transcribe invocation; the others are
+    downloaded and transcribed one by one, in parallel, as their download completes. A
+    note never waits for another note's download. Returns {message_id: Future of the
+    transcription}. Batches with fewer than two voice notes are left to process_attachment.
+    """
+    voice_notes = [m for m in messages if m.attachment and m.attachment.type == "audio"]
+    if len(voice_notes) < 2:
+        return {}
+
+    futures = {m.message_id: Future() for m in voice_notes}
+    staged = []
+    checking = [len(voice_notes)]
+    lock = threading.Lock()
+
+    def transcribe_staged(notes):
+        try:
+            if len(notes) == 1:
+                results = {notes[0].attachment.location: transcribe_audio(notes[0].attachment.location)}
+            else:
+                results = transcribe_audio_batch([m.attachment.location for m in notes])
+            for message in notes:
+                futures[message.message_id].set_result(results.get(message.attachment.location))
+        finally:
+            for message in notes:
+                if not futures[message.message_id].done():
+                    futures[message.message_id].set_result(None)
+
+    def run(message):
+        future = futures[message.message_id]
+        is_staged = False
+        try:
+            try:
+                is_staged = message.attachment.resolve_staged()
+            except Exception as e:
+                logger.error(f"Media store lookup failed for voice note {message.message_id}: {e}")
+            with lock:
+                if is_staged:
+                    staged.append(message)
+                checking[0] -= 1
+                ready = list(staged) if checking[0] == 0 and staged else None
+            if ready:
+                transcription_pool.submit(transcribe_staged, ready)
+            if not is_staged:
+                future.set_result(transcribe_audio(message.attachment.location))
+        except Exception as e:
+            logger.error(f"Failed to transcribe voice note {message.message_id}: {e}")
+        finally:
+            # never leave a message waiting on a transcription that won't come
+            if not is_staged and not future.done():
+                future.set_result(None)
+
+    for message in voice_notes:
+        transcription_pool.submit(run, message)
+    return futures
+
+
+def process_attachment(chat:ChatService, connections, acks:AckDispatcher, message, transcriptions=None):
     contact = connections.get_contact(message.phone_number)
 
     attach = message.attachment
-    logger.info(f"Processing attachment: location={attach.get('location')}, mime_type={attach.get('mime_type')}, mimeType={attach.get('mimeType')}, filename={attach.get('filename')}")
+    # first consumer of the attachment: this downloads it
+    try:
+        location = attach.location
+    except Exception as e:
+        logger.error(f"Failed to download attachment: {e}")
+        location = None
+
+    logger.info(f"Processing attachment: location={location}, mime_type={attach.get('mime_type')}, mimeType={attach.get('mimeType')}, filename={attach.get('filename')}")
     file_type = attach.get("mime_type")
-    file_content = attach.get("content")
     file_name = attach.get("filename")
     audio = message.message.get("audio")
+    converted_location = None
+    converted_content = None
+    transcription_future = None
+
+    if audio and location:
+        # transcription only needs the original OGG, so it runs alongside conversion + upload
+        logger.info("Transcribing audio")
+        transcription_future = (transcriptions or {}).get(message.message_id) or transcription_pool.submit(transcribe_audio, location)
 
-    if audio:
         file_name = "voice.ogg"
-        converted_location = convert_to_wav(attach.get("location"))
-        if converted_location:
-            print(f"converted location: {converted_location}")
-            file_content = message.get_s3_file_content(converted_location)
+        if AUDIO_CONVERSION_MODE == "local":
+            # in process, on the bytes of the note: no lambda hop, no WAV round trip through S3
+            try:
+                converted_content = convert_bytes_to_wav(attach.content)
+            except Exception as e:
+                logger.error(f"Local conversion failed: {e}")
+        else:
+            # same audio seen before (retry, forwarded note): reuse its WAV
+            converted_location = media_store.find_derived(attach.content_key, "wav")
+            if not converted_location:
+                converted_location = convert_to_wav(location)
+                if converted_location:
+                    media_store.save_derived(attach.content_key, "wav", converted_location)
+            if converted_location:
+                print(f"converted location: {converted_location}")
+        if converted_location or converted_content:
             file_name = "voice.wav"
             file_type = "audio/wav"
 
 
 
     if not file_name:
-        file_name = f"file.{get_extension_by_file_type(attach.get('mimeType'))}"
+        # mimeType only comes with the download, the webhook's mime_type is there even when it failed
+        file_name = f"file.{get_extension_by_file_type(attach.get('mimeType') or attach.get('mime_type'))}"
+
+    file_content = None
+    if location:
+        try:
+            if converted_content:
+                file_content = converted_content
+            elif converted_location:
+                file_content = message.get_attachment_content(converted_location)
+            else:
+                file_content = attach.open()
+        except Exception as e:
+            logger.error(f"Failed to open attachment content: {e}")
 
-    if attach.get("content"):
+    if file_content:
         contact = connections.get_contact(message.phone_number)
 
         if contact and contact.get("connectionToken"):
@@ -60,36 +174,36 @@ def process_attachment(chat:ChatService, connections, message):
 
             if attachment_id:
                 logger.info(f"Successfully uploaded attachment: {attachment_id}")
-                message.reaction("📎")
+                acks.react(message, "📎")
             else:
                 logger.error(f"Failed to upload attachment: {error_str}")
-                message.reaction("❌")
+                acks.react(message, "❌")
                 # Refresh contact in case connection was renewed
                 contact = connections.get_contact(message.phone_number)
                 if contact and contact.get("connectionToken"):
                     chat.send_message(f"[{error_str}]", contact["connectionToken"])
+        if hasattr(file_content, "close"):
+            file_content.close()
     else:
         logger.error("Failed to retrieve attachment content")
-        message.reaction("❌")
-        chat.send_message(
-            "Failed to retrieve attachment content", contact["connectionToken"]
-        )
-
-    if audio and message.attachment.get("location"):  # it's been downloaded
-        logger.info("Transcribing audio")
-
+        acks.react(message, "❌")
+        if contact and contact.get("connectionToken"):
+            chat.send_message(
+                "Failed to retrieve attachment content", contact["connectionToken"]
+            )
 
-        # transcribe using Amazon Transcribe
-        transcription = transcribe_audio( message.attachment.get("location"))
+    if transcription_future:
+        # join before the transcript is echoed back and forwarded
+        transcription = transcription_future.result()
         print ("transcription OK", transcription)
         message.add_transcription(transcription)
 
 
-def process_message(chat: ChatService, connections:ConnectionsService, message:WhatsappMessage):
-    message.mark_as_read()
-    message.reaction("👀")
-    if message.attachment and message.attachment.get("location"):
-        process_attachment(chat, connections, message)
+def process_message(chat: ChatService, connections:ConnectionsService, acks:AckDispatcher, message:WhatsappMessage, transcriptions=None):
+    acks.mark_as_read(message)
+    acks.react(message, "👀")
+    if message.attachment:
+        process_attachment(chat, connections, acks, message, transcriptions)
 
     # An existing conversation with Amazon Connect Chat
     contact = connections.get_contact(message.phone_number)
@@ -110,10 +224,9 @@ def process_message(chat: ChatService, connections:ConnectionsService, message:W
         if text:
             newContactId, newParticipantToken, newConnectionToken = (
                 chat.send_message_with_retry_connection(
-                    text, message, contact["connectionToken"]
+                    text, message, contact["connectionToken"], connections
                 )
             )
-            if newContactId: connections.remove_contactId(contact["contactId"])
 
     else:
         logger.info("Creating new contact")
@@ -136,18 +249,44 @@ def process_message(chat: ChatService, connections:ConnectionsService, message:W
             message.phone_number_id,
         )
 
-    message.reaction("✅")
+    acks.react(message, "✅")
+
+
+def release_direct_slot(in_flight):
+    """
+    Clear the sender's direct slot taken by on_raw_messages for this event, once its messages are delivered.
+
+    The update lands in the raw messages stream: the aggregator then releases the sender's
+    buffered messages it held behind the direct ones. The condition leaves a slot already
+    taken by a later message alone.
+    """
+    if not in_flight or not RAW_MESSAGES_TABLE:
+        return
+    try:
+        get_client("dynamodb").update_item(
+            TableName=RAW_MESSAGES_TABLE,
+            Key={"from": {"S": in_flight["from"]}, "id": {"S": IN_FLIGHT_ID}},
+            UpdateExpression="REMOVE directUntil, directToken",
+            ConditionExpression="directToken = :token",
+            ExpressionAttributeValues={":token": {"S": in_flight["token"]}},
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+            logger.error(f"Could not clear the direct slot of {in_flight['from']}: {e}")
 
 
-def process_record(chat, connections, event, ignore_stickers=True, ignore_reactions=True):
+def process_record(chat, connections, acks, event, ignore_stickers=True, ignore_reactions=True):
     whatsapp = WhatsappService(event, ignore_reactions, ignore_stickers)
+    transcriptions = start_batch_transcription(whatsapp.messages)
+    # an invocation carries one sender's messages (the aggregator and the direct route group by sender),
+    # customers run in parallel as separate invocations: process them in order
     for message in whatsapp.messages:
-        process_message(chat, connections, message)
+        process_message(chat, connections, acks, message, transcriptions)
 
 
 def lambda_handler(event, context):
     print(event)
-    connections = ConnectionsService(os.environ.get("TABLE_NAME"))
+    connections = ConnectionsService(os.environ.get("TABLE_NAME"), cache=warm_session_cache)
     config = get_ssm_parameter(os.environ["CONFIG_PARAM_NAME"])
 
     INSTANCE_ID = config.get("instance_id")
@@ -158,11 +297,20 @@ def lambda_handler(event, context):
 
     if not INSTANCE_ID or not CONTACT_FLOW_ID:
         logger.error("INSTANCE_ID and CONTACT_FLOW_ID must be set in environment variables")
+        release_direct_slot(event.get("inFlight"))
         return {"statusCode": 200, "body": "Missing required configuration"}
 
 
     chat = ChatService( instance_id=INSTANCE_ID, contact_flow_id=CONTACT_FLOW_ID, chat_duration_minutes=CHAT_DURATION_MINUTES, topic_arn=os.environ.get("TOPIC_ARN"))
 
-    process_record(chat, connections, event,ignore_stickers=IGNORE_STICKERS, ignore_reactions=IGNORE_REACTIONS)
+    # read receipts and reactions go out in the background, flushed before returning
+    acks = AckDispatcher()
+    try:
+        process_record(chat, connections, acks, event, ignore_stickers=IGNORE_STICKERS, ignore_reactions=IGNORE_REACTIONS)
+    finally:
+        acks.flush()
+        release_direct_slot(event.get("inFlight"))
+        logger.info(f"Session cache: {connections.cache.stats(reset=True)}")
+        media_store.emit_metrics()
 
     
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_clients import get_client
+
+logger = logging.getLogger()
+
+BUCKET_NAME = os.environ.get("BUCKET_NAME")
+MEDIA_INDEX_PREFIX = os.environ.get("MEDIA_INDEX_PREFIX", "media/")
+# media and index objects expire after this many days (bucket lifecycle rule, 0 = never)
+MEDIA_RETENTION_DAYS = int(os.environ.get("MEDIA_RETENTION_DAYS", 30))
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "WhatsappConnectChat")
+
+
+def content_key_from_sha256(sha256):
+    """Index key for the sha256 WhatsApp sends with the media (base64, made key safe)."""
+    if not sha256:
+        return None
+    return "sha256-" + sha256.replace("+", "-").replace("/", "_").rstrip("=")
+
+
+def content_key_from_etag(etag):
+    """Index key for an S3 ETag, the fallback when the webhook has no sha256."""
+    if not etag:
+        return None
+    return "etag-" + etag.strip('"')
+
+
+class MediaStore:
+    """
+    Content-addressed index over the media saved in S3.
+
+    Small JSON pointer objects under MEDIA_INDEX_PREFIX map a WhatsApp media id
+    and a content key to the S3 location of the media, and the content key to
+    the artifacts already derived from it (e.g. the WAV of a voice note). A
+    retried invocation finds its media by id, a forwarded file (new media id,
+    same content) by content key, and neither downloads nor converts again.
+
+    Records older than the retention period (less a day of margin) are ignored,
+    so a pointer never outlives the object it points to. Index failures are
+    logged and treated as misses: the store only saves work, it never blocks it.
+    """
+
+    def __init__(self, bucket_name=BUCKET_NAME, prefix=MEDIA_INDEX_PREFIX, retention_days=MEDIA_RETENTION_DAYS) -> None:
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.max_age_seconds = max(retention_days - 1, 0) * 86400 if retention_days else None
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    @property
+    def s3(self):
+        return get_client("s3")
+
+    def find_media(self, media_id, content_key=None):
+        """Saved record (location, mimeType...) of a media, by id then by content, or None."""
+        record = self._get(f"by-id/{media_id}")
+        self._count("MediaId", record)
+        if record or not content_key:
+            return record
+
+        record = self._get(f"by-content/{content_key}")
+        self._count("Content", record)
+        if record:
+            # next retry of this media id stops at the first lookup
+            self._put(f"by-id/{media_id}", dict(record, content_key=content_key))
+        return record
+
+    def save_media(self, media_id, content_key, record):
+        record = dict(record, content_key=content_key, created=int(time.time()))
+        self._put(f"by-id/{media_id}", record)
+        if content_key:
+            # an existing content record keeps its derived artifacts (e.g. the WAV of a voice note)
+            self._put(f"by-content/{content_key}", record, only_new=True)
+        return record
+
+    def content_key_for(self, bucket, key):
+        """Content key from the ETag of a saved object."""
+        try:
+            return content_key_from_etag(self.s3.head_object(Bucket=bucket, Key=key).get("ETag"))
+        except Exception as e:
+            logger.warning(f"Media store: no content key for s3://{bucket}/{key}: {e}")
+            return None
+
+    def find_derived(self, content_key, kind):
+        """Location of an artifact of the given kind (e.g. "wav") derived from the content, or None."""
+        if not content_key:
+            return None
+        record = self._get(f"by-content/{content_key}")
+        location = (record or {}).get("derived", {}).get(kind)
+        self._count("Derived", location)
+        return location
+
+    def save_derived(self, content_key, kind, location):
+        if not content_key:
+            return
+        record = self._get(f"by-content/{content_key}") or {"created": int(time.time())}
+        record.setdefault("derived", {})[kind] = location
+        self._put(f"by-content/{content_key}", record)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def emit_metrics(self):
+        """Log hit/miss counts since the last call in CloudWatch Embedded Metric Format, then reset them."""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return
+
+        metrics = dict(counts)
+        for lookup in ("MediaId", "Content", "Derived"):
+            hits, misses = counts.get(f"{lookup}Hits", 0), counts.get(f"{lookup}Misses", 0)
+            if hits + misses:
+                metrics[f"{lookup}HitRate"] = round(100 * hits / (hits + misses), 2)
+
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Cache"]],
+                    "Metrics": [
+                        {"Name": name, "Unit": "Percent" if name.endswith("HitRate") else "Count"}
+                        for name in metrics
+                    ],
+                }],
+            },
+            "Cache": "MediaStore",
+            **metrics,
+        }))
+
+    def _count(self, lookup, hit):
+        name = f"{lookup}{'Hits' if hit else 'Misses'}"
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def _get(self, name):
+        if not self.bucket_name:
+            return None
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}{name}.json")
+            record = json.loads(response["Body"].read())
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            logger.warning(f"Media store: failed to read {name}: {e}")
+            return None
+
+        if self.max_age_seconds and time.time() - record.get("created", 0) > self.max_age_seconds:
+            return None
+        return record
+
+    def _put(self, name, record, only_new=False):
+        """Write a record; with only_new, a record already there (or being written) is kept."""
+        if not self.bucket_name:
+            return
+        kwargs = {"IfNoneMatch": "*"} if only_new else {}
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket_name,
+                Key=f"{self.prefix}{name}.json",
+                Body=json.dumps(record).encode("utf-8"),
+                ContentType="application/json",
+                **kwargs,
+            )
+        except ClientError as e:
+            if only_new and e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return
+            logger.warning(f"Media store: failed to write {name}: {e}")
+        except Exception as e:
+            logger.warning(f"Media store: failed to write {name}: {e}")
+
+
+# shared by every message of the invocation (and warm invocations)
+media_store = MediaStore()
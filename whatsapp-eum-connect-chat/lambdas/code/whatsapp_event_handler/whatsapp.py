@@ -1,14 +1,143 @@
-import boto3
 import json
 import os
-import boto3.dynamodb
-import boto3.dynamodb.table
+import threading
+
+from aws_clients import get_client
+from media_store import media_store, content_key_from_sha256
+from send_rate_limit import send_whatsapp_message
 
 
 BUCKET_NAME = os.environ.get("BUCKET_NAME")
 VOICE_PREFIX = os.environ.get("VOICE_PREFIX", "voice_")
 ATTACHMENT_PREFIX = os.environ.get("ATTACHMENT_PREFIX", "attachment_")
 META_API_VERSION = os.environ.get("META_API_VERSION","v24.0" )
+# "stream" pipes S3 bodies to their consumer, "buffer" reads them fully into memory
+ATTACHMENT_TRANSFER_MODE = os.environ.get("ATTACHMENT_TRANSFER_MODE", "stream")
+
+
+def parse_s3_location(s3_location):
+    """Split 's3://bucket-name/key' into (bucket, key), raising ValueError if malformed."""
+    if not s3_location or not s3_location.startswith("s3://"):
+        raise ValueError("Invalid S3 location format. Expected 's3://bucket-name/key'")
+
+    path_parts = s3_location[5:].split("/", 1)
+    if len(path_parts) != 2:
+        raise ValueError("Invalid S3 location format. Expected 's3://bucket-name/key'")
+    return path_parts[0], path_parts[1]
+
+
+class S3Stream:
+    """
+    Readable S3 object body that knows its size.
+
+    The size comes from the object metadata, so an HTTP upload can send a
+    Content-Length and read the body in blocks instead of loading it in memory.
+    """
+
+    def __init__(self, body, size) -> None:
+        self.body = body
+        self.size = size
+
+    def read(self, amt=-1):
+        return self.body.read(amt if amt is not None and amt >= 0 else None)
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        self.body.close()
+
+
+class MediaAttachment:
+    """
+    Lazy handle on the media of an inbound message.
+
+    Building it costs no I/O: it only holds the webhook fields of the media
+    (id, mime_type, caption, filename...). The media is downloaded into S3 the
+    first time a consumer asks for its location or content, and concurrent
+    consumers share that single download.
+    """
+
+    def __init__(self, message, attachment_type, fields) -> None:
+        self.message = message
+        self.type = attachment_type
+        # same dict as message.message[attachment_type], so downloads show up there too
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._resolved = False
+        self._content = None
+
+    def get(self, key, default=None):
+        """Field of the attachment. Never triggers a download."""
+        return self.fields.get(key, default)
+
+    @property
+    def resolved(self):
+        return self._resolved
+
+    @property
+    def location(self):
+        """S3 URI of the media, downloading it on first use."""
+        self.resolve()
+        return self.fields.get("location")
+
+    @property
+    def content(self):
+        """Media bytes, read from S3 once and kept."""
+        location = self.location
+        with self._lock:
+            if self._content is None:
+                self._content = self.message.get_s3_file_content(location)
+            return self._content
+
+    def open(self):
+        """Media body for an upload (see WhatsappMessage.get_attachment_content)."""
+        if self._content is not None:
+            return self._content
+        return self.message.get_attachment_content(self.location)
+
+    @property
+    def content_key(self):
+        """Content key of the media in the media store, once resolved."""
+        return self.fields.get("content_key")
+
+    def resolve_staged(self):
+        """Resolve the media from the media store only, never downloading it. True if it is already in S3."""
+        if self._resolved:
+            return True
+        with self._lock:
+            if not self._resolved:
+                # WhatsApp sends the hash of the file, so forwarded media is recognised before downloading
+                content_key = content_key_from_sha256(self.fields.get("sha256"))
+                media_content = media_store.find_media(self.fields.get("id"), content_key)
+                if not media_content:
+                    return False
+                print("Attachment already saved:", media_content.get("location"))
+                self.fields.update(media_content)
+                self._resolved = True
+        return True
+
+    def resolve(self):
+        if self.resolve_staged():
+            return self
+        with self._lock:
+            if not self._resolved:
+                media_id = self.fields.get("id")
+                content_key = content_key_from_sha256(self.fields.get("sha256"))
+                media_content = self.message.download_media(
+                    media_id=media_id,
+                    phone_id=self.message.phone_number_id,
+                    bucket_name=BUCKET_NAME,
+                    media_prefix=ATTACHMENT_PREFIX,
+                )
+                media_content.pop("ResponseMetadata", None)
+                if not content_key:
+                    content_key = media_store.content_key_for(*parse_s3_location(media_content["location"]))
+                media_content = media_store.save_media(media_id, content_key, media_content)
+                self.fields.update(media_content)
+                print("Attachment Saved:", self.fields)
+                self._resolved = True
+        return self
 
 
 class WhatsappMessage:
@@ -19,7 +148,7 @@ class WhatsappMessage:
         metadata={},
         client=None,
         meta_api_version=META_API_VERSION,
-        download_attachments = True
+        download_attachments = False
     ) -> None:
         # arn:aws:social-messaging:region:account:phone-number-id/976c72a700aac43eaf573ae050example
         self.meta_phone_number = meta_phone_number
@@ -31,11 +160,10 @@ class WhatsappMessage:
         self.phone_number = message.get("from", "")
         self.meta_api_version = meta_api_version
         self.message_id = message.get("id", "")
-        self.client = client if client else boto3.client("socialmessaging")
-        self.s3_client = boto3.client("s3")
-        self.attachment = None
+        self.client = client if client else get_client("socialmessaging")
+        self.s3_client = get_client("s3")
         self.transcription = None
-        self.get_attachment(download=download_attachments)
+        self.attachment = self.get_attachment(download=download_attachments)
         
 
     def add_transcription(self, transcription):
@@ -77,9 +205,9 @@ class WhatsappMessage:
         self.message.update({"audio": audio})
         return audio
 
-    def get_attachment(self, download=True):
+    def get_attachment(self, download=False):
+        """MediaAttachment for the message's media, or None. Only downloads when download=True."""
         # Check for audio, image, document, video, or other attachment types
-        print("getting attachement for message:", self.message)
         attachment = None
         if self.message.get("audio"):
             attachment = self.message.get("audio")
@@ -98,37 +226,14 @@ class WhatsappMessage:
             attachment_type = "sticker"
 
         if not attachment:
-            return {}
+            return None
 
         print("Attachment Found:", attachment)
 
-        if not download:
-            return attachment
-
-        media_id = attachment.get("id")
-
-        media_content = self.download_media(
-            media_id=media_id,
-            phone_id=self.phone_number_id,
-            bucket_name=BUCKET_NAME,
-            media_prefix=ATTACHMENT_PREFIX,
-        )
-
-        # Update attachment with media content
-        if "ResponseMetadata" in media_content:
-            del media_content["ResponseMetadata"]
-
-        attachment.update(media_content)
-        print("Attachment Saved:", attachment)
-
-        binary = self.get_s3_file_content(media_content.get("location"))
-        attachment.update({"content": binary})
-
-        print("binary OK")
-
-        # Update message with attachment
-        self.message.update({attachment_type: attachment})
-        self.attachment = attachment
+        handle = MediaAttachment(self, attachment_type, attachment)
+        if download:
+            handle.resolve()
+        return handle
 
     # https://docs.aws.amazon.com/social-messaging/latest/userguide/receive-message-image.html
     def download_media(self, media_id, phone_id, bucket_name, media_prefix):
@@ -157,7 +262,7 @@ class WhatsappMessage:
             message=bytes(json.dumps(message_object), "utf-8"),
         )
         print (kwargs)
-        response = self.client.send_whatsapp_message(**kwargs)
+        response = send_whatsapp_message(self.client, **kwargs)
         print("mark as read:", response)
 
     def reaction(self, emoji):
@@ -175,7 +280,7 @@ class WhatsappMessage:
             message=bytes(json.dumps(message_object), "utf-8"),
         )
         # print(kwargs)
-        response = self.client.send_whatsapp_message(**kwargs)
+        response = send_whatsapp_message(self.client, **kwargs)
         print("react to message:", response)
 
     def text_reply(self, text_message):
@@ -195,7 +300,7 @@ class WhatsappMessage:
             message=bytes(json.dumps(message_object), "utf-8"),
         )
         # print(kwargs)
-        response = self.client.send_whatsapp_message(**kwargs)
+        response = send_whatsapp_message(self.client, **kwargs)
         print("replied to message:", response)
         # message_object["id"] = response.get("messageId")
         # message_object["from"] = self.phone_number
@@ -221,21 +326,7 @@ class WhatsappMessage:
             Exception: If there's an error downloading the file
         """
         try:
-            # Parse the S3 URI
-            if not s3_location.startswith("s3://"):
-                raise ValueError(
-                    "Invalid S3 location format. Expected 's3://bucket-name/key'"
-                )
-
-            # Remove 's3://' prefix and split into bucket and key
-            path_parts = s3_location[5:].split("/", 1)
-            if len(path_parts) != 2:
-                raise ValueError(
-                    "Invalid S3 location format. Expected 's3://bucket-name/key'"
-                )
-
-            bucket_name = path_parts[0]
-            object_key = path_parts[1]
+            bucket_name, object_key = parse_s3_location(s3_location)
 
             # Get the object from S3
             response = self.s3_client.get_object(Bucket=bucket_name, Key=object_key)
@@ -248,6 +339,26 @@ class WhatsappMessage:
             print(f"Error downloading file from S3: {str(e)}")
             raise
 
+    def open_s3_stream(self, s3_location):
+        """
+        Open an S3 object for streaming, without reading its body
+
+        Args:
+            s3_location (str): S3 URI in the format 's3://bucket-name/key'
+
+        Returns:
+            S3Stream: The object body, sized from the object metadata
+        """
+        bucket_name, object_key = parse_s3_location(s3_location)
+        response = self.s3_client.get_object(Bucket=bucket_name, Key=object_key)
+        return S3Stream(response["Body"], response["ContentLength"])
+
+    def get_attachment_content(self, s3_location):
+        """Attachment body as an S3Stream in stream mode, or as bytes in buffer mode."""
+        if ATTACHMENT_TRANSFER_MODE == "stream":
+            return self.open_s3_stream(s3_location)
+        return self.get_s3_file_content(s3_location)
+
 
 class WhatsappService:
     def __init__(self, event, ignore_reactions= True, ignore_stickers = True) -> None:
@@ -292,4 +403,3 @@ class WhatsappService:
             if contact.get("wa_id") == from_number:
                 return contact.get("profile", {}).get("name", "NN")
         return ""
-
@@ -1,6 +1,8 @@
 from aws_cdk import ( Duration, aws_lambda)
 from constructs import Construct
 
+import config
+
 
 LAMBDA_TIMEOUT = 900
 
@@ -12,6 +14,10 @@ BASE_LAMBDA_CONFIG = dict(
     tracing=aws_lambda.Tracing.ACTIVE,
 )
 
+# the ffmpeg layer ships x86_64 binaries
+X86_64_LAMBDA_CONFIG = dict(**BASE_LAMBDA_CONFIG)
+X86_64_LAMBDA_CONFIG.update(architecture=aws_lambda.Architecture.X86_64)
+
 from layers import TranscribeClient, RequestsLayer, FFMpeg
 
 class Lambdas(Construct):
@@ -49,13 +55,21 @@ class Lambdas(Construct):
         # ======================================================================
         # Inbound Messages (Buffered)
         # ======================================================================
+        if config.AUDIO_CONVERSION_MODE == "local":
+            # voice notes are converted in process, needs ffmpeg
+            handler_layers = [RequestsLib.layer, FFMLayer.layer]
+            handler_config = X86_64_LAMBDA_CONFIG
+        else:
+            handler_layers = [RequestsLib.layer]
+            handler_config = BASE_LAMBDA_CONFIG
+
         self.whatsapp_event_handler = aws_lambda.Function(
             self,
             "WhatsappIn",
             code=aws_lambda.Code.from_asset("./lambdas/code/whatsapp_event_handler/"),
             handler="lambda_function.lambda_handler",
-            layers=[RequestsLib.layer],
-            **BASE_LAMBDA_CONFIG, # type: ignore
+            layers=handler_layers,
+            **handler_config, # type: ignore
         )
 
         # ======================================================================
@@ -85,9 +99,6 @@ class Lambdas(Construct):
         # ======================================================================
         # Convert ogg to wav (to attach file in connect)
         # ======================================================================
-        X86_64_LAMBDA_CONFIG = dict(**BASE_LAMBDA_CONFIG)
-        X86_64_LAMBDA_CONFIG.update(architecture=aws_lambda.Architecture.X86_64)
-
         self.convert_to_wav = aws_lambda.Function(
             self,
             "convertWav",
@@ -0,0 +1,28 @@
+import importlib
+import os
+import sys
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+CODE_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code")
+
+
+def load(lambda_name, module="lambda_function"):
+    """
+    Import a module of one Lambda.
+
+    The Lambda directories are self-contained and share module names (lambda_function,
+    connections_service, whatsapp...), so the Lambda's own modules are imported without
+    what other tests left in sys.modules, and those are put back afterwards.
+    """
+    code_dir = os.path.abspath(os.path.join(CODE_DIR, lambda_name))
+    own = {name[:-3] for name in os.listdir(code_dir) if name.endswith(".py")}
+    others = {name: sys.modules.pop(name) for name in own if name in sys.modules}
+    sys.path.insert(0, code_dir)
+    try:
+        return importlib.import_module(module)
+    finally:
+        sys.path.remove(code_dir)
+        for name in own:
+            sys.modules.pop(name, None)
+        sys.modules.update(others)
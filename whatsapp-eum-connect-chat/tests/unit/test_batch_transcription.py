@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from tests.unit.lambda_modules import load
+
+whatsapp_event_handler = load("whatsapp_event_handler")
+
+
+class FakeAttachment:
+    type = "audio"
+
+    def __init__(self, name, staged, downloaded=None):
+        self.name = name
+        self.staged = staged
+        self.downloaded = downloaded
+
+    def resolve_staged(self):
+        return self.staged
+
+    @property
+    def location(self):
+        if not self.staged and self.downloaded:
+            self.downloaded.wait(5)
+        return f"s3://bucket/{self.name}.ogg"
+
+
+class FakeMessage:
+    def __init__(self, name, staged, downloaded=None):
+        self.message_id = name
+        self.attachment = FakeAttachment(name, staged, downloaded)
+
+
+@pytest.fixture
+def transcriber(monkeypatch):
+    calls = []
+    monkeypatch.setattr(whatsapp_event_handler, "transcribe_audio", lambda location: calls.append([location]) or f"text of {location}")
+    monkeypatch.setattr(whatsapp_event_handler, "transcribe_audio_batch",
+                        lambda locations: calls.append(list(locations)) or {l: f"text of {l}" for l in locations})
+    return calls
+
+
+def test_staged_notes_share_one_invocation(transcriber):
+    notes = [FakeMessage("a", True), FakeMessage("b", True)]
+
+    futures = whatsapp_event_handler.start_batch_transcription(notes)
+
+    assert futures["a"].result(5) == "text of s3://bucket/a.ogg"
+    assert futures["b"].result(5) == "text of s3://bucket/b.ogg"
+    assert transcriber == [["s3://bucket/a.ogg", "s3://bucket/b.ogg"]]
+
+
+def test_note_does_not_wait_for_another_download(transcriber):
+    downloaded = threading.Event()
+    notes = [FakeMessage("first", False), FakeMessage("slow", False, downloaded)]
+
+    futures = whatsapp_event_handler.start_batch_transcription(notes)
+
+    assert futures["first"].result(2) == "text of s3://bucket/first.ogg"
+    assert not futures["slow"].done()
+    downloaded.set()
+    assert futures["slow"].result(5) == "text of s3://bucket/slow.ogg"
+
+
+def test_failed_download_resolves_to_none(transcriber):
+    class Failing(FakeAttachment):
+        @property
+        def location(self):
+            raise RuntimeError("media unavailable")
+
+    broken = FakeMessage("broken", False)
+    broken.attachment = Failing("broken", False)
+
+    futures = whatsapp_event_handler.start_batch_transcription([FakeMessage("ok", False), broken])
+
+    assert futures["ok"].result(5) == "text of s3://bucket/ok.ogg"
+    assert futures["broken"].result(5) is None
+
+
+def test_single_voice_note_is_left_to_process_attachment(transcriber):
+    assert whatsapp_event_handler.start_batch_transcription([FakeMessage("a", True)]) == {}
@@ -0,0 +1,93 @@
+import os
+import sys
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code", "whatsapp_event_handler"))
+
+from connect_chat_service import ChatService  # noqa: E402
+from connections_service import ConnectionsService, SessionCache  # noqa: E402
+
+
+class FakeTable:
+    def __init__(self, items):
+        self.items = items
+        self.queries = 0
+
+    def query(self, **kwargs):
+        self.queries += 1
+        return {"Items": list(self.items.values())}
+
+    def delete_item(self, Key):
+        self.items.pop(Key["contactId"], None)
+
+
+class FakeMessage:
+    phone_number = "14155550100"
+    phone_number_id = "phone-number-id-abc"
+    message = {"customer_name": "Ana"}
+
+    def get_text(self):
+        return "hello"
+
+
+class FakeChat(ChatService):
+    """Only 'renewed' is a live connection token."""
+
+    def __init__(self):
+        self.sent = []
+        self.attached = []
+        self.started = 0
+
+    def send_message(self, message, connectionToken):
+        self.sent.append(connectionToken)
+        return None if connectionToken == "renewed" else "ACCESS_DENIED"
+
+    def attach_file(self, fileContents, fileName, fileType, ConnectionToken):
+        self.attached.append(ConnectionToken)
+        return ("attachment-id", None) if ConnectionToken == "renewed" else (None, "ACCESS_DENIED")
+
+    def start_chat_and_stream(self, *args, **kwargs):
+        self.started += 1
+        return "c-new", "participant", "new"
+
+
+def make_connections(token):
+    """A warm cache holding a stale token, while the table has the given one."""
+    cache = SessionCache(ttl_seconds=60)
+    cache.put(FakeMessage.phone_number, {"contactId": "c-old", "connectionToken": "stale"})
+    connections = ConnectionsService.__new__(ConnectionsService)
+    connections.cache = cache
+    connections.table = FakeTable({"c-2": {"contactId": "c-2", "customerId": FakeMessage.phone_number, "connectionToken": token}})
+    return connections
+
+
+def test_send_uses_chat_renewed_by_another_container():
+    chat, connections = FakeChat(), make_connections("renewed")
+
+    result = chat.send_message_with_retry_connection("hello", FakeMessage(), "stale", connections)
+
+    assert result == (None, None, None)
+    assert chat.sent == ["stale", "renewed"]
+    assert chat.started == 0
+    assert connections.get_contact(FakeMessage.phone_number)["connectionToken"] == "renewed"
+
+
+def test_send_starts_chat_when_table_token_is_expired_too():
+    chat, connections = FakeChat(), make_connections("expired")
+
+    result = chat.send_message_with_retry_connection("hello", FakeMessage(), "stale", connections)
+
+    assert result == ("c-new", "participant", "new")
+    assert chat.sent == ["stale", "expired"]
+    assert chat.started == 1
+    assert connections.table.items == {}
+
+
+def test_attach_uses_chat_renewed_by_another_container():
+    chat, connections = FakeChat(), make_connections("renewed")
+
+    result = chat.attach_file_with_retry_connection(FakeMessage(), connections, b"data", "a.png", "image/png", "stale")
+
+    assert result == ("attachment-id", None)
+    assert chat.attached == ["stale", "renewed"]
+    assert chat.started == 0
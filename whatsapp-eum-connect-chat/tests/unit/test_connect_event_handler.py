@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+from tests.unit.lambda_modules import load
+
+os.environ.setdefault("TABLE_NAME", "connections")
+connect_event_handler = load("connect_event_handler")
+
+
+class FakeSQS:
+    def __init__(self, failed=()):
+        self.failed = list(failed)
+        self.sent = []
+        self.visibility = {}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.sent.extend(Entries)
+        return {"Failed": self.failed}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self.visibility[ReceiptHandle] = VisibilityTimeout
+
+
+@pytest.fixture
+def sqs(monkeypatch):
+    fake = FakeSQS()
+    monkeypatch.setattr(connect_event_handler, "sqs", fake)
+    monkeypatch.setattr(connect_event_handler, "CONTACT_QUEUE_URL", "https://sqs/queue.fifo")
+    return fake
+
+
+def sns_record(message_id, **message):
+    return {"EventSource": "aws:sns", "Sns": {"MessageId": message_id, "Message": json.dumps(message), "MessageAttributes": {}}}
+
+
+def queued_record(message_id, **message):
+    body = json.dumps({"Message": json.dumps(message), "MessageAttributes": {}})
+    return {"eventSource": "aws:sqs", "messageId": message_id, "receiptHandle": f"rh-{message_id}", "body": body}
+
+
+def test_sns_records_are_queued_per_contact(sqs):
+    event = {"Records": [
+        sns_record("sns-1", ContactId="c-1", Type="MESSAGE"),
+        sns_record("sns-2", InitialContactId="c-2", Type="EVENT"),
+    ]}
+
+    assert connect_event_handler.lambda_handler(event, None) is None
+
+    assert [(e["MessageGroupId"], e["MessageDeduplicationId"]) for e in sqs.sent] == [("c-1", "sns-1"), ("c-2", "sns-2")]
+
+
+def test_records_not_queued_fail_the_invocation(sqs):
+    sqs.failed = [{"Id": "0", "Code": "InternalError"}]
+
+    with pytest.raises(RuntimeError):
+        connect_event_handler.lambda_handler({"Records": [sns_record("sns-1", ContactId="c-1")]}, None)
+
+
+def test_failed_record_returns_the_rest_of_the_batch(sqs, monkeypatch):
+    processed = []
+
+    def process_record(parsed):
+        _, message = parsed
+        if message["Id"] == "m-2":
+            raise RuntimeError("send failed")
+        processed.append(message["Id"])
+
+    monkeypatch.setattr(connect_event_handler, "process_record", process_record)
+    event = {"Records": [queued_record(f"q-{i}", Id=f"m-{i}", ContactId="c-1") for i in (1, 2, 3)]}
+
+    result = connect_event_handler.lambda_handler(event, None)
+
+    assert processed == ["m-1"]
+    assert result == {"batchItemFailures": [{"itemIdentifier": "q-2"}, {"itemIdentifier": "q-3"}]}
+    assert sqs.visibility == {"rh-q-2": connect_event_handler.QUEUE_RETRY_DELAY_SECONDS,
+                              "rh-q-3": connect_event_handler.QUEUE_RETRY_DELAY_SECONDS}
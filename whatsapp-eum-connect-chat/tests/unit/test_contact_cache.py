@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+from tests.unit.lambda_modules import load
+
+os.environ.setdefault("TABLE_NAME", "connections")
+connections_service = load("connect_event_handler", "connections_service")
+ContactCache, MISS = connections_service.ContactCache, connections_service.MISS
+
+CONNECTION = {"contactId": "c-1", "connectionToken": "token"}
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    time = monotonic
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(connections_service, "time", clock)
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ContactCache(ttl_seconds=30, negative_ttl_seconds=2, max_entries=10)
+    cache.put("c-1", CONNECTION)
+
+    clock.now += 29
+    assert cache.get("c-1") == CONNECTION
+    clock.now += 1
+    assert cache.get("c-1") is MISS
+
+
+def test_unknown_contact_is_remembered_for_the_negative_ttl(clock):
+    cache = ContactCache(ttl_seconds=30, negative_ttl_seconds=2, max_entries=10)
+    cache.put("c-1", None)
+
+    clock.now += 1.9
+    assert cache.get("c-1") is None
+    clock.now += 0.1
+    assert cache.get("c-1") is MISS
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ContactCache(ttl_seconds=30, negative_ttl_seconds=2, max_entries=2)
+    cache.put("c-1", CONNECTION)
+    cache.put("c-2", CONNECTION)
+    cache.get("c-1")
+
+    cache.put("c-3", CONNECTION)
+
+    assert cache.get("c-2") is MISS
+    assert cache.get("c-1") == CONNECTION
+    assert cache.get("c-3") == CONNECTION
+
+
+def test_disabled_cache_keeps_nothing(clock):
+    for cache in (ContactCache(ttl_seconds=0, negative_ttl_seconds=0, max_entries=10),
+                  ContactCache(ttl_seconds=30, negative_ttl_seconds=2, max_entries=0)):
+        cache.put("c-1", CONNECTION)
+        cache.put("c-2", None)
+        assert cache.get("c-1") is MISS
+        assert cache.get("c-2") is MISS
+
+
+def test_invalidate(clock):
+    cache = ContactCache(ttl_seconds=30, negative_ttl_seconds=2, max_entries=10)
+    cache.put("c-1", CONNECTION)
+
+    cache.invalidate("c-1")
+
+    assert cache.get("c-1") is MISS
+
+
+def test_emit_metrics_logs_counts_since_last_call(clock, capsys):
+    cache = ContactCache(ttl_seconds=30, negative_ttl_seconds=2, max_entries=10)
+    cache.put("c-1", CONNECTION)
+    cache.get("c-1")
+    cache.get("c-1")
+    cache.get("c-2")
+    assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 0.667}
+
+    cache.emit_metrics()
+
+    metrics = json.loads(capsys.readouterr().out)
+    assert (metrics["Hits"], metrics["Misses"], metrics["HitRate"], metrics["Entries"]) == (2, 1, 66.67, 1)
+    assert metrics["_aws"]["Timestamp"] == 1000000
+    assert cache.stats() == {"hits": 0, "misses": 0, "hit_rate": 0.0}
+
+    # nothing looked up since: nothing logged
+    cache.emit_metrics()
+    assert capsys.readouterr().out == ""
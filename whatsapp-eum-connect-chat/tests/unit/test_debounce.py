@@ -0,0 +1,108 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code", "message_aggregator"))
+
+from debounce import release_quiet_senders, next_release_at  # noqa: E402
+
+SENDER = "14155550100"
+
+
+def record(message_id, **fields):
+    return dict({"from": SENDER, "id": message_id, "metadata": {"phone_number_id": "pn-1"}}, **fields)
+
+
+def release(state, records, now, **kwargs):
+    kwargs.setdefault("quiet_gap", 3)
+    kwargs.setdefault("max_wait", 20)
+    return release_quiet_senders(state, records, now, **kwargs)
+
+
+def test_sender_released_after_quiet_gap():
+    first, second = record("wamid.1"), record("wamid.2")
+
+    ready, state = release({}, [(100, first), (102, second)], 104)
+    assert ready == []
+
+    ready, state = release(state, [], 105)
+    assert ready == [first, second]
+    assert state == {"pending": {}}
+
+
+def test_typing_sender_released_after_max_wait():
+    state = {}
+    for second in range(0, 20, 2):
+        ready, state = release(state, [(100 + second, record(f"wamid.{second}"))], 100 + second)
+        assert ready == []
+
+    ready, state = release(state, [], 120)
+
+    assert [r["id"] for r in ready] == [f"wamid.{second}" for second in range(0, 20, 2)]
+
+
+def test_flush_releases_every_sender_oldest_first():
+    other = dict(record("wamid.other"), **{"from": "14155550199"})
+
+    ready, state = release({}, [(101, record("wamid.1")), (100, other)], 101.5, flush=True)
+
+    assert ready == [other, record("wamid.1")]
+    assert state == {"pending": {}}
+
+
+def test_full_state_releases_oldest_buffers_early():
+    old = dict(record("wamid.old"), **{"from": "14155550199"})
+    new = record("wamid.new", text={"body": "x" * 500})
+
+    ready, state = release({}, [(100, old), (101, new)], 101, max_state_bytes=700)
+
+    assert ready == [old]
+    assert list(state["pending"]) == [f"pn-1#{SENDER}"]
+
+
+def test_next_release_at_is_first_quiet_gap_or_max_wait():
+    _, state = release({}, [(100, record("wamid.1"))], 101)
+    assert next_release_at(state, 101, quiet_gap=3, max_wait=20) == 103
+
+    _, state = release(state, [(119, record("wamid.2"))], 119)
+    assert next_release_at(state, 119, quiet_gap=3, max_wait=20) == 120
+
+    ready, state = release(state, [], next_release_at(state, 119, quiet_gap=3, max_wait=20))
+    assert len(ready) == 2
+    assert next_release_at(state, 120) is None
+
+
+def test_next_release_at_skips_held_senders():
+    held = record("wamid.text", holdUntil=1900, holdToken="wamid.voice")
+    _, state = release({}, [(100, held)], 101, in_flight=lambda sender, token: True)
+
+    assert next_release_at(state, 101) is None
+
+
+def test_held_sender_waits_for_direct_slot():
+    held = record("wamid.text", holdUntil=1900, holdToken="wamid.voice")
+    slot_taken = True
+
+    ready, state = release({}, [(100, held)], 110, in_flight=lambda sender, token: slot_taken)
+    assert ready == []
+
+    slot_taken = False
+    ready, state = release(state, [], 111, in_flight=lambda sender, token: slot_taken)
+    assert ready == [held]
+    assert state == {"pending": {}}
+
+
+def test_held_sender_stays_pending_on_flush():
+    held = record("wamid.text", holdUntil=1900, holdToken="wamid.voice")
+
+    ready, state = release({}, [(100, held)], 101, flush=True, in_flight=lambda sender, token: True)
+
+    assert ready == []
+    assert list(state["pending"]) == [f"pn-1#{SENDER}"]
+
+
+def test_hold_ends_at_hold_until():
+    held = record("wamid.text", holdUntil=105, holdToken="wamid.voice")
+
+    ready, _ = release({}, [(100, held)], 106, in_flight=lambda sender, token: True)
+
+    assert ready == [held]
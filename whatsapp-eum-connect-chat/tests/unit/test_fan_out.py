@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+from tests.unit.lambda_modules import load
+
+fan_out = load("message_aggregator", "fan_out")
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code}}, "Invoke")
+
+
+class Flaky:
+    """Raises the given errors in turn, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.mark.parametrize("error", [
+    client_error("TooManyRequestsException"),
+    client_error("ServiceException"),
+    EndpointConnectionError(endpoint_url="https://lambda.us-east-1.amazonaws.com"),
+    ReadTimeoutError(endpoint_url="https://lambda.us-east-1.amazonaws.com"),
+], ids=["throttled", "service fault", "connection error", "read timeout"])
+def test_retryable_errors_are_retried_with_jitter(error):
+    fn = Flaky(error, error)
+    slept = []
+
+    assert fan_out.call_with_backoff(fn, base_delay=0.2, max_delay=5.0, sleep=slept.append) == "ok"
+
+    assert fn.calls == 3
+    assert 0 <= slept[0] <= 0.2 and 0 <= slept[1] <= 0.4
+
+
+@pytest.mark.parametrize("error", [
+    client_error("ResourceNotFoundException"),
+    client_error("AccessDeniedException"),
+    ValueError("bad payload"),
+], ids=["not found", "access denied", "not a botocore error"])
+def test_other_errors_are_not_retried(error):
+    fn = Flaky(error)
+
+    with pytest.raises(type(error)):
+        fan_out.call_with_backoff(fn, sleep=pytest.fail)
+
+    assert fn.calls == 1
+
+
+def test_last_error_raised_after_max_attempts():
+    fn = Flaky(*[client_error("ThrottlingException")] * 3)
+    slept = []
+
+    with pytest.raises(ClientError):
+        fan_out.call_with_backoff(fn, max_attempts=3, max_delay=0.3, sleep=slept.append)
+
+    assert fn.calls == 3
+    assert len(slept) == 2 and max(slept) <= 0.3
+
+
+def test_fan_out_reports_only_failed_payloads(monkeypatch):
+    monkeypatch.setattr(fan_out.random, "uniform", lambda low, high: 0)
+    attempts = {}
+    lock = threading.Lock()
+
+    def send(payload):
+        with lock:
+            attempts[payload["n"]] = attempts.get(payload["n"], 0) + 1
+        if payload["n"] == 1 and attempts[1] == 1:
+            raise client_error("TooManyRequestsException")
+        if payload["n"] == 2:
+            raise client_error("ResourceNotFoundException")
+
+    payloads = [{"n": n} for n in range(5)]
+    failed = fan_out.fan_out(payloads, send, max_workers=2, max_attempts=3)
+
+    assert [(payload, error.response["Error"]["Code"]) for payload, error in failed] == [({"n": 2}, "ResourceNotFoundException")]
+    assert attempts == {0: 1, 1: 2, 2: 1, 3: 1, 4: 1}
+
+
+def test_fan_out_of_nothing():
+    assert fan_out.fan_out([], pytest.fail) == []
@@ -0,0 +1,80 @@
+import io
+import json
+import logging
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_modules import load
+
+media_store = load("whatsapp_event_handler", "media_store")
+
+
+class FakeS3:
+    """Objects of the bucket, with the IfNoneMatch condition of put_object."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, conflict=None):
+        self.objects = {}
+        # error code of a conditional put racing with another writer
+        self.conflict = conflict
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType, IfNoneMatch=None):
+        if IfNoneMatch == "*" and (Key in self.objects or self.conflict):
+            code = self.conflict or "PreconditionFailed"
+            raise ClientError({"Error": {"Code": code}}, "PutObject")
+        self.objects[Key] = Body
+
+    def record(self, name):
+        return json.loads(self.objects[f"media/{name}.json"])
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(media_store, "get_client", lambda service: s3)
+    return s3
+
+
+def store():
+    return media_store.MediaStore(bucket_name="bucket", prefix="media/", retention_days=30)
+
+
+def test_save_media_indexes_by_id_and_content(s3):
+    store().save_media("m-1", "sha256-abc", {"location": "s3://bucket/m-1.ogg"})
+
+    assert s3.record("by-id/m-1")["location"] == "s3://bucket/m-1.ogg"
+    assert s3.record("by-content/sha256-abc")["location"] == "s3://bucket/m-1.ogg"
+    assert store().find_media("m-2", "sha256-abc")["location"] == "s3://bucket/m-1.ogg"
+
+
+def test_saving_same_content_again_keeps_derived_artifacts(s3, caplog):
+    first = store()
+    first.save_media("m-1", "sha256-abc", {"location": "s3://bucket/m-1.ogg"})
+    first.save_derived("sha256-abc", "wav", "s3://bucket/m-1.wav")
+
+    # a forwarded voice note: new media id, same content
+    with caplog.at_level(logging.WARNING):
+        store().save_media("m-2", "sha256-abc", {"location": "s3://bucket/m-2.ogg"})
+
+    assert s3.record("by-id/m-2")["location"] == "s3://bucket/m-2.ogg"
+    assert s3.record("by-content/sha256-abc")["derived"] == {"wav": "s3://bucket/m-1.wav"}
+    assert caplog.records == []
+
+
+def test_concurrent_content_write_is_not_an_error(s3, caplog):
+    s3.conflict = "ConditionalRequestConflict"
+
+    with caplog.at_level(logging.WARNING):
+        store().save_media("m-1", "sha256-abc", {"location": "s3://bucket/m-1.ogg"})
+
+    assert s3.record("by-id/m-1")["location"] == "s3://bucket/m-1.ogg"
+    assert caplog.records == []
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_modules import load
+
+aggregator = load("message_aggregator")
+
+SENDER = "14155550100"
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeDynamoDB:
+    """Query of the raw table: the sender's messages written after the batch was read."""
+
+    def __init__(self):
+        self.written = []
+        self.queries = []
+
+    def query(self, **kwargs):
+        self.queries.append(kwargs)
+        return {"Items": [{"id": {"S": message_id}} for message_id in self.written]}
+
+
+class FakeLambda:
+    def __init__(self, clock):
+        self.clock = clock
+        self.invoked = []
+        self.error = None
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.error:
+            raise self.error
+        self.invoked.append((self.clock.now, json.loads(Payload)))
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    clock = FakeClock(101)
+    fakes = {"clock": clock, "dynamodb": FakeDynamoDB(), "lambda": FakeLambda(clock)}
+    monkeypatch.setenv("WHATSAPP_EVENT_HANDLER", "handler")
+    monkeypatch.setattr(aggregator, "RAW_MESSAGES_TABLE", "raw")
+    monkeypatch.setattr(aggregator, "time", clock)
+    monkeypatch.setattr(aggregator, "dynamodb", fakes["dynamodb"])
+    monkeypatch.setattr(aggregator, "lambda_client", fakes["lambda"])
+    return fakes
+
+
+def stream_event(*messages, **window):
+    records = [{"eventName": "INSERT", "dynamodb": {"ApproximateCreationDateTime": arrival, "NewImage": {
+        "from": {"S": SENDER},
+        "id": {"S": message_id},
+        "timestamp": {"S": str(arrival)},
+        "type": {"S": "text"},
+        "text": {"M": {"body": {"S": message_id}}},
+        "metadata": {"M": {"phone_number_id": {"S": "pn-1"}}},
+    }}} for arrival, message_id in messages]
+    return dict({"Records": records, "state": {}}, **window)
+
+
+def test_sender_turning_quiet_is_released_before_returning(aws):
+    result = aggregator.lambda_handler(stream_event((100, "wamid.1")), None)
+
+    assert result == {"state": {"pending": {}}, "failedGroups": []}
+    [(at, payload)] = aws["lambda"].invoked
+    assert at == 100 + aggregator.BUFFER_QUIET_GAP_IN_SECONDS
+    assert [m["id"] for m in payload["messages"]] == ["wamid.1"]
+
+
+def test_sender_with_newer_message_in_table_is_kept(aws):
+    aws["dynamodb"].written = ["wamid.1", "wamid.2"]
+
+    result = aggregator.lambda_handler(stream_event((100, "wamid.1")), None)
+
+    assert aws["lambda"].invoked == []
+    assert list(result["state"]["pending"]) == [f"pn-1#{SENDER}"]
+    assert aws["dynamodb"].queries[0]["ExpressionAttributeValues"][":timestamp"] == {"S": "100"}
+
+
+def test_final_invocation_does_not_wait(aws):
+    aggregator.lambda_handler(stream_event((100, "wamid.1"), isFinalInvokeForWindow=True), None)
+
+    assert [at for at, _ in aws["lambda"].invoked] == [101]
+    assert aws["dynamodb"].queries == []
+
+
+def test_groups_not_dispatched_are_returned(aws):
+    aws["lambda"].error = ClientError({"Error": {"Code": "ResourceNotFoundException"}}, "Invoke")
+
+    result = aggregator.lambda_handler(stream_event((100, "wamid.1"), (100, "wamid.2"), isFinalInvokeForWindow=True), None)
+
+    [failed] = result["failedGroups"]
+    assert failed["phone_number_id"] == "pn-1"
+    assert failed["from"] == SENDER
+    assert failed["message_ids"] == ["wamid.2"]
+    assert "ResourceNotFoundException" in failed["error"]
@@ -0,0 +1,194 @@
+import json
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_modules import load
+
+os.environ.setdefault("RAW_MESSAGES_TABLE", "raw")
+on_raw_messages = load("on_raw_messages")
+
+SENDER = "14155550100"
+
+
+def conditional_check_failed():
+    return ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem")
+
+
+class FakeTable:
+    """The #in-flight items, with the conditions of claim_direct and mark_buffered."""
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.in_flight = {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ConditionExpression=None, ReturnValues=None):
+        item = self.in_flight.setdefault(Key["from"], {})
+        values = ExpressionAttributeValues
+        if "directToken" in UpdateExpression:
+            self.calls.append("claim")
+            free = item.get("directUntil", 0) < values[":now"] and item.get("bufferedUntil", 0) < values[":now"]
+            if item.get("directToken") != values[":token"] and not free:
+                raise conditional_check_failed()
+            item.update(directUntil=values[":until"], directToken=values[":token"])
+            return {}
+        self.calls.append("mark_buffered")
+        item["bufferedUntil"] = values[":until"]
+        return {"Attributes": dict(item)}
+
+
+class FakeDynamoDB:
+    def __init__(self, calls, fail_writes=0):
+        self.calls = calls
+        self.fail_writes = fail_writes
+        self.items = {}
+        self.batches = []
+        # batch writes that leave their last item unprocessed
+        self.throttled_writes = 0
+
+    def batch_write_item(self, RequestItems):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            raise RuntimeError("write failed")
+        self.calls.append("write")
+        requests = RequestItems["raw"]
+        keys = [(r["PutRequest"]["Item"]["from"], r["PutRequest"]["Item"]["id"]) for r in requests]
+        assert len(requests) <= 25 and len(set(keys)) == len(keys)
+        self.batches.append(keys)
+        unprocessed = []
+        if self.throttled_writes:
+            self.throttled_writes -= 1
+            requests, unprocessed = requests[:-1], requests[-1:]
+        for request in requests:
+            item = request["PutRequest"]["Item"]
+            self.items[(item["from"], item["id"])] = item
+        return {"UnprocessedItems": {"raw": unprocessed}} if unprocessed else {}
+
+
+class FakeLambda:
+    def __init__(self, calls, fail=0):
+        self.calls = calls
+        self.fail = fail
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("invoke failed")
+        self.calls.append("invoke")
+        self.payloads.append(json.loads(Payload))
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    calls = []
+    fakes = {"table": FakeTable(calls), "dynamodb": FakeDynamoDB(calls), "lambda": FakeLambda(calls), "calls": calls}
+    monkeypatch.setattr(on_raw_messages, "table", fakes["table"])
+    monkeypatch.setattr(on_raw_messages, "dynamodb", fakes["dynamodb"])
+    monkeypatch.setattr(on_raw_messages, "lambda_client", fakes["lambda"])
+    monkeypatch.setattr(on_raw_messages, "INBOUND_ROUTING_MODE", "direct")
+    monkeypatch.setattr(on_raw_messages, "WHATSAPP_EVENT_HANDLER", "handler")
+    monkeypatch.setattr(on_raw_messages, "prefetch_media", lambda items: {})
+    return fakes
+
+
+def make_event(*messages):
+    entry = {"changes": [{"field": "messages", "value": {
+        "messaging_product": "whatsapp",
+        "metadata": {"phone_number_id": "pn-1"},
+        "contacts": [{"profile": {"name": "Ana"}, "wa_id": SENDER}],
+        "messages": [dict(message, **{"from": SENDER, "timestamp": "1700000000"}) for message in messages],
+    }}]}
+    sns = {"context": {}, "whatsAppWebhookEntry": json.dumps(entry)}
+    return {"Records": [{"Sns": {"Message": json.dumps(sns)}}]}
+
+
+VOICE_NOTE = {"id": "wamid.voice", "type": "audio", "audio": {"id": "m-1", "voice": True}}
+TEXT = {"id": "wamid.text", "type": "text", "text": {"body": "hello"}}
+
+
+def test_direct_message_is_invoked_after_it_is_written(aws):
+    on_raw_messages.lambda_handler(make_event(VOICE_NOTE), None)
+
+    assert aws["calls"] == ["claim", "write", "invoke"]
+    assert aws["dynamodb"].items[(SENDER, "wamid.voice")]["routed"] == "direct"
+    assert aws["lambda"].payloads[0]["inFlight"] == {"from": SENDER, "token": "wamid.voice"}
+
+
+def test_text_is_held_behind_direct_message_in_flight(aws):
+    on_raw_messages.lambda_handler(make_event(VOICE_NOTE), None)
+    on_raw_messages.lambda_handler(make_event(TEXT), None)
+
+    text = aws["dynamodb"].items[(SENDER, "wamid.text")]
+    assert "routed" not in text
+    assert text["holdToken"] == "wamid.voice"
+    assert text["holdUntil"] > 0
+
+
+def test_failed_write_is_redelivered_direct_only(aws):
+    aws["dynamodb"].fail_writes = 1
+    with pytest.raises(RuntimeError):
+        on_raw_messages.lambda_handler(make_event(VOICE_NOTE), None)
+    assert aws["lambda"].payloads == []
+
+    on_raw_messages.lambda_handler(make_event(VOICE_NOTE), None)
+
+    assert len(aws["lambda"].payloads) == 1
+    assert aws["dynamodb"].items[(SENDER, "wamid.voice")]["routed"] == "direct"
+
+
+def test_failed_invoke_is_redelivered_direct(aws):
+    aws["lambda"].fail = 1
+    with pytest.raises(RuntimeError):
+        on_raw_messages.lambda_handler(make_event(VOICE_NOTE), None)
+
+    on_raw_messages.lambda_handler(make_event(VOICE_NOTE), None)
+
+    assert [p["inFlight"]["token"] for p in aws["lambda"].payloads] == ["wamid.voice"]
+    assert aws["dynamodb"].items[(SENDER, "wamid.voice")]["routed"] == "direct"
+
+
+def raw_item(message_id, **fields):
+    return dict({"from": SENDER, "id": message_id}, **fields)
+
+
+def test_put_items_keeps_the_last_item_per_key(aws):
+    written = on_raw_messages.put_items([raw_item("a", n=1), raw_item("b"), raw_item("a", n=2), raw_item("a", **{"from": "other"})])
+
+    assert written == 3
+    assert aws["dynamodb"].batches == [[(SENDER, "a"), (SENDER, "b"), ("other", "a")]]
+    assert aws["dynamodb"].items[(SENDER, "a")]["n"] == 2
+
+
+def test_put_items_writes_25_items_per_batch(aws):
+    written = on_raw_messages.put_items([raw_item(f"m-{i}") for i in range(60)])
+
+    assert written == 60
+    assert [len(batch) for batch in aws["dynamodb"].batches] == [25, 25, 10]
+    assert len(aws["dynamodb"].items) == 60
+
+
+def test_unprocessed_items_are_retried_with_backoff(aws, monkeypatch):
+    slept = []
+    monkeypatch.setattr(on_raw_messages.time, "sleep", slept.append)
+    aws["dynamodb"].throttled_writes = 2
+
+    on_raw_messages.put_items([raw_item("a"), raw_item("b"), raw_item("c")])
+
+    assert aws["dynamodb"].batches == [[(SENDER, "a"), (SENDER, "b"), (SENDER, "c")], [(SENDER, "c")], [(SENDER, "c")]]
+    assert len(aws["dynamodb"].items) == 3
+    assert len(slept) == 2
+    assert all(0 <= delay <= 2.0 for delay in slept)
+
+
+def test_still_unprocessed_after_max_attempts_is_an_error(aws, monkeypatch):
+    slept = []
+    monkeypatch.setattr(on_raw_messages.time, "sleep", slept.append)
+    aws["dynamodb"].throttled_writes = 8
+
+    with pytest.raises(RuntimeError, match="1 raw messages still unprocessed after 8 attempts"):
+        on_raw_messages.write_batch([{"PutRequest": {"Item": raw_item("a")}}], max_attempts=8)
+
+    assert len(aws["dynamodb"].batches) == 8
+    assert len(slept) == 7
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code", "whatsapp_event_handler"))
+
+import lambda_function  # noqa: E402
+from whatsapp import WhatsappMessage  # noqa: E402
+
+
+class FailingMediaClient:
+    def get_whatsapp_message_media(self, **kwargs):
+        raise RuntimeError("media unavailable")
+
+
+class FakeConnections:
+    def get_contact(self, customerId):
+        return {"contactId": "c-1", "connectionToken": "token"}
+
+
+class FakeChat:
+    def __init__(self):
+        self.sent = []
+        self.attached = []
+
+    def send_message(self, text, connectionToken):
+        self.sent.append(text)
+
+    def attach_file_with_retry_connection(self, **kwargs):
+        self.attached.append(kwargs)
+        return "attachment-id", None
+
+
+class FakeAcks:
+    def __init__(self):
+        self.reactions = []
+
+    def react(self, message, emoji):
+        self.reactions.append(emoji)
+
+
+def make_message(media_type, fields):
+    message = {"from": "14155550100", "id": "wamid.1", "type": media_type, media_type: fields}
+    phone_number = {"arn": "arn:aws:social-messaging:us-east-1:123456789012:phone-number-id/abc"}
+    return WhatsappMessage(phone_number, message, client=FailingMediaClient())
+
+
+@pytest.mark.parametrize("media_type, fields", [
+    ("image", {"id": "m-1", "mime_type": "image/jpeg"}),
+    ("audio", {"id": "m-2", "mime_type": "audio/ogg; codecs=opus", "voice": True}),
+    ("image", {"id": "m-3"}),
+])
+def test_failed_download_reports_missing_content(media_type, fields):
+    chat, acks = FakeChat(), FakeAcks()
+
+    lambda_function.process_attachment(chat, FakeConnections(), acks, make_message(media_type, fields))
+
+    assert acks.reactions == ["❌"]
+    assert chat.sent == ["Failed to retrieve attachment content"]
+    assert chat.attached == []
+
+
+def test_extension_without_mime_type():
+    assert lambda_function.get_extension_by_file_type(None) == "unknown"
+    assert lambda_function.get_extension_by_file_type("image/png") == "png"
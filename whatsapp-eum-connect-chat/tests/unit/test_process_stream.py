@@ -0,0 +1,104 @@
+import pytest
+
+from tests.unit.lambda_modules import load
+
+process_stream = load("message_aggregator", "process_stream")
+
+
+def test_decodes_every_dynamodb_type():
+    image = {
+        "s": {"S": "hola"},
+        "n": {"N": "42"},
+        "negative": {"N": "-3"},
+        "decimal": {"N": "1.5"},
+        "bool": {"BOOL": False},
+        "null": {"NULL": True},
+        "b": {"B": "aGVsbG8="},
+        "ss": {"SS": ["a", "b"]},
+        "ns": {"NS": ["1", "2.5"]},
+        "bs": {"BS": ["aGVsbG8=", "d29ybGQ="]},
+        "m": {"M": {"inner": {"M": {"list": {"L": [{"N": "1"}, {"S": "x"}, {"M": {"deep": {"BOOL": True}}}]}}}}},
+        "l": {"L": [{"L": [{"NULL": True}]}, {"SS": ["c"]}]},
+    }
+
+    assert process_stream.deserialize_dynamodb(image) == {
+        "s": "hola",
+        "n": 42,
+        "negative": -3,
+        "decimal": 1.5,
+        "bool": False,
+        "null": None,
+        "b": "aGVsbG8=",
+        "ss": ["a", "b"],
+        "ns": [1, 2.5],
+        "bs": ["aGVsbG8=", "d29ybGQ="],
+        "m": {"inner": {"list": [1, "x", {"deep": True}]}},
+        "l": [[None], ["c"]],
+    }
+
+
+def test_map_keys_named_like_type_tags_are_plain_keys():
+    image = {
+        "S": {"N": "1"},
+        "M": {"M": {"S": {"S": "text"}, "L": {"L": [{"S": "item"}]}, "N": {"M": {"NULL": {"NULL": True}}}}},
+    }
+
+    assert process_stream.deserialize_dynamodb(image) == {
+        "S": 1,
+        "M": {"S": "text", "L": ["item"], "N": {"NULL": None}},
+    }
+
+
+def test_unknown_type_is_an_error():
+    with pytest.raises(ValueError, match="Unsupported DynamoDB type: X"):
+        process_stream.decode_value({"X": "1"})
+    with pytest.raises(ValueError, match="Unsupported DynamoDB type: X"):
+        process_stream.deserialize_dynamodb({"nested": {"L": [{"X": "1"}]}})
+    with pytest.raises(ValueError, match="Empty DynamoDB attribute value"):
+        process_stream.decode_value({})
+
+
+def message(message_id, timestamp, sender="14155550100", phone_number_id="pn-1", body=None, type="text"):
+    record = {
+        "from": sender,
+        "id": message_id,
+        "timestamp": str(timestamp),
+        "type": type,
+        "messaging_product": "whatsapp",
+        "metadata": {"phone_number_id": phone_number_id},
+        "contact": {"profile": {"name": "Ana"}, "wa_id": sender},
+    }
+    if type == "text":
+        record["text"] = {"body": body or message_id}
+    else:
+        record[type] = {"id": f"media-{message_id}"}
+    return record
+
+
+def test_out_of_order_records_are_grouped_in_timestamp_order():
+    records = [
+        message("b", 1700000002),
+        message("other", 1700000001, sender="14155550199"),
+        message("a", 1700000001),
+        message("voice", 1700000003, type="audio"),
+        message("c", 1700000004),
+    ]
+
+    groups = process_stream.aggregate_all_messages(records)
+
+    assert [g["contacts"][0]["wa_id"] for g in groups] == ["14155550100", "14155550199"]
+    messages = groups[0]["messages"]
+    # consecutive texts merged once sorted, the voice note keeps its place
+    assert [m["type"] for m in messages] == ["text", "audio", "text"]
+    assert messages[0]["text"] == {"body": "a\nb"}
+    assert messages[0]["id"] == "b"
+    assert messages[2]["text"] == {"body": "c"}
+
+
+def test_same_sender_on_two_business_numbers_is_two_groups():
+    records = [message("a", 1700000001), message("b", 1700000002, phone_number_id="pn-2")]
+
+    groups = process_stream.aggregate_all_messages(records)
+
+    assert [g["metadata"]["phone_number_id"] for g in groups] == ["pn-1", "pn-2"]
+    assert [[m["id"] for m in g["messages"]] for g in groups] == [["a"], ["b"]]
@@ -0,0 +1,208 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_modules import load
+
+# same module in both event handlers
+MODULES = [load("whatsapp_event_handler", "send_rate_limit"), load("connect_event_handler", "send_rate_limit")]
+
+
+@pytest.fixture(params=MODULES, ids=["whatsapp_event_handler", "connect_event_handler"])
+def send_rate_limit(request):
+    return request.param
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code}}, "Operation")
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeDynamoDB:
+    """Bucket items of the connections table, with the conditions of try_take."""
+
+    def __init__(self, error=None):
+        self.items = {}
+        self.error = error
+        # called between the read and the conditional update, as a concurrent sender would
+        self.before_update = None
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        if self.error:
+            raise self.error
+        item = self.items.get(Key["contactId"]["S"])
+        return {"Item": dict(item)} if item else {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        if self.before_update:
+            self.before_update()
+        item = self.items.get(Key["contactId"]["S"])
+        if ConditionExpression == "attribute_not_exists(contactId)":
+            ok = item is None
+        else:
+            ok = item is not None and item["updated"] == ExpressionAttributeValues[":updated"]
+        if not ok:
+            raise client_error("ConditionalCheckFailedException")
+        self.items[Key["contactId"]["S"]] = {
+            "tokens": ExpressionAttributeValues[":tokens"],
+            "updated": ExpressionAttributeValues[":now"],
+        }
+
+
+class FakeWhatsApp:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def send_whatsapp_message(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"messageId": "m-1"}
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.keys = []
+
+    def acquire(self, key):
+        self.keys.append(key)
+
+
+def test_bucket_key_is_the_same_for_id_and_arn(send_rate_limit):
+    assert send_rate_limit.bucket_key("arn:aws:social-messaging:us-east-1:123:phone-number-id/abc") == "phone-number-id-abc"
+    assert send_rate_limit.bucket_key("phone-number-id-abc") == "phone-number-id-abc"
+
+
+def test_local_bucket_spends_burst_then_paces(send_rate_limit, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(send_rate_limit, "time", clock)
+    bucket = send_rate_limit.LocalTokenBucket(rate=10, burst=2)
+
+    assert [bucket.reserve("pn") for _ in range(4)] == pytest.approx([0, 0, 0.1, 0.2])
+    # other numbers have their own bucket
+    assert bucket.reserve("other") == 0
+
+    clock.now += 1
+    assert bucket.reserve("pn") == 0
+
+
+def test_local_acquire_sleeps_at_most_max_wait(send_rate_limit, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(send_rate_limit, "time", clock)
+    bucket = send_rate_limit.LocalTokenBucket(rate=1, burst=1)
+    slept = []
+
+    # ten concurrent senders: the clock does not move while they wait
+    waits = [bucket.acquire("pn", max_wait=5, sleep=slept.append) for _ in range(10)]
+
+    assert waits == pytest.approx(list(range(10)))
+    assert slept == pytest.approx([1, 2, 3, 4, 5, 5, 5, 5, 5])
+
+
+def test_shared_bucket_takes_tokens_until_empty(send_rate_limit):
+    dynamodb = FakeDynamoDB()
+    bucket = send_rate_limit.SharedTokenBucket(table_name="connections", rate=10, burst=2, client=dynamodb)
+
+    assert bucket.try_take("pn", 1000.0) == 0
+    assert bucket.try_take("pn", 1000.0) == 0
+    assert bucket.try_take("pn", 1000.0) == pytest.approx(0.1)
+    assert float(dynamodb.items["ratelimit#pn"]["tokens"]["N"]) == pytest.approx(0)
+
+    # refilled at the configured rate
+    assert bucket.try_take("pn", 1000.1) == 0
+
+
+def test_shared_bucket_counts_again_when_another_sender_took_a_token(send_rate_limit):
+    dynamodb = FakeDynamoDB()
+    bucket = send_rate_limit.SharedTokenBucket(table_name="connections", rate=10, burst=5, client=dynamodb)
+    bucket.try_take("pn", 1000.0)
+
+    def concurrent_take():
+        dynamodb.before_update = None
+        bucket.try_take("pn", 1000.001)
+
+    dynamodb.before_update = concurrent_take
+    wait = bucket.try_take("pn", 1000.002)
+
+    assert 0 < wait <= 0.015
+    # only the concurrent sender's token was taken
+    assert dynamodb.items["ratelimit#pn"]["updated"] == {"N": "1000001"}
+
+
+def test_shared_bucket_raises_other_update_errors(send_rate_limit):
+    dynamodb = FakeDynamoDB()
+    bucket = send_rate_limit.SharedTokenBucket(table_name="connections", rate=10, burst=5, client=dynamodb)
+
+    def throttled():
+        raise client_error("ProvisionedThroughputExceededException")
+
+    dynamodb.before_update = throttled
+    with pytest.raises(ClientError):
+        bucket.try_take("pn", 1000.0)
+
+
+def test_shared_acquire_waits_for_tokens_then_gives_up(send_rate_limit, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(send_rate_limit, "time", clock)
+    bucket = send_rate_limit.SharedTokenBucket(table_name="connections", rate=1, burst=1, client=FakeDynamoDB())
+
+    assert bucket.acquire("pn", max_wait=5, sleep=clock.sleep) == 0
+    assert bucket.acquire("pn", max_wait=5, sleep=clock.sleep) == pytest.approx(1)
+    assert bucket.acquire("pn", max_wait=0.5, sleep=clock.sleep) == pytest.approx(0.5)
+
+
+def test_shared_acquire_never_blocks_a_send(send_rate_limit):
+    bucket = send_rate_limit.SharedTokenBucket(
+        table_name="connections", rate=1, burst=1, client=FakeDynamoDB(error=RuntimeError("table unavailable")))
+
+    assert bucket.acquire("pn", max_wait=5, sleep=pytest.fail) == 0
+
+
+def test_send_retries_throttling_with_a_token_per_attempt(send_rate_limit, monkeypatch):
+    limiter = FakeLimiter()
+    monkeypatch.setattr(send_rate_limit, "limiter", limiter)
+    client = FakeWhatsApp(client_error("ThrottlingException"), client_error("TooManyRequestsException"))
+    slept = []
+
+    response = send_rate_limit.send_whatsapp_message(
+        client, base_delay=0.5, max_delay=8.0, sleep=slept.append, originationPhoneNumberId="phone-number-id/abc")
+
+    assert response == {"messageId": "m-1"}
+    assert client.calls == 3
+    assert limiter.keys == ["phone-number-id-abc"] * 3
+    # full jitter under the exponential cap
+    assert 0 <= slept[0] <= 0.5 and 0 <= slept[1] <= 1.0
+
+
+def test_send_raises_after_max_attempts(send_rate_limit, monkeypatch):
+    monkeypatch.setattr(send_rate_limit, "limiter", None)
+    client = FakeWhatsApp(*[client_error("ThrottledRequestException")] * 3)
+    slept = []
+
+    with pytest.raises(ClientError):
+        send_rate_limit.send_whatsapp_message(client, max_attempts=3, sleep=slept.append, originationPhoneNumberId="pn")
+
+    assert client.calls == 3
+    assert len(slept) == 2
+
+
+def test_send_does_not_retry_other_errors(send_rate_limit, monkeypatch):
+    monkeypatch.setattr(send_rate_limit, "limiter", None)
+    client = FakeWhatsApp(client_error("ValidationException"))
+
+    with pytest.raises(ClientError):
+        send_rate_limit.send_whatsapp_message(client, sleep=pytest.fail, originationPhoneNumberId="pn")
+
+    assert client.calls == 1
@@ -0,0 +1,30 @@
+from tests.unit.lambda_modules import load
+
+connections_service = load("whatsapp_event_handler", "connections_service")
+
+CONNECTION = {"contactId": "c-1", "connectionToken": "token"}
+
+
+def test_stats_reset_after_logging():
+    cache = connections_service.SessionCache(ttl_seconds=30)
+    cache.put("14155550100", CONNECTION)
+    cache.get("14155550100")
+    cache.get("14155550199")
+
+    assert cache.stats(reset=True) == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+    # the next invocation of a warm container only counts its own lookups
+    cache.get("14155550100")
+    assert cache.stats() == {"hits": 1, "misses": 0, "hit_rate": 1.0}
+    assert cache.stats() == {"hits": 1, "misses": 0, "hit_rate": 1.0}
+
+
+def test_invalidate_contact_drops_its_sessions():
+    cache = connections_service.SessionCache()
+    cache.put("14155550100", CONNECTION)
+    cache.put("14155550199", None)
+
+    cache.invalidate_contact("c-1")
+
+    assert cache.get("14155550100") is connections_service.MISS
+    assert cache.get("14155550199") is None
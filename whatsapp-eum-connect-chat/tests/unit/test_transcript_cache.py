@@ -0,0 +1,120 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code", "transcribe_audio"))
+
+from transcript_cache import TranscriptCache, audio_fingerprint  # noqa: E402
+
+
+class FakeTable:
+    def __init__(self, fail=False):
+        self.items = {}
+        self.fail = fail
+
+    def get_item(self, Key):
+        if self.fail:
+            raise RuntimeError("table unavailable")
+        item = self.items.get((Key["fingerprint"], Key["languageCode"]))
+        return {"Item": item} if item else {}
+
+    def put_item(self, Item):
+        if self.fail:
+            raise RuntimeError("table unavailable")
+        self.items[(Item["fingerprint"], Item["languageCode"])] = Item
+
+
+class FakeTranscriber:
+    def __init__(self, transcript="hola mundo", error=None):
+        self.transcript = transcript
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.transcript
+
+
+def transcribe(cache, transcriber, fingerprint="etag-abc", language_code="es-US"):
+    return asyncio.run(cache.get_or_transcribe(fingerprint, language_code, transcriber))
+
+
+def test_miss_transcribes_and_stores_with_ttl():
+    table = FakeTable()
+    cache = TranscriptCache(table=table, ttl_seconds=60)
+    transcriber = FakeTranscriber()
+
+    assert transcribe(cache, transcriber) == "hola mundo"
+    assert transcriber.calls == 1
+    item = table.items[("etag-abc", "es-US")]
+    assert item["transcript"] == "hola mundo"
+    assert time.time() < item["expires"] <= time.time() + 60
+
+
+def test_hit_does_not_start_a_stream():
+    cache = TranscriptCache(table=FakeTable())
+    transcribe(cache, FakeTranscriber())
+
+    transcriber = FakeTranscriber("other")
+    assert transcribe(cache, transcriber) == "hola mundo"
+    assert transcriber.calls == 0
+
+
+def test_language_code_is_part_of_the_key():
+    cache = TranscriptCache(table=FakeTable())
+    transcribe(cache, FakeTranscriber(), language_code="es-US")
+
+    transcriber = FakeTranscriber("hello world")
+    assert transcribe(cache, transcriber, language_code="en-US") == "hello world"
+    assert transcriber.calls == 1
+
+
+def test_expired_item_is_a_miss():
+    table = FakeTable()
+    cache = TranscriptCache(table=table)
+    table.put_item({"fingerprint": "etag-abc", "languageCode": "es-US", "transcript": "old", "expires": int(time.time()) - 1})
+
+    transcriber = FakeTranscriber()
+    assert transcribe(cache, transcriber) == "hola mundo"
+    assert transcriber.calls == 1
+
+
+def test_failed_or_empty_transcription_is_not_cached():
+    table = FakeTable()
+    cache = TranscriptCache(table=table)
+
+    with pytest.raises(RuntimeError):
+        transcribe(cache, FakeTranscriber(error=RuntimeError("stream failed")))
+    transcribe(cache, FakeTranscriber(""))
+
+    assert table.items == {}
+
+
+def test_no_fingerprint_or_no_table_bypasses_the_cache():
+    table = FakeTable()
+    transcriber = FakeTranscriber()
+    transcribe(TranscriptCache(table=table), transcriber, fingerprint=None)
+    transcribe(TranscriptCache(table=None, table_name=None), transcriber)
+
+    assert transcriber.calls == 2
+    assert table.items == {}
+
+
+def test_table_errors_fall_back_to_transcribing():
+    transcriber = FakeTranscriber()
+    assert transcribe(TranscriptCache(table=FakeTable(fail=True)), transcriber) == "hola mundo"
+    assert transcriber.calls == 1
+
+
+def test_fingerprint_is_the_object_etag():
+    class FakeS3:
+        def head_object(self, Bucket, Key):
+            assert (Bucket, Key) == ("bucket", "attachment_1.ogg")
+            return {"ETag": '"9b2cf535f27731c974343645a3985328"'}
+
+    assert audio_fingerprint(FakeS3(), "bucket", "attachment_1.ogg") == "etag-9b2cf535f27731c974343645a3985328"
@@ -3,12 +3,13 @@ from aws_cdk import (
     RemovalPolicy,     aws_ssm as ssm,
 
     aws_s3 as s3, Stack, CfnOutput, 
-    aws_iam as iam, Duration, aws_lambda_event_sources as event_sources, aws_lambda
+    aws_iam as iam, Duration, aws_lambda_event_sources as event_sources, aws_lambda, aws_sqs as sqs
 )
 
 from constructs import Construct
 
 from lambdas import Lambdas
+from lambdas.project_lambdas import LAMBDA_TIMEOUT
 from topic import Topic
 from databases import Tables
 import config
@@ -26,6 +27,7 @@ class WhatsappEndUserMessagingConnectChatStack(Stack):
     def create_resources(self):
 
         buffer_seconds = Duration.seconds(config.BUFFER_IN_SECONDS) 
+        quiet_gap_seconds = Duration.seconds(config.BUFFER_QUIET_GAP_IN_SECONDS)
 
         self.lambda_functions = Lambdas(self, "L")
         self.tables = Tables(self, "T")
@@ -40,19 +42,66 @@ class WhatsappEndUserMessagingConnectChatStack(Stack):
                 starting_position=aws_lambda.StartingPosition.TRIM_HORIZON, 
                 tumbling_window = buffer_seconds,
                 batch_size=1000, 
-                max_batching_window = buffer_seconds)
+                # invoked every quiet gap while messages flow, senders are released from there
+                max_batching_window = quiet_gap_seconds)
+        )
+
+        # agent records are relayed by connect_event_handler to this queue, one message group per contact,
+        # and processed from it one contact batch at a time (a poison record ends in the dead letter queue)
+        queue_config = dict(fifo=True, enforce_ssl=True, encryption=sqs.QueueEncryption.SQS_MANAGED)
+        self.contact_queue = sqs.Queue(
+            self, "ContactQueue",
+            visibility_timeout=Duration.seconds(LAMBDA_TIMEOUT),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=5,
+                queue=sqs.Queue(self, "ContactDLQ", retention_period=Duration.days(14), **queue_config)),
+            **queue_config)
+        self.lambda_functions.connect_event_handler.add_event_source(
+            event_sources.SqsEventSource(self.contact_queue, batch_size=10, report_batch_item_failures=True)
         )
-        
-        self.s3_bucket = s3.Bucket(self, "S3", removal_policy=RemovalPolicy.DESTROY)
+
+        # inbound media, its converted versions and the media store index expire together
+        retention = [
+            s3.LifecycleRule(prefix=prefix, expiration=Duration.days(config.MEDIA_RETENTION_DAYS))
+            for prefix in ("attachment_", "media/")
+        ] if config.MEDIA_RETENTION_DAYS else None
+        self.s3_bucket = s3.Bucket(self, "S3", removal_policy=RemovalPolicy.DESTROY, lifecycle_rules=retention)
 
         CfnOutput(self, "TopicArn", value=self.topic_messages_in.topic.topic_arn)
 
 
     def set_up_env_vars(self):
         self.lambda_functions.message_aggregator.add_environment(key="WHATSAPP_EVENT_HANDLER", value=self.lambda_functions.whatsapp_event_handler.function_arn)
+        self.lambda_functions.message_aggregator.add_environment(key="FAN_OUT_MAX_WORKERS", value=str(config.AGGREGATOR_MAX_CONCURRENCY))
+        self.lambda_functions.message_aggregator.add_environment(key="BUFFER_IN_SECONDS", value=str(config.BUFFER_IN_SECONDS))
+        self.lambda_functions.message_aggregator.add_environment(key="BUFFER_QUIET_GAP_IN_SECONDS", value=str(config.BUFFER_QUIET_GAP_IN_SECONDS))
+        self.lambda_functions.message_aggregator.add_environment(key="RAW_MESSAGES_TABLE", value=self.tables.raw_messages.table_name)
         self.lambda_functions.on_raw_messages.add_environment(key="RAW_MESSAGES_TABLE", value=self.tables.raw_messages.table_name)
+        self.lambda_functions.on_raw_messages.add_environment(key="INBOUND_ROUTING_MODE", value=config.INBOUND_ROUTING_MODE)
+        self.lambda_functions.on_raw_messages.add_environment(key="WHATSAPP_EVENT_HANDLER", value=self.lambda_functions.whatsapp_event_handler.function_arn)
+        self.lambda_functions.on_raw_messages.add_environment(key="BUFFER_IN_SECONDS", value=str(config.BUFFER_IN_SECONDS))
+        self.lambda_functions.on_raw_messages.add_environment(key="DIRECT_IN_FLIGHT_SECONDS", value=str(config.DIRECT_IN_FLIGHT_SECONDS))
+        self.lambda_functions.on_raw_messages.add_environment(key="PREFETCH_MAX_WORKERS", value=str(config.PREFETCH_MEDIA_MAX_WORKERS))
+        self.lambda_functions.on_raw_messages.add_environment(key="BUCKET_NAME", value=self.s3_bucket.bucket_name)
+        self.lambda_functions.on_raw_messages.add_environment(key="MEDIA_RETENTION_DAYS", value=str(config.MEDIA_RETENTION_DAYS))
         self.lambda_functions.whatsapp_event_handler.add_environment(key="CONVERT_WAV_HANDLER", value=self.lambda_functions.convert_to_wav.function_arn)
         self.lambda_functions.whatsapp_event_handler.add_environment(key="TRANSCRIBE_HANDLER", value=self.lambda_functions.transcribe_audio.function_arn)
+        self.lambda_functions.whatsapp_event_handler.add_environment(key="TRANSCRIPTION_WORKERS", value=str(config.TRANSCRIPTION_WORKERS))
+        self.lambda_functions.whatsapp_event_handler.add_environment(key="RAW_MESSAGES_TABLE", value=self.tables.raw_messages.table_name)
+        self.lambda_functions.whatsapp_event_handler.add_environment(key="SESSION_CACHE_TTL_SECONDS", value=str(config.SESSION_CACHE_TTL_SECONDS))
+        self.lambda_functions.whatsapp_event_handler.add_environment(key="ATTACHMENT_TRANSFER_MODE", value=config.ATTACHMENT_TRANSFER_MODE)
+        self.lambda_functions.whatsapp_event_handler.add_environment(key="AUDIO_CONVERSION_MODE", value=config.AUDIO_CONVERSION_MODE)
+        self.lambda_functions.convert_to_wav.add_environment(key="CONVERSION_MODE", value=config.CONVERT_WAV_MODE)
+        self.lambda_functions.connect_event_handler.add_environment(key="CONTACT_QUEUE_URL", value=self.contact_queue.queue_url)
+        self.lambda_functions.connect_event_handler.add_environment(key="CONTACT_CACHE_TTL_SECONDS", value=str(config.CONTACT_CACHE_TTL_SECONDS))
+        self.lambda_functions.connect_event_handler.add_environment(key="CONTACT_CACHE_NEGATIVE_TTL_SECONDS", value=str(config.CONTACT_CACHE_NEGATIVE_TTL_SECONDS))
+        self.lambda_functions.connect_event_handler.add_environment(key="CONTACT_CACHE_MAX_ENTRIES", value=str(config.CONTACT_CACHE_MAX_ENTRIES))
+        self.lambda_functions.connect_event_handler.add_environment(key="ATTACHMENT_MAX_WORKERS", value=str(config.OUTBOUND_ATTACHMENT_CONCURRENCY))
+        self.lambda_functions.connect_event_handler.add_environment(key="OUTBOUND_MEDIA_CACHE_DAYS", value=str(config.OUTBOUND_MEDIA_CACHE_DAYS))
+        self.lambda_functions.whatsapp_event_handler.add_environment(key="MEDIA_RETENTION_DAYS", value=str(config.MEDIA_RETENTION_DAYS))
+        if config.TRANSCRIPT_CACHE_TTL_DAYS:
+            self.lambda_functions.transcribe_audio.add_environment(key="TRANSCRIPT_CACHE_TABLE", value=self.tables.transcripts.table_name)
+            self.lambda_functions.transcribe_audio.add_environment(key="TRANSCRIPT_CACHE_TTL_SECONDS", value=str(config.TRANSCRIPT_CACHE_TTL_DAYS * 86400))
 
         for l in [self.lambda_functions.whatsapp_event_handler,  self.lambda_functions.connect_event_handler]:
             l.add_environment(key="META_API_VERSION", value=config.META_API_VERSION)
@@ -61,16 +110,23 @@ class WhatsappEndUserMessagingConnectChatStack(Stack):
             l.add_environment(key="VOICE_PREFIX", value="voice_")
             l.add_environment(key="TOPIC_ARN", value=self.topic_messages_out.topic.topic_arn)
             l.add_environment(key="CONFIG_PARAM_NAME", value=config.CONFIG_PARAM_NAME)
+            l.add_environment(key="SEND_RATE_LIMIT_MODE", value=config.SEND_RATE_LIMIT_MODE)
+            l.add_environment(key="SEND_RATE_PER_SECOND", value=str(config.SEND_RATE_PER_SECOND))
+            l.add_environment(key="SEND_RATE_BURST", value=str(config.SEND_RATE_BURST))
 
 
     def set_up_permissions(self):
         self.tables.raw_messages.grant_read_write_data(self.lambda_functions.on_raw_messages)
         self.tables.raw_messages.grant_read_write_data(self.lambda_functions.message_aggregator)
+        self.tables.raw_messages.grant_write_data(self.lambda_functions.whatsapp_event_handler)
 
         self.tables.active_connections.grant_read_write_data(self.lambda_functions.whatsapp_event_handler)
         self.tables.active_connections.grant_read_write_data(self.lambda_functions.connect_event_handler)
+        self.contact_queue.grant_send_messages(self.lambda_functions.connect_event_handler)
+        self.tables.transcripts.grant_read_write_data(self.lambda_functions.transcribe_audio)
 
         self.lambda_functions.whatsapp_event_handler.grant_invoke(self.lambda_functions.message_aggregator)
+        self.lambda_functions.whatsapp_event_handler.grant_invoke(self.lambda_functions.on_raw_messages)
         self.lambda_functions.convert_to_wav.grant_invoke(self.lambda_functions.whatsapp_event_handler)
         self.lambda_functions.transcribe_audio.grant_invoke(self.lambda_functions.whatsapp_event_handler)
 
@@ -87,14 +143,22 @@ class WhatsappEndUserMessagingConnectChatStack(Stack):
             ],
         )
 
+        outbound_media_policy = iam.PolicyStatement(
+            actions=["social-messaging:PostWhatsAppMessageMedia"],
+            resources=[ f"arn:aws:social-messaging:{self.region}:{self.account}:phone-number-id/*"])
+
         transcribe_policy = iam.PolicyStatement(actions=["transcribe:Start*"], resources=["*"])
 
         self.lambda_functions.connect_event_handler.add_to_role_policy(eum_policy)
+        self.lambda_functions.connect_event_handler.add_to_role_policy(outbound_media_policy)
         self.lambda_functions.whatsapp_event_handler.add_to_role_policy(eum_policy)
+        self.lambda_functions.on_raw_messages.add_to_role_policy(eum_policy)
         self.lambda_functions.whatsapp_event_handler.add_to_role_policy(amazon_connect_policy)
         self.lambda_functions.transcribe_audio.add_to_role_policy(transcribe_policy)
 
         self.s3_bucket.grant_read_write(self.lambda_functions.whatsapp_event_handler)
+        self.s3_bucket.grant_read_write(self.lambda_functions.on_raw_messages)
+        self.s3_bucket.grant_read_write(self.lambda_functions.connect_event_handler)
         self.s3_bucket.grant_read_write(self.lambda_functions.convert_to_wav)
         self.s3_bucket.grant_read(self.lambda_functions.transcribe_audio)
 